@@ -1,19 +1,26 @@
 #!/usr/bin/env python
 """
-Create an empty blackboard table in whatever database is defined in owlrc.
+Create an empty blackboard table (and its blackboard_summary projection) in
+whatever database is defined in owlrc. If the blackboard table already exists,
+add whatever index it is missing and (re)build the content of
+blackboard_summary from it. It is therefore safe to run this script again after
+upgrading OWL.
 
 Usage:
     shell> blackboard-init.py
 """
 import elixir
 
-from owl.config import DATABASE_CONNECTION_STR
-from owl.blackboard import *
+from owl import blackboard
 
 
 
-# Init the blackboard database.
-elixir.metadata.bind = DATABASE_CONNECTION_STR
-elixir.metadata.bind.echo = False
-elixir.setup_all()
+# Init the blackboard database: create the missing tables first and then the
+# indexes of the tables which were already there.
+blackboard._connect()
 elixir.create_all()
+for name in blackboard.createIndexes():
+    print('Created index %s' % (name))
+
+# Fill the summary table (this only matters for pre-existing blackboards).
+blackboard.rebuildSummary()
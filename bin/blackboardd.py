@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+"""
+OWL Blackboard Writer Daemon
+
+Introduction
+This long-lived daemon writes Blackboard entries on behalf of the OWL Condor job
+hooks (see owl_job_hook.py). Without it, each hook invocation has to start a
+Python interpreter, import the ORM, setup the table mappings and open a brand
+new database connection, just to write a single row. The daemon does all of that
+only once, keeps its database connection(s) open and commits the events it
+receives in batches.
+
+Usage
+It is assumed that this daemon is started and kept alive by the local Condor
+Master on each execute node. owl_job_hook.py forwards the raw job ClassAd (and
+its role) to the daemon over a Unix socket and waits for the daemon to confirm
+that the corresponding database transaction has been committed. If the daemon
+is not running, owl_job_hook.py falls back to writing to the database itself.
+
+Installation
+Define the daemon in the local Condor configuration and add it to DAEMON_LIST
+therein. For instance (in /etc/condor/condor_config.local):
+    BLACKBOARDD = /usr/local/bin/blackboardd.py
+    DAEMON_LIST   = MASTER, COLLECTOR, NEGOTIATOR, STARTD, SCHEDD, BLACKBOARDD
+The socket (see the [Blackboardd] section in owlrc) is only accessible to the
+daemon user and to the members of socket_group, which therefore has to include
+the user Condor runs the job hooks as.
+
+Protocol
+Clients connect to the Unix socket and send a single JSON string of the form
+    "[hook role, raw job ClassAd]"
+followed by a newline. The daemon replies with the JSON string "true" (followed
+by a newline) if the event was committed to the database, "false" otherwise and
+then closes the connection.
+"""
+import asyncore
+import asynchat
+import grp
+import json
+import logging
+import os
+import socket
+import sys
+import time
+
+import elixir
+
+import owl.condorutils as condor
+from owl import blackboard
+
+
+
+# Constants
+HEARTBEAT_TIMEOUT = 10
+# Permissions of the Unix socket and of the directory containing it.
+SOCKET_MODE = 0660
+SOCKET_DIR_MODE = 0750
+
+
+
+def _group_id(group, logger):
+    """
+    Return the numeric id of the group called `group` or -1 (meaning "leave the
+    group alone") if `group` is empty or unknown.
+    """
+    if(not group):
+        return(-1)
+    try:
+        return(grp.getgrnam(group).gr_gid)
+    except KeyError:
+        logger.warn('Warning: unknown socket group %s: only the daemon ' \
+                    % (group) + 'user will be able to connect.')
+    return(-1)
+
+
+def _make_socket_dir(path, gid):
+    """
+    Create the directory `path` (owned by the daemon user and by group `gid`)
+    that holds the daemon socket, unless it already exists. Refuse to use an
+    existing directory that somebody else owns.
+    """
+    if(not os.path.isdir(path)):
+        os.makedirs(path, SOCKET_DIR_MODE)
+        os.chown(path, -1, gid)
+        os.chmod(path, SOCKET_DIR_MODE)
+    elif(os.stat(path).st_uid != os.getuid()):
+        raise(RuntimeError('%s is not owned by the daemon user.' % (path)))
+    return
+
+
+
+class RequestHandler(asynchat.async_chat):
+    """
+    Handle the communication with a single job hook.
+    """
+    # asynchat.async_chat has a lot of publich methods, nothing we can do about
+    # that, hence:
+    # pylint: disable=R0904
+    def __init__(self, request, daemon, logger):
+        asynchat.async_chat.__init__(self, request)
+        self.set_terminator('\n')
+
+        self.indata = ''
+        self.request = request
+        self.daemon = daemon
+        self._logger = logger
+        return
+
+    def collect_incoming_data(self, data):
+        """
+        This gets called for us when there is new data on the wire. We simply
+        append the additional data to whatever we already have in self.indata.
+        """
+        self.indata += data
+        return
+
+    def found_terminator(self):
+        """
+        This gets called every time the client send us a terminator char. We
+        hand the event (encoded in self.indata) to the daemon, which will reply
+        once the event has been committed to the database.
+        """
+        try:
+            (role, job_ad) = json.loads(self.indata)
+        except:
+            self._logger.warn('Warning: ignored malformed event %s' \
+                              % (str(self.indata[:80])))
+            self.indata = ''
+            self.reply(False)
+            return
+        self.indata = ''
+
+        if(role not in blackboard.HOOK_ROLES):
+            self._logger.warn('Warning: ignored unsupported hook role %s' \
+                              % (str(role)))
+            self.reply(False)
+            return
+
+        self.daemon.enqueue(role, job_ad, self.reply)
+        return
+
+    def reply(self, ok):
+        """
+        Tell the client whether or not its event was committed.
+        """
+        self.push(json.dumps(bool(ok)) + '\n')
+        self.close_when_done()
+        return
+
+
+class EventMonitor(asyncore.dispatcher):
+    """
+    Listen on the Unix socket for incoming job hook connections.
+    """
+    # asyncore.dispatcher has a lot of publich methods, nothing we can do about
+    # that, hence:
+    # pylint: disable=R0904
+    def __init__(self, socket_path, daemon, logger, socket_group=None):
+        asyncore.dispatcher.__init__(self)
+
+        self.daemon = daemon
+        self._logger = logger
+
+        # Only the daemon user and the members of socket_group (i.e. the user
+        # Condor runs the job hooks as) can reach the socket: whoever can
+        # connect can write arbitrary rows into the Blackboard.
+        gid = _group_id(socket_group, logger)
+        _make_socket_dir(os.path.dirname(os.path.abspath(socket_path)), gid)
+
+        # Remove any stale socket file from a previous run.
+        if(os.path.exists(socket_path)):
+            os.remove(socket_path)
+
+        # Start the actual service. Create the socket with restricted
+        # permissions right away rather than fixing them up after bind().
+        self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0117)
+        try:
+            self.bind(socket_path)
+        finally:
+            os.umask(old_umask)
+        os.chown(socket_path, -1, gid)
+        os.chmod(socket_path, SOCKET_MODE)
+        self.listen(1000)
+
+        self._logger.debug('Listening on %s.' % (socket_path))
+        return
+
+    def handle_accept(self):
+        """
+        Called after a connect() has been called by the remote client to the
+        local endpoint. We are ready to read data over the socket.
+        """
+        pair = self.accept()
+        if(pair is None):
+            return
+
+        RequestHandler(request=pair[0], daemon=self.daemon, logger=self._logger)
+        return
+
+
+class Daemon(object):
+    """
+    OWL Blackboard Writer Daemon
+
+    It does two things:
+        1. Listens on a Unix socket for job hook events, writes them to the
+           Blackboard in batches (one transaction per batch) and tells each
+           client once its event has been committed.
+        2. Sends keepalive messages to the Condor Master (is present).
+    """
+    def __init__(self, socket_path, heartbeat_timeout, logger, batch_size=100,
+                 flush_interval=.05, socket_group=None):
+        """
+        Initialize a Blackboard Writer Daemon.
+
+            socket_path: path of the Unix socket to listen on - string
+            socket_group: name of the group allowed to connect to the socket
+                (e.g. condor); if None only the daemon user can - string
+            heartbeat_timeout: the number of seconds to wait before sending out
+                a heartbeat signal (to the Condor Master) - float
+            logger: a (required) logging.logger instance.
+            batch_size: the maximum number of events to commit in a single
+                transaction - integer
+            flush_interval: the maximum number of seconds an event can wait
+                before being committed - float
+        """
+        self._logger = logger
+
+        # Send a heartbeat every heartbeat_timeout seconds.
+        self.hb_timeout = heartbeat_timeout
+
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+
+        # Events waiting to be committed: [(role, job_ad, callback), ...] as
+        # well as the time the oldest one arrived.
+        self._pending = []
+        self._oldest = None
+
+        self._logger.info('Blackboardd initialized.')
+
+        # Monitor for hook events.
+        self.event_monitor = EventMonitor(socket_path=socket_path,
+                                          daemon=self,
+                                          logger=self._logger,
+                                          socket_group=socket_group)
+        return
+
+    def enqueue(self, role, job_ad, callback):
+        """
+        Schedule the hook event (`role`, `job_ad`) for the next batch. Invoke
+        `callback` with a boolean success flag once the batch has been written.
+        """
+        if(not self._pending):
+            self._oldest = time.time()
+        self._pending.append((role, job_ad, callback))
+        return
+
+    def run(self, timeout=1.):
+        """
+        Sit is an infinite loop waiting for events to write to the Blackboard.
+        """
+        asyncmap = asyncore.socket_map
+
+        last_heartbeat = 0
+        pid = os.getpid()
+        while(True):
+            # Do not wait longer than the oldest pending event can afford.
+            poll_timeout = timeout
+            if(self._pending):
+                poll_timeout = max(0., self._oldest + self.flush_interval -
+                                   time.time())
+
+            # Poll the sockets.
+            asyncore.poll(poll_timeout, asyncmap)
+
+            # Commit the pending events if the batch is full or old enough.
+            if(self._pending and
+               (len(self._pending) >= self.batch_size or
+                time.time() - self._oldest >= self.flush_interval)):
+                self._flush()
+
+            # Do we need to send a heartbeat?
+            now = time.time()
+            if(now - last_heartbeat >= self.hb_timeout):
+                condor.send_alive(pid, 3 * self.hb_timeout)
+                last_heartbeat = now
+        return
+
+    def _flush(self):
+        """
+        Write all pending events to the Blackboard in a single transaction (see
+        blackboard.ingestMany). If that fails, write them one by one so that a
+        single bad event does not take the whole batch down with it.
+        """
+        events = self._pending
+        self._pending = []
+        self._oldest = None
+
+        try:
+            blackboard.ingestMany([(role, job_ad)
+                                   for (role, job_ad, _) in events])
+        except:
+            self._logger.exception('Batch of %d events failed: retrying ' \
+                                   % (len(events)) + 'them one by one.')
+            elixir.session.rollback()
+        else:
+            self._logger.debug('Committed %d events.' % (len(events)))
+            for (_, _, callback) in events:
+                callback(True)
+            return
+
+        for (role, job_ad, callback) in events:
+            try:
+                blackboard.processHookEvent(role, job_ad, commit=True)
+            except:
+                self._logger.exception('Error processing %s event.' % (role))
+                elixir.session.rollback()
+                callback(False)
+            else:
+                callback(True)
+        return
+
+    def stop(self):
+        """
+        Cleanup and quit.
+        """
+        self._logger.info('Blackboardd stopping.')
+        if(self._pending):
+            self._flush()
+        logging.shutdown()
+        return
+
+
+
+
+if(__name__ == '__main__'):
+    from owl import config
+    from owl import utils
+
+
+    # Where are we supposed to write logs and which logging level should we use?
+    log_file_name = os.path.join(config.LOGGING_LOG_DIR,
+                                 config.BLACKBOARDD_LOG_NAME)
+    logger = utils.get_logger(file_name=log_file_name,
+                              verbosity=config.LOGGING_LOG_LEVEL)
+    logger.info('OWL Configuration: ' + \
+                '; '.join(config.CONFIG_TEXT.split('\n')))
+
+    daemon = Daemon(socket_path=config.BLACKBOARDD_SOCKET,
+                    socket_group=config.BLACKBOARDD_SOCKET_GROUP,
+                    heartbeat_timeout=HEARTBEAT_TIMEOUT,
+                    batch_size=int(config.BLACKBOARDD_BATCH_SIZE),
+                    flush_interval=float(config.BLACKBOARDD_FLUSH_INTERVAL),
+                    logger=logger)
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        daemon.stop()
+    sys.exit(0)
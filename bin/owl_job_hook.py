@@ -14,14 +14,24 @@ JobStartDate, RemoteSysCpu, RemoteUserCpu and ImageSize. OWL does add JobState
 if not present and sets it to 'Starting'.
 """
 import datetime
+import json
 import logging
 import os
+import socket
 import sys
 import time
 
 
 
 
+# Constants
+BLACKBOARDD_SOCKET = os.environ.get('OWL_BLACKBOARDD_SOCKET',
+                                    '/var/run/owl/blackboardd.sock')
+BLACKBOARDD_TIMEOUT = 30.
+
+
+
+
 def get_owl_environment(job_ad):
     """
     Look into the given job ClassAd for any extra environment variables that
@@ -72,66 +82,52 @@ def setup_logger(name):
 
 
 
-def update_blackboard_entry(job_ad, logger=None):
+def forward_to_blackboardd(role, job_ad, socket_path=BLACKBOARDD_SOCKET,
+                           timeout=BLACKBOARDD_TIMEOUT):
     """
-    Update the Blackboard entry corresponding to the given Job ClassAd.
-    """
-    from owl.classad import Job
-    from owl import blackboard
-
+    Hand the raw ClassAd `job_ad` and our `role` to the local blackboard writer
+    daemon (blackboardd.py) and wait for it to commit the corresponding
+    Blackboard change. Only use the standard library so that, when the daemon
+    is running, we do not pay the price of importing OWL and the ORM.
 
-    # Create a Job instance from the ClassAd and use it to update the BB.
-    blackboard.updateEntry(Job.new_from_classad(job_ad))
-    return
-
-
-def create_blackboard_entry(job_ad, logger=None):
+    Return True if the daemon committed the change, False otherwise (including
+    when the daemon is not running).
     """
-    Create a new Blackboard entry from `job_ad`. In case a Blackboard entry with
-    the same GlobalJobId already exists (which would happen e.g. in a rescue
-    DAG), fallback to an update.
-    """
-    from owl.classad import Job
-    from owl import blackboard
+    if(not os.path.exists(socket_path)):
+        return(False)
 
-    # Now, we could be in a rescue DAG, meaning that the blackboard entry might
-    # already be there. If this is the case, we just update that entry and not
-    # create a new one.
-    entry = None
-    job = Job.new_from_classad(job_ad)
+    reply = ''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
     try:
-        entry = blackboard.getEntry(entryId=job.GlobalJobId)
-    except:
-        pass
+        sock.connect(socket_path)
+        sock.sendall(json.dumps([role, job_ad]) + '\n')
+        while(not reply.endswith('\n')):
+            data = sock.recv(4096)
+            if(not data):
+                break
+            reply += data
+    except socket.error:
+        return(False)
+    finally:
+        sock.close()
 
-    if(entry):
-        update_blackboard_entry(job_ad, logger)
-    else:
-        blackboard.createEntry(job)
-    return
+    try:
+        return(json.loads(reply) is True)
+    except ValueError:
+        return(False)
 
 
-def close_blackboard_entry(job_ad, logger=None):
+def update_blackboard(role, job_ad, logger=None):
     """
-    Close the Blackboard entry corresponding to the given Job ClassAd.
+    Create, update or close the Blackboard entry corresponding to the given Job
+    ClassAd `job_ad`, depending on our `role`. In case a Blackboard entry with
+    the same GlobalJobId already exists when creating it (which would happen
+    e.g. in a rescue DAG), fallback to an update.
     """
-    from owl.classad import Job
     from owl import blackboard
 
-
-    # Create a Job instance from the ClassAd.
-    job = Job.new_from_classad(job_ad)
-
-    # Make sure that the job CompletionDate is not 0 (as it seems to be all the
-    # time).
-    if(not hasattr(job, 'CompletionDate') or job.CompletionDate == 0):
-        job.CompletionDate = job.JobStartDate + job.JobDuration
-        if(logger):
-            logger.debug('CompletionDate = 0 in an exit hook: setting it to %d'
-                         % (job.CompletionDate))
-
-    # Close the Blackboard entry corresponding to job.
-    blackboard.closeEntry(job)
+    blackboard.processHookEvent(role, job_ad)
     return
 
 
@@ -168,9 +164,22 @@ if(__name__ == '__main__'):
             role = 'prepare_job'
     logger.debug('Script invoked as %s hook.' % (role))
 
-    # Agument the (very restricted) environment with OWL specific variables
-    # defined in the job/ClassAd Environment (if any).
+    # OWL specific variables defined in the job/ClassAd Environment (if any).
     owlEnv = get_owl_environment(classad)
+
+    # Let the blackboard writer daemon do the work, if it is running. It only
+    # knows about its own configuration: jobs overriding any of it (e.g. the
+    # database to use) are handled here.
+    if(owlEnv):
+        logger.debug('Job has OWL overrides: updating the blackboard directly.')
+    elif(forward_to_blackboardd(role, classad)):
+        logger.debug('Update done by blackboardd.')
+        sys.exit(0)
+    else:
+        logger.debug('blackboardd not available: updating the blackboard ' + \
+                     'directly.')
+
+    # Agument the (very restricted) environment with those variables.
     for k in owlEnv.keys():
         v = owlEnv[k]
         logger.debug('Adding ENV(%s) = %s' % (k, v))
@@ -179,25 +188,13 @@ if(__name__ == '__main__'):
     from owl.config import DATABASE_CONNECTION_STR
     logger.debug('OWL DATABASE_CONNECTION_STR = %s' % (DATABASE_CONNECTION_STR))
 
-
-    if(role == 'job_exit'):
-        fn = close_blackboard_entry
-    elif(role == 'prepare_job'):
-        fn = create_blackboard_entry
-    elif(role == 'update_job'):
-        fn = update_blackboard_entry
-    else:
-        # What did they ask us to do again?????
-        logger.warning('Unsupported hook role: exiting with no action.')
-        sys.exit(0)
-
     # What are you waiting for?
     logger.debug('Upodating the blackboard.')
     ok = False
     retries = 5
     while(retries > 0 and not ok):
         try:
-            fn(classad, logger)
+            update_blackboard(role, classad, logger)
             ok = True
         except:
             retries -= 1
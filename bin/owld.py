@@ -22,10 +22,13 @@ API
 The OWL daemon implements the following JSON HTTP API described in
     docs/OWL_API.txt
 """
-import array
 import asyncore
 import asynchat
 import datetime
+import errno
+import fcntl
+import functools
+import heapq
 import inspect
 import json
 import logging
@@ -34,10 +37,15 @@ import Queue
 import select
 import socket
 import sys
+import threading
 import time
 
+import elixir
+
 import owl.condorutils as condor
 from owl import blackboard
+from owl import classad
+from owl import matchmaking
 
 
 
@@ -45,6 +53,22 @@ from owl import blackboard
 OWLD_METHOD_PREFIX = 'owlapi_'
 HEARTBEAT_TIMEOUT = 10
 LOG_NAME = 'owlddev.log'
+# Default number of worker threads and maximum number of queued commands.
+WORKERS = 4
+QUEUE_DEPTH = 100
+# Default number of seconds the Condor pool state is cached for.
+CACHE_TTL = 5.
+# The Blackboard fields returned by the job listing API methods.
+JOB_SUMMARY_FIELDS = ('GlobalJobId',
+                      'DAGManJobId',
+                      'Dataset',
+                      'Owner',
+                      'JobStartDate',
+                      'DAGNodeName',
+                      'DAGParentNodeNames',
+                      'ExitCode',
+                      'JobState',
+                      'JobDuration')
 
 
 
@@ -58,8 +82,11 @@ LOG_NAME = 'owlddev.log'
 #   2. Client sends a command in a single JSON string.
 #   3. OWLD (via Command Monitor and Request Handler) parses the string and
 #      creates one entry in the CommandQueue. It assigns that entry a unique ID
-#   4. OWLD executes the command (at some later time).
-#   5. OWLD sends results to Client.
+#   4. One of the OWLD worker threads executes the command (at some later
+#      time) and hands the result back to the event loop.
+#   5. OWLD sends results to Client (from the event loop thread).
+#   6. Unless Client asked for a persistent connection (see
+#      RequestHandler.found_terminator), OWLD closes the connection.
 class CommandQueue(Queue.Queue):
     """
     Thread-safe queue holding user-specified OWLD commands.
@@ -74,6 +101,214 @@ class CommandIDQueue(Queue.Queue):
     pass
 
 
+class ResultNotifier(asyncore.file_dispatcher):
+    """
+    Wake up the event loop whenever a worker thread has a result ready and
+    deliver the results from there. Sockets (and hence RequestHandler
+    instances) are only ever touched by the event loop thread.
+    """
+    # asyncore.file_dispatcher has a lot of publich methods, nothing we can do
+    # about that, hence:
+    # pylint: disable=R0904
+    def __init__(self, logger):
+        (read_fd, self._write_fd) = os.pipe()
+        fcntl.fcntl(self._write_fd, fcntl.F_SETFL,
+                    fcntl.fcntl(self._write_fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        asyncore.file_dispatcher.__init__(self, read_fd)
+        os.close(read_fd)
+
+        self.results = Queue.Queue()
+        self._logger = logger
+        return
+
+    def notify(self, callback, result):
+        """
+        Called from a worker thread: schedule callback(result) to be invoked in
+        the event loop thread.
+        """
+        self.results.put((callback, result))
+        try:
+            os.write(self._write_fd, 'x')
+        except OSError, e:
+            # A full pipe means that the event loop is awake already.
+            if(e.errno != errno.EAGAIN):
+                raise
+        return
+
+    def writable(self):
+        return(False)
+
+    def handle_read(self):
+        """
+        Drain the wake-up pipe and deliver all the results we have.
+        """
+        self.recv(4096)
+        while(True):
+            try:
+                (callback, result) = self.results.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                callback(result)
+            except:
+                self._logger.exception('Error delivering a result.')
+        return
+
+
+class WorkerPool(object):
+    """
+    Bounded pool of threads executing OWLD commands concurrently, so that a slow
+    command (e.g. condor_status timing out) does not block every other client.
+    """
+    def __init__(self, handler, size, queue_depth, logger):
+        """
+        Start `size` worker threads executing the commands in self.cmd_queue,
+        which holds at most `queue_depth` commands. `handler` is invoked with
+        each command and has to return a (callback, result) tuple or None (if
+        there is nothing to send back). callback(result) is then invoked from
+        the event loop thread.
+        """
+        self.cmd_queue = CommandQueue(maxsize=max(0, queue_depth))
+        self.notifier = ResultNotifier(logger)
+        self._handler = handler
+        self._logger = logger
+
+        self._threads = []
+        for i in range(max(1, size)):
+            thread = threading.Thread(target=self._work,
+                                      name='owld-worker-%d' % (i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        return
+
+    def _work(self):
+        """
+        Worker thread main loop.
+        """
+        while(True):
+            cmd_spec = self.cmd_queue.get()
+            if(cmd_spec is None):
+                break
+
+            try:
+                res = self._handler(cmd_spec)
+            except:
+                self._logger.exception('Error executing command %s' \
+                                       % (str(cmd_spec[0])[:80]))
+                res = (cmd_spec[1][1], None)
+            finally:
+                # Each thread has its own database session: do not keep its
+                # transaction (and snapshot of the database) around.
+                elixir.session.remove()
+
+            if(res is not None):
+                self.notifier.notify(*res)
+        return
+
+    def stop(self, timeout=5.):
+        """
+        Ask all the worker threads to quit once they are done with what they
+        are doing.
+        """
+        for _ in self._threads:
+            try:
+                self.cmd_queue.put_nowait(None)
+            except Queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(timeout)
+        return
+
+
+class CondorCache(object):
+    """
+    Thread-safe, time-bounded cache of the Condor pool state (e.g. the parsed
+    output of condor_status), shared by all the worker threads. Concurrent
+    misses on the same key only run the expensive fetch once: the other threads
+    wait for it and then use its result.
+    """
+    def __init__(self, ttl=CACHE_TTL):
+        """
+        Cache values for `ttl` seconds (0 disables caching) - float
+        """
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        # {key: (expiration time, value)} and {key: refresh lock}.
+        self._entries = {}
+        self._refresh_locks = {}
+        self._lock = threading.Lock()
+        return
+
+    def _lookup(self, key):
+        """
+        Return (True, value) if we have a fresh value for `key`, (False, None)
+        otherwise.
+        """
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if(entry is not None and entry[0] > time.time()):
+                self.hits += 1
+                return((True, entry[1]))
+            return((False, None))
+        finally:
+            self._lock.release()
+
+    def _refresh_lock(self, key):
+        """
+        Return the lock serializing the refreshes of `key`.
+        """
+        self._lock.acquire()
+        try:
+            return(self._refresh_locks.setdefault(key, threading.Lock()))
+        finally:
+            self._lock.release()
+
+    def get(self, key, fetch, cacheable=None):
+        """
+        Return the cached value for `key`. If we do not have a fresh one, call
+        fetch() to get it and cache it, unless cacheable(value) is False (e.g.
+        because fetch failed).
+        """
+        (found, value) = self._lookup(key)
+        if(found):
+            return(value)
+
+        lock = self._refresh_lock(key)
+        lock.acquire()
+        try:
+            # Somebody else might have refreshed `key` while we were waiting.
+            (found, value) = self._lookup(key)
+            if(found):
+                return(value)
+
+            self._lock.acquire()
+            try:
+                self.misses += 1
+            finally:
+                self._lock.release()
+
+            value = fetch()
+            if(self.ttl > 0 and (cacheable is None or cacheable(value))):
+                self._lock.acquire()
+                try:
+                    self._entries[key] = (time.time() + self.ttl, value)
+                finally:
+                    self._lock.release()
+            return(value)
+        finally:
+            lock.release()
+
+    def stats(self):
+        """
+        Return the cache hit/miss counters as a dictionary.
+        """
+        return({'hits': self.hits, 'misses': self.misses, 'ttl': self.ttl})
+
+
 class RequestHandler(asynchat.async_chat):
     """
     Handle the communication with the client, be it a commandline tool or
@@ -122,10 +357,20 @@ class RequestHandler(asynchat.async_chat):
         # what we get from the client is a simple JSON string of the form
         #   "[method name, arg1, arg2, ..., keyword_dict]"
         # Where all strings are unicode and the argument list might be empty.
+        # In that case we reply and close the connection. Alternatively, the
+        # client can keep the connection open and send as many commands as it
+        # likes, each one a JSON string of the form
+        #   "{"id": request id, "command": [method name, arg1, ...]}"
+        # The replies are of the form
+        #   "{"id": request id, "result": result}"
+        # and are sent as soon as they are ready (i.e. possibly out of order).
+        # The request id can be anything JSON serializable and is chosen by the
+        # client.
         # What we put in the Command Queue is
         #   ((method name, arg1, arg2, ..., keyword_dict), (cmd_id, callback))
-        # Where callback is self.replay and cmd_id is dynamically generated and
-        # are for internal consumption only.
+        # Where callback is self.replay (or self.reply_to with the request id
+        # bound to it) and cmd_id is dynamically generated and are for internal
+        # consumption only.
         try:
             cmd_spec = json.loads(self.indata)
         except:
@@ -133,22 +378,55 @@ class RequestHandler(asynchat.async_chat):
                               % (str(self.indata[:-1])))
             self.indata = ''
             return
+        self.indata = ''
+
+        callback = self.reply
+        if(isinstance(cmd_spec, dict)):
+            callback = functools.partial(self.reply_to, cmd_spec.get('id'))
+            cmd_spec = cmd_spec.get('command')
+        if(not isinstance(cmd_spec, list) or not cmd_spec):
+            msg = 'Warning: ignored malformed command %s' % (str(cmd_spec))
+            self._logger.warn(msg)
+            callback(msg)
+            return
         cmd_id = new_command_id(self.cmd_id_queue)
 
         # Remember that we only want tuples in our queues.
-        self.cmd_queue.put((tuple(cmd_spec), (cmd_id, self.reply)))
-        self.indata = ''
+        try:
+            self.cmd_queue.put_nowait((tuple(cmd_spec), (cmd_id, callback)))
+        except Queue.Full:
+            msg = 'Warning: too many pending commands, try again later'
+            self._logger.warn(msg)
+            callback(msg)
         return
 
     def reply(self, message):
         """
-        Simply send `message` back to the client.
+        Simply send `message` back to the client and close the connection.
         """
+        if(not self.connected):
+            # The client went away while we were working on its command.
+            return
+
         self._logger.debug('Replying "%s"' % (message))
         self.push(json.dumps(message, default=datetime_handler) + '\n')
         self.close_when_done()
         return
 
+    def reply_to(self, request_id, message):
+        """
+        Send `message` back to the client as the result of its request
+        `request_id`. Keep the connection open for further requests.
+        """
+        if(not self.connected):
+            # The client went away while we were working on its command.
+            return
+
+        self._logger.debug('Replying "%s" to %s' % (message, str(request_id)))
+        self.push(json.dumps({'id': request_id, 'result': message},
+                             default=datetime_handler) + '\n')
+        return
+
 
 class CommandMonitor(asyncore.dispatcher):
     """
@@ -208,7 +486,8 @@ class Daemon(object):
     """
     def __init__(self, ipaddr, port, heartbeat_timeout, logger,
                  max_msg_size=None, max_rows=None,
-                 apiprefix=OWLD_METHOD_PREFIX):
+                 apiprefix=OWLD_METHOD_PREFIX, workers=WORKERS,
+                 queue_depth=QUEUE_DEPTH, cache_ttl=CACHE_TTL):
         """
         Initialize an OWL Daemon.
 
@@ -224,6 +503,12 @@ class Daemon(object):
                 methods can return - integer
             apiprefix: each method which starts with apiprefix is exposed as an
                 API method - string
+            workers: the number of threads executing API methods concurrently
+                - integer
+            queue_depth: the maximum number of commands waiting for a worker
+                thread. Commands in excess get rejected - integer
+            cache_ttl: the number of seconds the Condor pool state is cached
+                for (0 disables caching) - float
         """
         self._max_rows = max_rows
         self._logger = logger
@@ -231,11 +516,24 @@ class Daemon(object):
         # Send a heartbeat every heartbeat_timeout seconds.
         self.hb_timeout = heartbeat_timeout
 
+        # Timers run by the event loop: a heap of (time, function, args).
+        self._timers = []
+
+        # Cache of the Condor pool state.
+        self.cache = CondorCache(ttl=cache_ttl)
+        # Columnar copy of the cached pool state for match-making, as a tuple
+        # (condor_status ads, matchmaking.MachineTable).
+        self._machine_table = (None, None)
+
         # All public API methods are prefixed with self.prefix
         self.prefix = apiprefix
 
-        # Init a command queue.
-        self.cmd_queue = CommandQueue()
+        # Init the worker pool (and its command queue).
+        self.pool = WorkerPool(handler=self._handle_command,
+                               size=workers,
+                               queue_depth=queue_depth,
+                               logger=self._logger)
+        self.cmd_queue = self.pool.cmd_queue
 
         self._logger.info('OWLD initialized.')
 
@@ -247,45 +545,58 @@ class Daemon(object):
                                           logger=self._logger)
         return
 
-    def run(self, use_poll=False, timeout=1., sleep_time=.1):
+    def schedule(self, delay, func, *args):
+        """
+        Invoke func(*args) from the event loop, `delay` seconds from now.
+        """
+        heapq.heappush(self._timers, (time.time() + delay, func, args))
+        return
+
+    def run(self, use_poll=False):
         """
         Sit is an infinite loop waiting for a command to answer.
         """
-        # This is just a merge of our event loop, monitoring the queue, and
-        # ayncore.loop.
+        # This is just asyncore.loop plus our timers. We block in poll until
+        # either there is socket activity (which includes a worker thread
+        # handing us a result, see ResultNotifier) or the next timer is due:
+        # there is no busy waiting and replies go out as soon as they are
+        # ready.
         if use_poll and hasattr(select, 'poll'):
             poll_fun = asyncore.poll2
         else:
             poll_fun = asyncore.poll
         asyncmap = asyncore.socket_map
 
-        last_heartbeat = 0
-        pid = os.getpid()
+        self.schedule(0, self._heartbeat, os.getpid())
         while(True):
-            # Poll the sockets.
-            if(asyncmap):
-                poll_fun(timeout, asyncmap)
-
-            # Check the command queue and see if there is anything we to do.
-            self._handle_command()
-
-            # Do we need to send a heartbeat?
+            # Run whatever timer is due.
             now = time.time()
-            if(now - last_heartbeat >= self.hb_timeout):
-                send_alive(pid, timeout)
-            time.sleep(sleep_time)
+            while(self._timers and self._timers[0][0] <= now):
+                (_, func, args) = heapq.heappop(self._timers)
+                func(*args)
+                now = time.time()
+
+            # Poll the sockets until the next timer is due.
+            timeout = None
+            if(self._timers):
+                timeout = max(0., self._timers[0][0] - now)
+            poll_fun(timeout, asyncmap)
         return
 
-    def _handle_command(self):
+    def _heartbeat(self, pid):
         """
-        Look at self.cmd_queue to see if there is anything to do. If so, parse
-        the command specification found there, potentially act on it and quit.
+        Send a heartbeat to the Condor Master and schedule the next one.
         """
-        try:
-            cmd_spec = self.cmd_queue.get(block=True, timeout=.1)
-        except Queue.Empty:
-            return
+        condor.send_alive(pid, 3 * self.hb_timeout)
+        self.schedule(self.hb_timeout, self._heartbeat, pid)
+        return
 
+    def _handle_command(self, cmd_spec):
+        """
+        Parse the command specification `cmd_spec` (from self.cmd_queue) and
+        potentially act on it. Return (callback, result) or None if there is
+        nothing to send back. This is called by the worker threads.
+        """
         # raw_cmd_spec is a tuple of the form
         #   ((method name, arg1, arg2, ..., keyword_dict), (id, callback))
         # All strings are unicode.
@@ -303,8 +614,7 @@ class Daemon(object):
             msg = 'Warning: ignored unsupported command %s' \
                   % (str(meth_spec[0]))
             self._logger.warn(msg)
-            callback(msg)
-            return
+            return((callback, msg))
 
         # Do we have keyword arguments or just positional args?
         kwds = {}
@@ -313,17 +623,51 @@ class Daemon(object):
             kwds = meth_spec.pop()
 
         result = getattr(self, method_name)(*meth_spec[1:], **kwds)
-        callback(result)
-        return
+        return((callback, result))
 
     def stop(self):
         """
         Cleanup and quit.
         """
         self._logger.info('OWLD stopping.')
+        self.pool.stop()
         logging.shutdown()
         return
 
+    def _condor_status(self, timeout=condor.TIMEOUT):
+        """
+        Return the (cached) output of condor_status as a tuple
+            ([ClassAd, ...], {Name: ClassAd}, {Machine: first ClassAd})
+        """
+        def fetch():
+            ads = condor.condor_status(timeout=timeout)
+            by_machine = {}
+            for ad in ads:
+                by_machine.setdefault(getattr(ad, 'Machine', None), ad)
+            return((ads, dict([(ad.Name, ad) for ad in ads]), by_machine))
+        cacheable = lambda res: not (res[0] and condor.is_error_ad(res[0][0]))
+        return(self.cache.get('condor_status', fetch, cacheable))
+
+    def _machines(self, timeout=condor.TIMEOUT):
+        """
+        Return a matchmaking.MachineTable of the (cached) condor_status output.
+        The table is rebuilt only when the cached pool state changes.
+        """
+        (ads, _, _) = self._condor_status(timeout=timeout)
+        (cached_ads, table) = self._machine_table
+        if(cached_ads is not ads):
+            table = matchmaking.MachineTable(ads)
+            self._machine_table = (ads, table)
+        return(table)
+
+    def _condor_stats(self, timeout=condor.TIMEOUT):
+        """
+        Return the (cached) output of condor_stats.
+        """
+        return(self.cache.get('condor_stats',
+                              lambda: condor.condor_stats(timeout=timeout),
+                              lambda ad: not condor.is_error_ad(ad)))
+
     def owlapi_echo(self, message=''):
         """
         Simple echo service.
@@ -362,7 +706,7 @@ class Daemon(object):
         Return
             [resource name, ...]
         """
-        ads = condor.condor_status(timeout=timeout)
+        (ads, _, _) = self._condor_status(timeout=timeout)
         return([ad.Name for ad in ads])
 
     def owlapi_resources_get_info(self, name=None, timeout=condor.TIMEOUT):
@@ -378,10 +722,53 @@ class Daemon(object):
         if(name is None):
             return
 
-        ads = condor.condor_status(name, timeout=timeout)
-        if(not ads):
+        ad = find_resource(name, self._condor_status(timeout=timeout))
+        if(ad is None):
             return
-        return(ads[0].todict())
+        return(ad.todict())
+
+    def owlapi_resources_get_info_many(self, names=None,
+                                       timeout=condor.TIMEOUT):
+        """
+        Return the full ClassAds for the given resource names as dictionaries.
+        This only runs condor_status once, no matter how many names are given.
+
+        Usage
+           resources_get_info_many([resource name, ...])
+
+        Return
+            {resource name: ClassAd instance as dictionary or None, ...}
+        """
+        if(not names):
+            return({})
+
+        status = self._condor_status(timeout=timeout)
+        res = {}
+        for name in names:
+            ad = find_resource(name, status)
+            res[name] = ad.todict() if ad is not None else None
+        return(res)
+
+    def owlapi_resources_get_matches(self, job_ad=None,
+                                     timeout=condor.TIMEOUT):
+        """
+        Return the resources (i.e. slots) which can run the job described by
+        the ClassAd text `job_ad` and the job Rank for each of them, best Rank
+        first. A resource can run a job if both the job and the resource
+        Requirements are TRUE.
+
+        Usage
+           resources_get_matches(job ClassAd text)
+
+        Return
+            [[resource name, rank], ...]
+        """
+        if(not job_ad):
+            return([])
+
+        job = classad.Job.new_from_classad(job_ad)
+        return([[getattr(ad, 'Name', None), rank] \
+                for (ad, rank) in self._machines(timeout=timeout).match(job)])
 
     def owlapi_resources_get_stats(self, timeout=condor.TIMEOUT):
         """
@@ -393,11 +780,24 @@ class Daemon(object):
         Return
             Collected statistics as a dictionary.
         """
-        stats = condor.condor_stats(timeout=timeout)
+        stats = self._condor_stats(timeout=timeout)
         if(not stats):
             return
         return(stats.todict())
 
+    def owlapi_resources_get_cache_stats(self):
+        """
+        Return the hit/miss counters of the Condor pool state cache (used by
+        the resources_* methods) as well as its time to live in seconds.
+
+        Usage
+            resources_get_cache_stats()
+
+        Return
+            {'hits': int, 'misses': int, 'ttl': float}
+        """
+        return(self.cache.stats())
+
     def owlapi_jobs_get_list(self, owner=None, dataset=None,
                              offset=None, limit=20, newest_first=True):
         """
@@ -424,16 +824,7 @@ class Daemon(object):
             [{GlobalJobId, DAGManJobId, Dataset, Owner, JobStartDate,
               DAGNodeName, DAGParentNodeNames, ExitCode, JobState, JobDuration}]
         """
-        fields = ('GlobalJobId',
-                  'DAGManJobId',
-                  'Dataset',
-                  'Owner',
-                  'JobStartDate',
-                  'DAGNodeName',
-                  'DAGParentNodeNames',
-                  'ExitCode',
-                  'JobState',
-                  'JobDuration')
+        fields = JOB_SUMMARY_FIELDS
         # Do we have a limit on the number of rows we can return?
         if(self._max_rows and self._max_rows < limit):
             limit = self._max_rows
@@ -443,7 +834,56 @@ class Daemon(object):
                                                 dataset=dataset,
                                                 limit=limit,
                                                 offset=offset,
-                                                newest_first=newest_first)])
+                                                newest_first=newest_first,
+                                                summary=True,
+                                                fields=fields)])
+
+    def owlapi_jobs_get_page(self, owner=None, dataset=None, cursor=None,
+                             limit=20, newest_first=True):
+        """
+        Cursor-based alternative to jobs_get_list: return the next page of at
+        most `limit` Blackboard entries (optionally restricted to those
+        corresponding to a given dataset and/or user) together with the cursor
+        of the page after that. Start from the first page if `cursor` is None.
+        The returned cursor is None when there are no more pages and otherwise
+        is an opaque string to pass back as is. Unlike with `offset` in
+        jobs_get_list, every page is equally fast to retrieve, no matter how
+        deep it is.
+
+        If newest_first=True, then the results are sorted by descending
+        JobStartDate. The sorting is reversed otherwise. Entries with no
+        JobStartDate come last.
+
+        Usage
+            jobs_get_page(owner=None, dataset=None, cursor=None, limit=20,
+                          newest_first=True)
+
+        Return
+            {jobs: [{GlobalJobId, DAGManJobId, Dataset, Owner, JobStartDate,
+                     DAGNodeName, DAGParentNodeNames, ExitCode, JobState,
+                     JobDuration}],
+             cursor: next page cursor or None}
+            None if `cursor` is invalid.
+        """
+        fields = JOB_SUMMARY_FIELDS
+        # Do we have a limit on the number of rows we can return?
+        if(self._max_rows and (limit is None or self._max_rows < limit)):
+            limit = self._max_rows
+
+        try:
+            (entries, next_cursor) = blackboard.listEntriesPage(
+                owner=owner,
+                dataset=dataset,
+                limit=limit,
+                cursor=cursor,
+                newest_first=newest_first,
+                summary=True,
+                fields=fields)
+        except ValueError:
+            return
+        return({'jobs': [dict([(f, getattr(e, f, None)) for f in fields]) \
+                         for e in entries],
+                'cursor': next_cursor})
 
     def owlapi_jobs_get_dag(self, dagId):
         """
@@ -473,17 +913,8 @@ class Daemon(object):
             [{GlobalJobId, DAGManJobId, Dataset, Owner, JobStartDate,
               DAGNodeName, DAGParentNodeNames, ExitCode, JobState, JobDuration}]
         """
-        fields = ('GlobalJobId',
-                  'DAGManJobId',
-                  'Dataset',
-                  'Owner',
-                  'JobStartDate',
-                  'DAGNodeName',
-                  'DAGParentNodeNames',
-                  'ExitCode',
-                  'JobState',
-                  'JobDuration')
-        res = blackboard.getOSFEntry(str(dagId))
+        fields = JOB_SUMMARY_FIELDS
+        res = blackboard.getOSFEntry(str(dagId), summary=True, fields=fields)
         if(not res or len(res) != 4):
             return([])
         return([dict([(f, getattr(e, f, None)) for f in fields]) \
@@ -511,6 +942,26 @@ class Daemon(object):
             return
         return(entry.todict())
 
+    def owlapi_jobs_get_info_many(self, job_ids=None):
+        """
+        Return all info about the given blackboard entries (identified by their
+        GlobalJobIds `job_ids`) as Python dictionaries. This only needs one
+        database query, no matter how many ids are given (up to a few hundred).
+
+        Usage
+            jobs_get_info_many([job_id, ...])
+
+        Return
+            {job_id: blackboard entry as a dictionary or None, ...}
+        """
+        if(not job_ids):
+            return({})
+
+        entries = blackboard.getEntries(job_ids)
+        return(dict([(job_id, entries[job_id].todict() \
+                                  if job_id in entries else None) \
+                     for job_id in job_ids]))
+
     def owlapi_jobs_suspend(self, job_id=None, owner=None,
                             timeout=condor.TIMEOUT):
         """
@@ -652,51 +1103,21 @@ def new_command_id(queue):
     queue.put(new_id)
     return(new_id)
 
-def send_alive(pid, timeout=300, master_host="127.0.0.1", master_port=1271):
-    """
-    Send a UDP packet to the condor_master containing the
-    DC_CHILDALIVE command.
 
-    This will have the master register a trigger to fire in timeout
-    seconds. When the trigger fires the pid will be killed. Each time
-    the DC_CHILDALIVE is sent the trigger's timer is reset to fire in
-    timeout seconds.
-
-    DC_CHILDALIVE should be sent every timeout/3 seconds.
-    """
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.sendto(build_message(pid, int(timeout)), (master_host, master_port))
-    return
 
-def build_message(pid, timeout):
+def find_resource(name, status):
     """
-    Build a datagram packet to send to the condor_master.
-
-    The package format is (command, pid, timeout). The command is
-    always DC_CHILDALIVE (the integer 60008). The pid is the pid of
-    the process the master is monitoring, i.e. getpid if this
-    script. The timeout is the amount of time, in seconds, the master
-    will wait before killing the pid. Each field in the packet must be
-    8 bytes long, thus the padding.
+    Return the ClassAd of the resource called `name` in `status` (i.e. what
+    Daemon._condor_status returns) or None if there is no such resource. If
+    `name` is a host name rather than a slot name, return its first slot, just
+    like condor_status would.
     """
-    DC_CHILDALIVE = 60008
+    (_, by_name, by_machine) = status
+    ad = by_name.get(name)
+    if(ad is None and name is not None):
+        ad = by_machine.get(name)
+    return(ad)
 
-    message = array.array('H')
-    message.append(0)
-    message.append(0)
-    message.append(0) # padding
-    message.append(socket.htons(DC_CHILDALIVE))
-
-    message.append(0)
-    message.append(0)
-    message.append(0) # padding
-    message.append(socket.htons(pid))
-
-    message.append(0)
-    message.append(0)
-    message.append(0) # padding
-    message.append(socket.htons(timeout))
-    return(message.tostring())
 
 
 datetime_handler = lambda obj: obj.isoformat() \
@@ -729,6 +1150,15 @@ if(__name__ == '__main__'):
         if(max_rows <= 0):
             max_rows = None
 
+    # How many commands do we execute concurrently and how many can wait?
+    workers = int(config.OWLD_WORKERS or WORKERS)
+    queue_depth = int(config.OWLD_QUEUE_DEPTH or QUEUE_DEPTH)
+
+    # How long do we cache the Condor pool state for?
+    cache_ttl = CACHE_TTL
+    if(config.OWLD_CACHE_TTL is not None):
+        cache_ttl = float(config.OWLD_CACHE_TTL)
+
     # Where are we supposed to write logs and which logging level should we use?
     log_file_name = os.path.join(config.LOGGING_LOG_DIR, config.OWLD_LOG_NAME)
     verbosity = config.LOGGING_LOG_LEVEL
@@ -742,6 +1172,9 @@ if(__name__ == '__main__'):
                     heartbeat_timeout=HEARTBEAT_TIMEOUT,
                     max_msg_size=max_msg_bytes,
                     max_rows=max_rows,
+                    workers=workers,
+                    queue_depth=queue_depth,
+                    cache_ttl=cache_ttl,
                     logger=logger)
     try:
         daemon.run()
@@ -1,7 +1,26 @@
 #!/usr/bin/env python
+"""
+Spread keymaster daemon: hand out unique Condor-style ClusterIds to spread
+clients (see owl.plugins.spread_keyclient).
+
+Requests (bodies of messages sent to the key_queue queue) are either
+    get_clusterid       reply with one new ClusterId
+    get_clusterids N    reserve N contiguous ClusterIds and reply with the
+                        first one
+ClusterIds are never handed out twice, not even across restarts: we persist a
+high-water mark (a bit ahead of the ClusterIds handed out, so that we do not
+have to write it for every request) in a state file and restart from there.
+Without a state file (e.g. the first time), we start from the largest ClusterId
+in the blackboard.
+
+Usage
+    spread_keymasterd.py [broker host [state file]]
+"""
 import logging
+import os
 import socket
 import sys
+import tempfile
 
 import pika
 
@@ -13,21 +32,87 @@ from owl import blackboard
 # Constants
 HOSTNAME = socket.gethostname()
 logging.basicConfig(level=logging.CRITICAL)
-CLUSTER_ID = blackboard.getMaxClusterId()
+QUEUE_NAME = 'key_queue'
+STATE_FILE = '/var/tmp/owl_spread_keymasterd.state'
+# How far ahead of the ClusterIds handed out we persist the high-water mark.
+RESERVE = 10000
 
+# Last ClusterId handed out and persisted high-water mark.
+CLUSTER_ID = 0
+HIGH_WATER_MARK = 0
 
 
 
+
+def load_high_water_mark(path=None):
+    """
+    Return the high-water mark stored in `path` (STATE_FILE by default) or None
+    if there is none.
+    """
+    path = path or STATE_FILE
+    try:
+        return(int(open(path).read().strip()))
+    except (IOError, ValueError):
+        return
+
+
+def save_high_water_mark(mark, path=None):
+    """
+    Atomically write `mark` to `path` (STATE_FILE by default).
+    """
+    path = path or STATE_FILE
+    (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+    with os.fdopen(fd, 'w') as f:
+        f.write('%d\n' % (mark))
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+    return
+
+
+def init_clusterid(path=None):
+    """
+    Start from the persisted high-water mark or, if there is none, from the
+    largest ClusterId in the blackboard.
+    """
+    global CLUSTER_ID, HIGH_WATER_MARK
+    mark = load_high_water_mark(path)
+    if(mark is None):
+        mark = blackboard.getMaxClusterId()
+    CLUSTER_ID = HIGH_WATER_MARK = mark
+    return
+
+
+def get_clusterids(n, path=None):
+    """
+    Reserve `n` contiguous ClusterIds and return the first one. The high-water
+    mark is persisted before any ClusterId beyond it is handed out.
+    """
+    global CLUSTER_ID, HIGH_WATER_MARK
+    first = CLUSTER_ID + 1
+    CLUSTER_ID += n
+    if(CLUSTER_ID > HIGH_WATER_MARK):
+        HIGH_WATER_MARK = CLUSTER_ID + RESERVE
+        save_high_water_mark(HIGH_WATER_MARK, path)
+    return(first)
+
+
 def get_clusterid():
-    global CLUSTER_ID
-    CLUSTER_ID += 1
-    return(CLUSTER_ID)
+    return(get_clusterids(1))
 
 
 def on_request(ch, method, props, body):
-    if(body == 'get_clusterid'):
-        clusterid = get_clusterid()
-        print(' [.] got key request, replying with key=%d' % (clusterid))
+    tokens = body.split()
+    if(tokens and tokens[0] in ('get_clusterid', 'get_clusterids')):
+        n = 1
+        if(len(tokens) == 2):
+            try:
+                n = max(1, int(tokens[1]))
+            except ValueError:
+                pass
+        clusterid = get_clusterids(n)
+        print(' [.] got key request, replying with key=%d (n=%d)' \
+              % (clusterid, n))
         ch.basic_publish(exchange='',
                          routing_key=props.reply_to,
                          properties=pika.BasicProperties(correlation_id = \
@@ -46,14 +131,17 @@ if(__name__ == '__main__'):
               'first argument to this')
         print(' [i] script e.g. ./spread_keymaster.py machine.example.com')
         broker_host = 'localhost'
+    if(len(sys.argv) > 2):
+        STATE_FILE = sys.argv[2]
+    init_clusterid()
 
     connection = pika.BlockingConnection(pika.ConnectionParameters(
         host=broker_host))
     channel = connection.channel()
-    channel.queue_declare(queue='key_queue')
+    channel.queue_declare(queue=QUEUE_NAME)
 
     channel.basic_qos(prefetch_count=1)
-    channel.basic_consume(on_request, queue='key_queue')
+    channel.basic_consume(on_request, queue=QUEUE_NAME)
 
     print " [x] Awaiting KEY requests"
     channel.start_consuming()
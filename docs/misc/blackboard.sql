@@ -117,3 +117,35 @@ create table blackboard (
     Dataset                  varchar(255),
     Instances                integer
 );
+
+create index ix_blackboard_JobStartDate on blackboard (JobStartDate, GlobalJobId);
+create index ix_blackboard_Owner_JobStartDate on blackboard (Owner, JobStartDate, GlobalJobId);
+create index ix_blackboard_Dataset_JobStartDate on blackboard (Dataset, JobStartDate, GlobalJobId);
+create index ix_blackboard_DAGManJobId on blackboard (DAGManJobId, ClusterId, ProcId);
+
+
+create table blackboard_summary (
+    GlobalJobId              varchar(255) not null,
+    DAGManJobId              integer,
+    Dataset                  varchar(255),
+    Owner                    varchar(255),
+    JobStartDate             timestamp without time zone,
+    DAGNodeName              varchar(255),
+    DAGParentNodeNames       varchar(255),
+    ExitCode                 integer,
+    JobState                 varchar(255),
+    JobDuration              real,
+    ClusterId                integer,
+    ProcId                   integer
+);
+
+create index ix_blackboard_summary_JobStartDate on blackboard_summary (JobStartDate, GlobalJobId);
+create index ix_blackboard_summary_Owner_JobStartDate on blackboard_summary (Owner, JobStartDate, GlobalJobId);
+create index ix_blackboard_summary_Dataset_JobStartDate on blackboard_summary (Dataset, JobStartDate, GlobalJobId);
+create index ix_blackboard_summary_DAGManJobId on blackboard_summary (DAGManJobId, ClusterId, ProcId);
+
+-- Only needed when upgrading an existing blackboard (see blackboard.rebuildSummary).
+insert into blackboard_summary
+    select GlobalJobId, DAGManJobId, Dataset, Owner, JobStartDate, DAGNodeName,
+           DAGParentNodeNames, ExitCode, JobState, JobDuration, ClusterId, ProcId
+    from blackboard;
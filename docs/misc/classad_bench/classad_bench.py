@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Compare the memory footprint and attribute access speed of classad.ClassAd and
+classad.CompactClassAd.
+
+Usage
+    shell> classad_bench.py [<number of ads> [<ClassAd file>]]
+
+The ads are all built from the same ClassAd text (test/ad.txt in the OWL source
+tree by default), with a few attributes changed for each one, just like the
+machine ClassAds of a pool would be. The memory figures only include the per
+ad containers (i.e. the instances and their __dict__ or value list) since the
+attribute values are the same in both cases.
+"""
+import os
+import sys
+import time
+
+from owl import classad
+
+
+
+# Constants
+AD_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '..', '..', '..', 'test', 'ad.txt')
+# Mixed-case attribute names, as found in user code.
+LOOKUPS = ('Owner', 'ClusterId', 'JobStartDate', 'owner', 'DAGNodeName',
+           'RemoteHost', 'ImageSize', 'Iwd')
+
+
+
+def build(cls, attrs, num_ads):
+    ads = []
+    for i in range(num_ads):
+        ad = cls(**attrs)
+        ad.ClusterId = i
+        ad.RemoteHost = 'slot%d@example.com' % (i)
+        ads.append(ad)
+    return(ads)
+
+
+def footprint(ads):
+    res = 0
+    for ad in ads:
+        res += sys.getsizeof(ad)
+        if(isinstance(ad, classad.CompactClassAd)):
+            res += sys.getsizeof(ad._values)
+        else:
+            res += sys.getsizeof(ad.__dict__)
+    return(res)
+
+
+def lookups(ads):
+    t0 = time.time()
+    for ad in ads:
+        for name in LOOKUPS:
+            getattr(ad, name)
+    return(time.time() - t0)
+
+
+def bench(num_ads, ad_file):
+    attrs = classad._parse(open(ad_file).read())
+    print('%d ads with %d attributes each.' % (num_ads, len(attrs)))
+
+    for cls in (classad.ClassAd, classad.CompactClassAd):
+        t0 = time.time()
+        ads = build(cls, attrs, num_ads)
+        dt = time.time() - t0
+        print('%-15s build: %6.3f s  lookups: %6.3f s  containers: %7.1f MB' \
+              % (cls.__name__, dt, lookups(ads), footprint(ads) / 1048576.))
+    return(0)
+
+
+
+
+if(__name__ == '__main__'):
+    num_ads = 100000
+    ad_file = AD_FILE
+    if(len(sys.argv) > 1):
+        num_ads = int(sys.argv[1])
+    if(len(sys.argv) > 2):
+        ad_file = sys.argv[2]
+    sys.exit(bench(num_ads, ad_file))
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+Measure how fast classad._parse turns ClassAd text into {key: val} dictionaries
+compared to the original multi-pass implementation (i.e. line continuation
+regex, split, per line lower() and exception driven int/float sniffing), which
+is reproduced below as legacy_parse.
+
+Usage
+    shell> parse_bench.py [<number of repetitions> [<ClassAd file> ...]]
+
+Each file may contain any number of (job or machine) ClassAds separated by empty
+lines, e.g. the output of condor_q -long or condor_status -long. The default
+corpus is test/ad.txt in the OWL source tree. The script exits with a non zero
+exit code if the two implementations do not return the same results.
+"""
+import os
+import re
+import sys
+import time
+
+from owl import classad
+
+
+
+# Constants
+AD_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '..', '..', '..', 'test', 'ad.txt')
+MULTILINE_BUSTER = re.compile(' *\\\\ *\n *')
+ROUNDS = 5
+
+
+
+def legacy_value(raw_value):
+    if(raw_value.startswith('"') and raw_value.endswith('"')):
+        return(unicode(raw_value[1:-1]))
+    if(raw_value.upper() == 'FALSE'):
+        return(False)
+    if(raw_value.upper() == 'TRUE'):
+        return(True)
+    try:
+        return(int(raw_value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return(float(raw_value))
+    except (TypeError, ValueError):
+        pass
+    return(unicode(raw_value))
+
+
+def legacy_parse(classad_text):
+    classad_text = MULTILINE_BUSTER.sub(' ', classad_text)
+
+    res = {}
+    lines = classad_text.split('\n')
+    for i in range(len(lines)):
+        line = lines[i].strip()
+        if(not(line)):
+            continue
+        if(line.lower().startswith('queue')):
+            res['Instances'] = classad._extract_num_instances(line)
+            continue
+        if(line.startswith('#')):
+            continue
+        raw_key, raw_val = line.split('=', 1)
+        key = raw_key.strip()
+        if(key[0] == '+'):
+            key = key[1:]
+        res[key] = legacy_value(raw_val.strip())
+    return(res)
+
+
+def load(file_names):
+    ads = []
+    for file_name in file_names:
+        ad = []
+        for line in open(file_name):
+            if(not line.strip()):
+                if(ad):
+                    ads.append(''.join(ad))
+                ad = []
+                continue
+            ad.append(line)
+        if(ad):
+            ads.append(''.join(ad))
+    return(ads)
+
+
+def bench(repetitions, file_names):
+    ads = load(file_names)
+    num_lines = sum([ad.count('\n') for ad in ads])
+    print('%d ads (%d lines) parsed %d times.' \
+          % (len(ads), num_lines, repetitions))
+
+    for ad in ads:
+        if(legacy_parse(ad) != classad._parse(ad)):
+            print('Error: the two parsers disagree on\n%s' % (ad))
+            return(1)
+
+    # Report the best of ROUNDS rounds, to minimize the noise.
+    timings = []
+    for parse in (legacy_parse, classad._parse):
+        best = None
+        for _ in range(ROUNDS):
+            t0 = time.time()
+            for _ in range(repetitions):
+                for ad in ads:
+                    parse(ad)
+            dt = time.time() - t0
+            if(best is None or dt < best):
+                best = dt
+        timings.append(best)
+        print('%-15s %7.3f s  %9.0f lines/s' \
+              % (parse.__name__, timings[-1],
+                 repetitions * num_lines / timings[-1]))
+    print('Speedup: %.2fx' % (timings[0] / timings[1]))
+    return(0)
+
+
+
+
+if(__name__ == '__main__'):
+    repetitions = 1000
+    file_names = [AD_FILE, ]
+    if(len(sys.argv) > 1):
+        repetitions = int(sys.argv[1])
+    if(len(sys.argv) > 2):
+        file_names = sys.argv[2:]
+    sys.exit(bench(repetitions, file_names))
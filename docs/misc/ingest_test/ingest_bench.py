@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Measure how many Blackboard rows per second we can write from job hook events,
+either one event at a time (blackboard.processHookEvent, i.e. what each job hook
+used to do) or in batches (blackboard.ingestMany, i.e. what blackboardd does).
+
+Usage
+    shell> ingest_bench.py [<number of jobs> [<batch size> [<target rows/s>]]]
+
+Each job generates three events (prepare_job, update_job and job_exit), just
+like a real Condor job would. The events are written to a scratch SQLite
+database. The script exits with a non zero exit code if ingestMany does not
+reach the target rate (2000 events/s by default).
+"""
+import os
+import sys
+import tempfile
+import time
+
+# Point OWL to a scratch database before importing it.
+(fid, DB_NAME) = tempfile.mkstemp(suffix='.sqlite')
+os.close(fid)
+os.environ['OWL_DATABASE_CONNECTION_STR'] = 'sqlite:///%s' % (DB_NAME)
+
+import elixir
+
+from owl import blackboard
+
+
+
+# Constants
+AD = '''\
+MyType = "Job"
+GlobalJobId = "bench.example.com#%(cluster)d.%(proc)d#1363299340"
+ClusterId = %(cluster)d
+ProcId = %(proc)d
+Owner = "owl"
+QDate = 1363299340
+JobStartDate = 1363299345
+JobDuration = 12.5
+CompletionDate = 0
+DAGNodeName = "PROC_MEF"
+DAGParentNodeNames = ""
+Arguments = "-i raw-%(proc)06d.fits -o out-%(proc)06d.fits"
+Cmd = "/usr/local/bin/processMef.py"
+Iwd = "/tmp"
+%(extra)s
+'''
+EXTRA = {'prepare_job': 'Instances = 4',
+         'update_job': 'JobPid = 1234\nJobState = "Running"',
+         'job_exit': 'JobPid = 1234\nJobState = "Exited"\nExitCode = 0'}
+
+
+
+def events(num_jobs, cluster):
+    res = []
+    for role in ('prepare_job', 'update_job', 'job_exit'):
+        for proc in range(num_jobs):
+            res.append((role, AD % {'cluster': cluster,
+                                    'proc': proc,
+                                    'extra': EXTRA[role]}))
+    return(res)
+
+
+def one_by_one(evts):
+    for (role, ad) in evts:
+        blackboard.processHookEvent(role, ad)
+    return
+
+
+def batched(evts, batch_size):
+    for i in range(0, len(evts), batch_size):
+        blackboard.ingestMany(evts[i:i+batch_size])
+    return
+
+
+def timeit(fn, *args):
+    t0 = time.time()
+    fn(*args)
+    return(time.time() - t0)
+
+
+
+if(__name__ == '__main__'):
+    num_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    target = float(sys.argv[3]) if len(sys.argv) > 3 else 2000.
+
+    blackboard._connect()
+    elixir.create_all()
+
+    num_events = 3 * num_jobs
+    dt_single = timeit(one_by_one, events(num_jobs, 1))
+    dt_batch = timeit(batched, events(num_jobs, 2), batch_size)
+    os.remove(DB_NAME)
+
+    rate = num_events / dt_batch
+    print('processHookEvent: %8.1f events/s' % (num_events / dt_single))
+    print('ingestMany:       %8.1f events/s (batch size %d)'
+          % (rate, batch_size))
+    print('Speedup:          %8.1fx' % (dt_single / dt_batch))
+    if(rate < target):
+        print('FAILED: below the target of %.1f events/s' % (target))
+        sys.exit(1)
+    sys.exit(0)
@@ -84,9 +84,9 @@ def process(datasets, repository, template_root, code_root=CODE_ROOT,
     salt = '_%d' % (int(1e6 * random.random()))
     work_dir += salt
 
+    # Get the instrument/mode Workflow instance (dataset independent)...
+    wflow = AcsSimpleWorkflow.shared(template_root=template_root)
     for dataset in datasets:
-        # Create a instrument/mode Workflow instance (dataset independent)...
-        wflow = AcsSimpleWorkflow(template_root=template_root)
         # ... and submit it to the grid (for this particular piece of data).
         _id = wflow.execute(code_root=code_root,
                             repository=repository,
@@ -38,7 +38,7 @@ Variables used by the job/workflow templates are
 
 Different types of middleware can be used to execute the workflow on the user
 data. The middleware is specified using the -g option and defaults to 'condor'.
-Supported middleware is 'condor', 'makefile' or 'xgrid'.
+Supported middleware is 'condor', 'local', 'makefile' or 'xgrid'.
 """
 import os
 import random
@@ -118,18 +118,25 @@ def process(datasets, repository, template_root, code_root=CODE_ROOT,
     salt = '_%d' % (int(1e6 * random.random()))
     work_dir += salt
 
-    for dataset in datasets:
-        # Create a instrument/mode Workflow instance (dataset independent)...
-        wflow = BcwWorkflow(template_root=template_root)
-        # ... and submit it to the grid (for this particular piece of data).
-        _id = wflow.execute(code_root=code_root,
-                            repository=repository,
-                            dataset=dataset,
-                            work_dir=work_dir,
-                            flavour=middleware)
-        print('Dataset %s submitted as job %s' % (dataset, _id))
-        print('  Work directory: %s' % (work_dir))
-    return(0)
+    # Get the instrument/mode Workflow instance (dataset independent)...
+    wflow = BcwWorkflow.shared(template_root=template_root)
+    # ... and submit it to the grid (for all our datasets in one go).
+    results = wflow.execute_many(datasets,
+                                 code_root=code_root,
+                                 repository=repository,
+                                 work_dir=work_dir,
+                                 flavour=middleware)
+    err = 0
+    for result in results:
+        if(result['error']):
+            print('Dataset %s NOT submitted: %s' % (result['dataset'],
+                                                    result['error']))
+            err = 1
+            continue
+        print('Dataset %s submitted as job %s' % (result['dataset'],
+                                                  result['job_id']))
+        print('  Work directory: %s' % (result['work_dir']))
+    return(err)
 
 
 
@@ -10,6 +10,8 @@ import config
 import blackboard
 import dag
 import classad
+import classad_expr
+import matchmaking
 import workflow
 
 import plugins
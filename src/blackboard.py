@@ -117,21 +117,67 @@ column:
     Dataset = "raw-000002.fits"
     Instances = 4
 """
+import base64
 import datetime
+import json
+import threading
+
 import elixir
 from sqlalchemy import desc, asc
+from sqlalchemy import and_, or_
 from sqlalchemy import func
+from sqlalchemy import bindparam, select
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy import Index
+from sqlalchemy.engine.reflection import Inspector
+from sqlalchemy.orm.exc import NoResultFound
 
 from classad import Job
 from config import DATABASE_CONNECTION_STR
+from config import DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW
+from config import DATABASE_POOL_RECYCLE, DATABASE_POOL_PRE_PING
+from config import DATABASE_STATEMENT_TIMEOUT
 import condorutils
 
 
 
 
+# Constants
+# The three Condor job hook roles we know how to handle (see owl_job_hook.py).
+HOOK_ROLES = ('prepare_job', 'update_job', 'job_exit')
+# Maximum number of rows/keys in a single statement issued by ingestMany.
+INGEST_CHUNK_SIZE = 500
+# The Blackboard columns copied to the narrow blackboard_summary table. These
+# are what owld returns for job listings plus what it needs to sort them.
+SUMMARY_FIELDS = ('GlobalJobId', 'DAGManJobId', 'Dataset', 'Owner',
+                  'JobStartDate', 'DAGNodeName', 'DAGParentNodeNames',
+                  'ExitCode', 'JobState', 'JobDuration', 'ClusterId', 'ProcId')
+# Cache used by _get_job_attrs_for_db.
+_COLUMN_NAMES = {}
+# Reference for the timestamps we store in pagination cursors.
+EPOCH = datetime.datetime(1970, 1, 1)
+# The one engine (and hence connection pool) each process uses. See _connect.
+_engine = None
+_engine_lock = threading.Lock()
+
+
+
+
 # Classes/Tables.
 class Blackboard(elixir.Entity):
     elixir.using_options(tablename='blackboard')
+    # Indexes for listEntries and listEntriesPage (filter on Owner and/or
+    # Dataset, sort on JobStartDate and GlobalJobId) and getOSFEntry (filter on
+    # DAGManJobId, sort on ClusterId and ProcId). The GlobalJobId prefix match
+    # uses the primary key.
+    elixir.using_table_options(
+        Index('ix_blackboard_JobStartDate', 'JobStartDate', 'GlobalJobId'),
+        Index('ix_blackboard_Owner_JobStartDate', 'Owner', 'JobStartDate',
+              'GlobalJobId'),
+        Index('ix_blackboard_Dataset_JobStartDate', 'Dataset', 'JobStartDate',
+              'GlobalJobId'),
+        Index('ix_blackboard_DAGManJobId', 'DAGManJobId', 'ClusterId',
+              'ProcId'))
 
     MyType = elixir.Field(elixir.Unicode(255))
     TargetType = elixir.Field(elixir.Unicode(255))
@@ -261,11 +307,166 @@ class Blackboard(elixir.Entity):
 
 
 
+class BlackboardSummary(elixir.Entity):
+    """
+    Narrow projection of the Blackboard table, holding only the SUMMARY_FIELDS
+    columns. It is kept up to date every time a Blackboard entry is written and
+    is what job listings should query: scanning its (short) rows and indexes is
+    much cheaper than scanning the ~130 column blackboard table.
+    """
+    elixir.using_options(tablename='blackboard_summary')
+    elixir.using_table_options(
+        Index('ix_blackboard_summary_JobStartDate', 'JobStartDate',
+              'GlobalJobId'),
+        Index('ix_blackboard_summary_Owner_JobStartDate', 'Owner',
+              'JobStartDate', 'GlobalJobId'),
+        Index('ix_blackboard_summary_Dataset_JobStartDate', 'Dataset',
+              'JobStartDate', 'GlobalJobId'),
+        Index('ix_blackboard_summary_DAGManJobId', 'DAGManJobId', 'ClusterId',
+              'ProcId'))
+
+    GlobalJobId = elixir.Field(elixir.Unicode(255), primary_key=True)
+    DAGManJobId = elixir.Field(elixir.Unicode(255))
+    Dataset = elixir.Field(elixir.Unicode(255))
+    Owner = elixir.Field(elixir.Unicode(255))
+    JobStartDate = elixir.Field(elixir.DateTime)
+    DAGNodeName = elixir.Field(elixir.Unicode(255))
+    DAGParentNodeNames = elixir.Field(elixir.Unicode(255))
+    ExitCode = elixir.Field(elixir.Integer)
+    JobState = elixir.Field(elixir.Unicode(255))
+    JobDuration = elixir.Field(elixir.Float)
+    ClusterId = elixir.Field(elixir.Integer)
+    ProcId = elixir.Field(elixir.Integer)
+
+    def __repr__(self):
+        return('BlackboardSummary(GlobalJobId=%s, ExitCode=%s)'
+               % (self.GlobalJobId, str(self.ExitCode)))
+
+    def todict(self):
+        return(dict([(key, val) for (key, val) in self.__dict__.items()
+                     if not key.startswith('_')]))
+
+
+
+def _as_bool(value):
+    """
+    Interpret the configuration value `value` as a boolean.
+    """
+    return(str(value).strip().lower() in ('1', 'true', 'yes', 'on'))
+
+
+def _ping_connection(dbapi_connection, connection_record, connection_proxy):
+    """
+    Pool checkout listener: make sure that the connection we are about to hand
+    out is still alive. If not, have the pool replace it with a new one.
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        try:
+            cursor.execute('SELECT 1')
+        except:
+            raise(exc.DisconnectionError())
+    finally:
+        cursor.close()
+    return
+
+
+def _set_statement_timeout(timeout):
+    """
+    Return a pool connect listener that limits the time each database statement
+    can take to `timeout` seconds, using whatever mechanism the database in use
+    supports.
+    """
+    flavour = DATABASE_CONNECTION_STR.split(':', 1)[0].split('+', 1)[0]
+
+    def listener(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            if(flavour.startswith('postgres')):
+                cursor.execute('SET statement_timeout TO %d'
+                               % (int(timeout * 1000)))
+            elif(flavour == 'mysql'):
+                cursor.execute('SET SESSION max_execution_time = %d'
+                               % (int(timeout * 1000)))
+            elif(hasattr(dbapi_connection, 'timeout')):
+                # pyodbc (i.e. mssql).
+                dbapi_connection.timeout = int(timeout)
+        finally:
+            cursor.close()
+        return
+    return(listener)
+
+
+def _connect():
+    """
+    Create the database engine (and hence its connection pool), bind the elixir
+    metadata and session to it and setup the mappings. Do that only once per
+    process so that long-lived processes (e.g. owld or blackboardd) keep
+    reusing the same connections. Return the engine.
+
+    The pool is configured using the pool_size, max_overflow, pool_recycle and
+    pool_pre_ping [Database] entries in owlrc (SQLite does not use a pool). The
+    statement_timeout entry limits the time (in seconds) each database
+    statement can take (0 means no limit; for SQLite it is the time to wait for
+    a database lock instead).
+
+    This is thread-safe: owld calls into the blackboard from its worker threads.
+    """
+    global _engine
+    if(_engine is not None):
+        return(_engine)
+
+    _engine_lock.acquire()
+    try:
+        if(_engine is None):
+            _engine = _createEngine()
+    finally:
+        _engine_lock.release()
+    return(_engine)
+
+
+def _createEngine():
+    """
+    Do the actual work for _connect (which holds _engine_lock while calling us)
+    and return the new engine.
+    """
+    kwds = {'echo': False}
+    connect_args = {}
+    timeout = float(DATABASE_STATEMENT_TIMEOUT or 0)
+    if(DATABASE_CONNECTION_STR.startswith('sqlite')):
+        if(timeout > 0):
+            connect_args['timeout'] = timeout
+    else:
+        kwds.update({'pool_size': int(DATABASE_POOL_SIZE),
+                     'max_overflow': int(DATABASE_MAX_OVERFLOW),
+                     'pool_recycle': int(DATABASE_POOL_RECYCLE)})
+    if(connect_args):
+        kwds['connect_args'] = connect_args
+    engine = create_engine(DATABASE_CONNECTION_STR, **kwds)
+
+    if(_as_bool(DATABASE_POOL_PRE_PING)):
+        event.listen(engine, 'checkout', _ping_connection)
+    if(timeout > 0 and not DATABASE_CONNECTION_STR.startswith('sqlite')):
+        event.listen(engine, 'connect', _set_statement_timeout(timeout))
+
+    elixir.metadata.bind = engine
+    elixir.session.configure(bind=engine)
+    elixir.setup_all()
+
+    # Keep blackboard_summary in sync with the ORM writes to blackboard.
+    event.listen(Blackboard.mapper, 'after_insert', _updateSummary)
+    event.listen(Blackboard.mapper, 'after_update', _updateSummary)
+    return(engine)
+
+
 def _get_job_attrs_for_db(job):
-    mapping = dict([(k.lower(), k) for k in Blackboard.__dict__.keys() \
-                    if k[0].isupper()])
+    mapping = _COLUMN_NAMES
+    if(not mapping):
+        # {lowercase column name: column name}, computed only once.
+        mapping.update([(k.lower(), k) for k in Blackboard.__dict__.keys() \
+                        if k[0].isupper()])
     attrs = dict([(mapping[k], v) for (k, v) in job.__dict__.items() \
-                  if k in mapping.keys()])
+                  if k in mapping])
     return(attrs)
 
 
@@ -301,15 +502,171 @@ def _convertTimeStamps(job):
     return
 
 
-def createEntry(job):
+def _fixCompletionDate(job):
+    """
+    Make sure that the job CompletionDate is not 0 (as it seems to be all the
+    time in job exit hooks).
+    """
+    if(not hasattr(job, 'CompletionDate') or job.CompletionDate == 0):
+        job.CompletionDate = job.JobStartDate + job.JobDuration
+    return
+
+
+def _chunks(seq, size=INGEST_CHUNK_SIZE):
+    """
+    Split the list `seq` in successive sub-lists of at most `size` elements.
+    """
+    return([seq[i:i+size] for i in range(0, len(seq), size)])
+
+
+def _existingJobIds(conn, table, job_ids):
+    """
+    Using the connection `conn`, return the set of the GlobalJobIds in
+    `job_ids` which are already in `table`.
+    """
+    key = table.c.GlobalJobId
+
+    existing = set()
+    for chunk in _chunks(job_ids):
+        existing.update([r[0] for r in
+                         conn.execute(select([key], key.in_(chunk)))])
+    return(existing)
+
+
+def _upsertRows(conn, table, rows, job_ids, existing=None):
+    """
+    Using the connection `conn`, write `rows` ({GlobalJobId: {column: value}})
+    to `table`, inserting the rows whose GlobalJobId is not in the table yet
+    and updating the others. `job_ids` is the list of GlobalJobIds in `rows`,
+    which defines the order in which rows are written. `existing`, if given, is
+    the set of GlobalJobIds already in `table` (see _existingJobIds).
+
+    Instead of one statement per row, issue one SELECT for the existing
+    GlobalJobIds and write the rows with (executemany) INSERT and UPDATE
+    statements, INGEST_CHUNK_SIZE rows at a time.
+    """
+    key = table.c.GlobalJobId
+
+    # Which of these jobs do we know about already?
+    if(existing is None):
+        existing = _existingJobIds(conn, table, job_ids)
+
+    # New entries: one INSERT for all of them. All rows need the same
+    # columns for that to work.
+    new_rows = [rows[j] for j in job_ids if j not in existing]
+    columns = set()
+    for row in new_rows:
+        columns.update(row.keys())
+    new_rows = [dict([(c, row.get(c)) for c in columns])
+                for row in new_rows]
+    for chunk in _chunks(new_rows):
+        conn.execute(table.insert(), chunk)
+
+    # Existing entries: one UPDATE per distinct set of columns. We need to
+    # rename the bind parameters as they cannot have the same name as the
+    # columns they update. They also need the column types: without them,
+    # values are not converted the way the ORM and INSERT do (e.g. SQLite
+    # would get DateTimes in a different text format).
+    groups = {}
+    for job_id in job_ids:
+        if(job_id in existing):
+            row = rows[job_id]
+            cols = tuple(sorted([c for c in row if c != 'GlobalJobId']))
+            groups.setdefault(cols, []).append(row)
+    for (cols, group) in groups.items():
+        if(not cols):
+            continue
+        stmt = table.update() \
+                    .where(key == bindparam('_GlobalJobId', type_=key.type)) \
+                    .values(dict([(c, bindparam('_' + c, type_=table.c[c].type))
+                                  for c in cols]))
+        params = [dict([('_' + c, row[c]) for c in cols] +
+                       [('_GlobalJobId', row['GlobalJobId'])])
+                  for row in group]
+        for chunk in _chunks(params):
+            conn.execute(stmt, chunk)
+    return
+
+
+def _summaryRows(rows):
+    """
+    Project `rows` ({GlobalJobId: {column: value}}) onto the columns of the
+    blackboard_summary table.
+    """
+    return(dict([(job_id, dict([(c, v) for (c, v) in row.items()
+                                if c in SUMMARY_FIELDS]))
+                 for (job_id, row) in rows.items()]))
+
+
+def _updateSummary(mapper, connection, target):
+    """
+    Mapper listener: keep the blackboard_summary row of the Blackboard entry
+    `target` in sync with it whenever the latter is inserted or updated.
+    """
+    row = dict([(c, getattr(target, c)) for c in SUMMARY_FIELDS])
+    _upsertRows(connection, BlackboardSummary.table,
+                {target.GlobalJobId: row}, [target.GlobalJobId])
+    return
+
+
+def createIndexes():
+    """
+    Create the Blackboard and BlackboardSummary indexes which are not in the
+    database yet and return their names. This is only needed when upgrading an
+    existing blackboard database: elixir.create_all() leaves existing tables
+    (and hence their indexes) alone.
+    """
+    # Define the database connection.
+    engine = _connect()
+
+    # Index.create() cannot skip existing indexes by itself.
+    inspector = Inspector.from_engine(engine)
+    created = []
+    for table in (Blackboard.table, BlackboardSummary.table):
+        known = set([i['name'] for i in inspector.get_indexes(table.name)])
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            if(index.name not in known):
+                index.create(bind=engine)
+                created.append(index.name)
+    return(created)
+
+
+def rebuildSummary():
+    """
+    (Re)create the content of the blackboard_summary table from scratch using
+    what is in the blackboard table. This is only needed when upgrading an
+    existing blackboard database, as the summary is otherwise maintained every
+    time a Blackboard entry is written.
+    """
+    # Define the database connection.
+    _connect()
+
+    columns = [Blackboard.table.c[c] for c in SUMMARY_FIELDS]
+    try:
+        conn = elixir.session.connection()
+        conn.execute(BlackboardSummary.table.delete())
+
+        result = conn.execute(select(columns))
+        rows = result.fetchmany(INGEST_CHUNK_SIZE)
+        while(rows):
+            conn.execute(BlackboardSummary.table.insert(),
+                         [dict(zip(SUMMARY_FIELDS, row)) for row in rows])
+            rows = result.fetchmany(INGEST_CHUNK_SIZE)
+        elixir.session.commit()
+    except:
+        elixir.session.rollback()
+        raise
+    return
+
+
+def createEntry(job, commit=True):
     """
     Insert the corresponding Blackboard entry in the database. Derive the
     Dataset name form the job.Arguments string, if job.Dataset is not defined.
+    If commit=False, leave it to the caller to commit the current transaction.
     """
     # Define the database connection.
-    elixir.metadata.bind = DATABASE_CONNECTION_STR
-    elixir.metadata.bind.echo = False
-    elixir.setup_all()
+    _connect()
 
     # Fix timestamps and dataset name.
     _convertTimeStamps(job)
@@ -318,18 +675,18 @@ def createEntry(job):
 
     entry = Blackboard(**attrs)
 
-    elixir.session.commit()
+    if(commit):
+        elixir.session.commit()
     return
 
 
-def updateEntry(job):
+def updateEntry(job, commit=True):
     """
-    Fetch the existing entry for job and update it.
+    Fetch the existing entry for job and update it. If commit=False, leave it to
+    the caller to commit the current transaction.
     """
     # Define the database connection.
-    elixir.metadata.bind = DATABASE_CONNECTION_STR
-    elixir.metadata.bind.echo = False
-    elixir.setup_all()
+    _connect()
 
     # Fix timestamps.
     _convertTimeStamps(job)
@@ -351,22 +708,26 @@ def updateEntry(job):
         if(attrs[key] != getattr(entry, key)):
             setattr(entry, key, attrs[key])
             modified += 1
-    if(modified):
+    if(modified and commit):
         elixir.session.commit()
     return
 
 
 def listEntries(owner=None, dataset=None, limit=None, offset=None,
-                newest_first=True):
+                newest_first=True, summary=False, fields=None):
     """
     List all known Blackboard entries and return them to the caller. Implement
     pagination via limit and offset. If newest_first=True, then the results are
     sorted by descending JobStartDate. The sorting is reversed otherwise.
+
+    If summary=True, return BlackboardSummary entries (i.e. only the
+    SUMMARY_FIELDS columns) instead, which is much faster.
+
+    If `fields` is not None, only select the given columns and return named
+    tuples instead of full entries (see _select).
     """
     # Define the database connection.
-    elixir.metadata.bind = DATABASE_CONNECTION_STR
-    elixir.metadata.bind.echo = False
-    elixir.setup_all()
+    _connect()
 
     try:
         limit = int(limit)
@@ -389,15 +750,16 @@ def listEntries(owner=None, dataset=None, limit=None, offset=None,
     if(offset < 0):
         offset = 0
 
-    query = Blackboard.query
+    entity = BlackboardSummary if summary else Blackboard
+    query = _select(entity, fields)
     if(dataset):
-        query = query.filter_by(Dataset=dataset)
+        query = query.filter(entity.Dataset == dataset)
     if(owner):
-        query = query.filter_by(Owner=owner)
+        query = query.filter(entity.Owner == owner)
     if(newest_first):
-        query = query.order_by(desc(Blackboard.JobStartDate))
+        query = query.order_by(desc(entity.JobStartDate))
     else:
-        query = query.order_by(asc(Blackboard.JobStartDate))
+        query = query.order_by(asc(entity.JobStartDate))
 
     if(limit is not None):
         query = query.limit(limit)
@@ -406,25 +768,188 @@ def listEntries(owner=None, dataset=None, limit=None, offset=None,
     return(query.all())
 
 
+def _select(entity, fields=None, required=()):
+    """
+    Return a query over `entity` (i.e. Blackboard or BlackboardSummary). If
+    `fields` is None, the query returns full `entity` instances. Otherwise it
+    only selects the columns named in `fields` (plus those in `required`, which
+    the caller needs internally) and returns lightweight named tuples instead.
+    These support attribute access just like `entity` instances, but skip the
+    ORM instance creation and identity map overhead and do not transfer
+    columns nobody asked for.
+    """
+    if(fields is None):
+        return(entity.query)
+
+    names = list(fields) + [f for f in required if f not in fields]
+    try:
+        columns = [entity.table.c[name] for name in names]
+    except KeyError, e:
+        raise(ValueError('Unknown %s field %s' % (entity.__name__, str(e))))
+    return(elixir.session.query(*columns))
+
+
+def _encodeCursor(phase, jobStartDate, globalJobId):
+    """
+    Turn the position of the last entry of a page into an opaque string token.
+    """
+    usecs = None
+    if(jobStartDate is not None):
+        delta = jobStartDate - EPOCH
+        usecs = (delta.days * 86400 + delta.seconds) * 1000000 + \
+                delta.microseconds
+    raw = json.dumps([phase, usecs, globalJobId])
+    return(base64.urlsafe_b64encode(raw))
+
+
+def _decodeCursor(cursor):
+    """
+    Inverse of _encodeCursor. Raise ValueError if `cursor` is not a valid token.
+    """
+    try:
+        (phase, usecs, globalJobId) = json.loads(
+            base64.urlsafe_b64decode(str(cursor)))
+        phase = int(phase)
+    except:
+        raise(ValueError('Invalid cursor %s' % (str(cursor))))
+
+    jobStartDate = None
+    if(usecs is not None):
+        jobStartDate = EPOCH + datetime.timedelta(microseconds=usecs)
+    return(phase, jobStartDate, globalJobId)
+
+
+def listEntriesPage(owner=None, dataset=None, limit=20, cursor=None,
+                    newest_first=True, summary=False, fields=None):
+    """
+    Keyset (as opposed to limit/offset) pagination over the Blackboard entries.
+    Return the first `limit` entries (optionally restricted to the given `owner`
+    and/or `dataset`) following the position identified by `cursor` together
+    with the cursor of the next page:
+        ([entry, ...], next cursor)
+    Start from the first page if `cursor` is None. The next cursor is None when
+    there are no more pages. Cursors are opaque strings: callers should simply
+    pass back whatever the previous call returned. If `limit` is None (or
+    anything but a positive integer) return all the remaining entries.
+
+    Results are sorted by descending JobStartDate (ascending if
+    newest_first=False) and then by GlobalJobId. Entries without a JobStartDate
+    (e.g. jobs that have not started yet) come last. Unlike with listEntries
+    offsets, each page costs the same no matter how deep it is.
+
+    If summary=True, return BlackboardSummary entries (i.e. only the
+    SUMMARY_FIELDS columns) instead, which is much faster.
+
+    If `fields` is not None, only select the given columns (plus JobStartDate
+    and GlobalJobId, which we need for the cursor) and return named tuples
+    instead of full entries (see _select).
+    """
+    # Define the database connection.
+    _connect()
+
+    try:
+        limit = int(limit)
+    except:
+        limit = None
+    if(limit is not None and limit <= 0):
+        limit = None
+
+    # The position of the last entry we returned. Entries with a JobStartDate
+    # are returned first (phase 0), the ones without one afterwards (phase 1).
+    (phase, jobStartDate, globalJobId) = (0, None, None)
+    if(cursor is not None):
+        (phase, jobStartDate, globalJobId) = _decodeCursor(cursor)
+
+    entity = BlackboardSummary if summary else Blackboard
+    if(newest_first):
+        order = desc
+        after = lambda column, value: column < value
+    else:
+        order = asc
+        after = lambda column, value: column > value
+
+    query = _select(entity, fields, ('JobStartDate', 'GlobalJobId'))
+    if(dataset):
+        query = query.filter(entity.Dataset == dataset)
+    if(owner):
+        query = query.filter(entity.Owner == owner)
+
+    entries = []
+    if(phase == 0):
+        dated = query.filter(entity.JobStartDate != None)
+        if(jobStartDate is not None):
+            dated = dated.filter(
+                or_(after(entity.JobStartDate, jobStartDate),
+                    and_(entity.JobStartDate == jobStartDate,
+                         after(entity.GlobalJobId, globalJobId))))
+        dated = dated.order_by(order(entity.JobStartDate),
+                               order(entity.GlobalJobId))
+        if(limit is not None):
+            dated = dated.limit(limit)
+        entries = dated.all()
+
+        # Did we run out of dated entries? If so, move on to the others.
+        if(limit is None or len(entries) < limit):
+            (phase, globalJobId) = (1, None)
+
+    if(phase == 1 and (limit is None or len(entries) < limit)):
+        undated = query.filter(entity.JobStartDate == None)
+        if(globalJobId is not None):
+            undated = undated.filter(after(entity.GlobalJobId, globalJobId))
+        undated = undated.order_by(order(entity.GlobalJobId))
+        if(limit is not None):
+            undated = undated.limit(limit - len(entries))
+        entries += undated.all()
+
+    if(limit is None or len(entries) < limit):
+        return((entries, None))
+    last = entries[-1]
+    phase = 0 if last.JobStartDate is not None else 1
+    return((entries, _encodeCursor(phase, last.JobStartDate, last.GlobalJobId)))
+
+
 def getEntry(globalJobId):
     """
     Retrieve a single blackboard entry given its GlobalJobId `globalJobId`.
     """
     # Define the database connection.
-    elixir.metadata.bind = DATABASE_CONNECTION_STR
-    elixir.metadata.bind.echo = False
-    elixir.setup_all()
+    _connect()
 
     query = Blackboard.query.filter_by(GlobalJobId=globalJobId)
     return(query.one())
 
 
-def getOSFEntry(dagManJobId):
+def getEntries(globalJobIds):
+    """
+    Retrieve the blackboard entries with the given GlobalJobIds `globalJobIds`
+    using as few queries as possible (one per INGEST_CHUNK_SIZE ids). Return a
+    dictionary {GlobalJobId: entry}. Ids with no corresponding entry are not
+    in the dictionary.
+    """
+    # Define the database connection.
+    _connect()
+
+    job_ids = list(set([unicode(job_id) for job_id in globalJobIds]))
+    entries = {}
+    for chunk in _chunks(job_ids):
+        query = Blackboard.query.filter(Blackboard.GlobalJobId.in_(chunk))
+        entries.update([(entry.GlobalJobId, entry) for entry in query])
+    return(entries)
+
+
+def getOSFEntry(dagManJobId, summary=False, fields=None):
     """
     Given a DAGManJobId `dagManJobId`, find all the blackboard entries that are
     associated with that DAG and present them in an OSF-like manner:
         Dataset, Owner, DAGManJobId, [Nodei JobState, Nodei ExitCode, ]
 
+    If summary=True, use BlackboardSummary entries (i.e. only the
+    SUMMARY_FIELDS columns) instead, which is much faster.
+
+    If `fields` is not None, only select the given columns (plus Dataset, Owner
+    and DAGManJobId, which we need for the OSF-like entry) and use named tuples
+    instead of full entries (see _select).
+
     WARNING: while this works also if you do not specify a full Global Job ID
     but just a ClusterId (which incidentally is what is stored in the database
     as well as in each Job ClassAd), there is a risk. The risk is that we end up
@@ -438,9 +963,7 @@ def getOSFEntry(dagManJobId):
     ClusterId counter...
     """
     # Define the database connection.
-    elixir.metadata.bind = DATABASE_CONNECTION_STR
-    elixir.metadata.bind.echo = False
-    elixir.setup_all()
+    _connect()
 
     osfEntries = []
 
@@ -454,12 +977,14 @@ def getOSFEntry(dagManJobId):
         [submit_host, jobId, _] = condorutils.parse_globaljobid(dagManJobId)
         dagManJobId = int(jobId.split('.')[0])
 
-    query = Blackboard.query.filter_by(DAGManJobId=unicode(dagManJobId))
+    entity = BlackboardSummary if summary else Blackboard
+    query = _select(entity, fields, ('Dataset', 'Owner', 'DAGManJobId'))
+    query = query.filter(entity.DAGManJobId == unicode(dagManJobId))
     if(submit_host):
         # This is why global job ids are much safer (but not super safe).
         submit_host = unicode(submit_host)
-        query = query.filter(Blackboard.GlobalJobId.startswith(submit_host))
-    entries = query.order_by(Blackboard.ClusterId, Blackboard.ProcId).all()
+        query = query.filter(entity.GlobalJobId.startswith(submit_host))
+    entries = query.order_by(entity.ClusterId, entity.ProcId).all()
     if(not entries):
         return
 
@@ -471,10 +996,12 @@ def getOSFEntry(dagManJobId):
     return(osfEntry)
 
 def getMaxClusterId():
+    """
+    Return the largest ClusterId in the blackboard or 0 if the blackboard is
+    empty.
+    """
     # Define the database connection.
-    elixir.metadata.bind = DATABASE_CONNECTION_STR
-    elixir.metadata.bind.echo = False
-    elixir.setup_all()
+    _connect()
 
     entry = elixir.session.query(func.max(Blackboard.ClusterId)).one()
     if(entry and len(entry) == 1 and entry[0] is not None):
@@ -483,6 +1010,116 @@ def getMaxClusterId():
 
 
 
+def processHookEvent(role, job_ad, commit=True):
+    """
+    Given the raw ClassAd `job_ad` passed to a Condor job hook playing the role
+    `role` (one of HOOK_ROLES), create, update or close the corresponding
+    Blackboard entry. If commit=False, leave it to the caller to commit the
+    current transaction (e.g. to commit many events at once).
+
+    This is the code shared by owl_job_hook.py and blackboardd.py.
+    """
+    if(role not in HOOK_ROLES):
+        raise(ValueError('Unsupported hook role %s' % (str(role))))
+
+    job = Job.new_from_classad(job_ad)
+    if(role == 'update_job'):
+        return(updateEntry(job, commit=commit))
+
+    if(role == 'job_exit'):
+        _fixCompletionDate(job)
+        return(closeEntry(job, commit=commit))
+
+    # We could be in a rescue DAG, meaning that the blackboard entry might
+    # already be there. If this is the case, we just update that entry and not
+    # create a new one.
+    try:
+        entry = getEntry(job.GlobalJobId)
+    except:
+        entry = None
+    if(entry):
+        return(updateEntry(job, commit=commit))
+    return(createEntry(job, commit=commit))
+
+
+
+def ingestMany(events):
+    """
+    Write the job hook `events`, a list of (role, job) tuples where role is one
+    of HOOK_ROLES and job is either a raw job ClassAd or a Job instance, to the
+    Blackboard in a single transaction.
+
+    The result is exactly that of calling processHookEvent on each event in
+    turn: prepare_job creates the entry of an unknown job (deriving its Dataset
+    name) and updates that of a known one, leaving Instances alone; update_job
+    and job_exit update the entry of a known job and raise NoResultFound, just
+    like updateEntry, for an unknown one (in which case nothing is written).
+
+    Events are coalesced per GlobalJobId: the last value of each attribute
+    wins. Then, instead of one SELECT, one Python-side comparison and one
+    COMMIT per event, we issue one SELECT for the existing GlobalJobIds and
+    write the rows with (executemany) INSERT and UPDATE statements,
+    INGEST_CHUNK_SIZE rows at a time.
+
+    Return the number of Blackboard entries written.
+    """
+    # Define the database connection.
+    _connect()
+
+    jobs = []
+    for (role, job) in events:
+        if(role not in HOOK_ROLES):
+            raise(ValueError('Unsupported hook role %s' % (str(role))))
+        if(isinstance(job, basestring)):
+            job = Job.new_from_classad(job)
+
+        if(role == 'job_exit'):
+            _fixCompletionDate(job)
+        _convertTimeStamps(job)
+        jobs.append((role, job))
+    if(not jobs):
+        return(0)
+
+    try:
+        conn = elixir.session.connection()
+
+        # Coalesce the events into {GlobalJobId: {column: value}}. Keep track
+        # of the order in which we first saw each job.
+        job_ids = []
+        seen = set()
+        for (_, job) in jobs:
+            if(job.GlobalJobId not in seen):
+                seen.add(job.GlobalJobId)
+                job_ids.append(job.GlobalJobId)
+        existing = _existingJobIds(conn, Blackboard.table, job_ids)
+
+        rows = {}
+        for (role, job) in jobs:
+            job_id = job.GlobalJobId
+            if(job_id in existing or job_id in rows):
+                # See updateEntry.
+                attrs = _get_job_attrs_for_db(job)
+                attrs.pop('Instances', None)
+                rows.setdefault(job_id, {}).update(attrs)
+            elif(role == 'prepare_job'):
+                # See createEntry.
+                job.Dataset = _extractDatasetName(job)
+                rows[job_id] = _get_job_attrs_for_db(job)
+            else:
+                raise(NoResultFound('No Blackboard entry for %s' % (job_id)))
+        job_ids = [j for j in job_ids if j in rows]
+
+        _upsertRows(conn, Blackboard.table, rows, job_ids, existing)
+        _upsertRows(conn, BlackboardSummary.table,
+                    _summaryRows(rows), job_ids)
+        elixir.session.commit()
+    except:
+        elixir.session.rollback()
+        raise
+    return(len(job_ids))
+
+
+
 # Aliases
 closeEntry = updateEntry
 
@@ -6,7 +6,9 @@ bit like micro database engines, in a sense.
 
 More information here: http://research.cs.wisc.edu/condor/classad/
 """
+import collections
 import re
+import threading
 
 import condorutils
 
@@ -16,10 +18,66 @@ import condorutils
 # lines can be split over multiple lines using a \. When we find one, we get rid
 # of it, append a space get the following like and stitch it to the current one.
 MULTILINE_BUSTER = re.compile(' *\\\\ *\n *')
+# Numeric ClassAd literals: group 1 is set for integers, not for floats.
+_NUMBER = re.compile('([+-]?[0-9]+)\\Z|[+-]?(?:[0-9]+\\.?[0-9]*|\\.[0-9]+)' +
+                     '(?:[eE][+-]?[0-9]+)?\\Z')
+# Non numeric strings float() accepts (possibly with a sign).
+_FLOAT_WORDS = ('inf', 'infinity', 'nan')
+# Maximum number of attribute names in the _fold cache.
+MAX_FOLDED = 10000
+# Maximum number of AdSchema instances shared via _SCHEMAS (and, for each of
+# them, of schemas in its extension table). Ads whose schema was evicted keep
+# working, new ads with the same attribute names just get a new schema.
+MAX_SCHEMAS = 1000
+# Cache of the lower-case (interned) versions of ClassAd attribute names.
+_FOLDED = {}
+# Shared key tables of CompactClassAd instances: {attribute names: AdSchema},
+# least recently used first.
+_SCHEMAS = collections.OrderedDict()
+_SCHEMAS_LOCK = threading.Lock()
+
+
+
+class Expression(unicode):
+    """
+    ClassAd value which is neither a string nor a number nor a boolean, e.g.
+    (Arch == "X86_64") && (Memory > 1024). For all intents and purposes this is
+    just a unicode string, but it allows code evaluating ClassAd expressions
+    (see classad_expr) to tell `Foo = "bar"` (the string bar) from `Foo = bar`
+    (the value of the bar attribute).
+    """
+    pass
 
 
 
 # Helper functions.
+def _fold(name):
+    """
+    Return the lower-case version of the attribute name `name`, caching it so
+    that case-insensitive lookups do not have to call lower() every time.
+    """
+    try:
+        return(_FOLDED[name])
+    except KeyError:
+        pass
+
+    # Unicode names are folded as such: only pure ASCII ones can be turned into
+    # (interned) plain strings.
+    folded = name.lower()
+    if(isinstance(folded, unicode)):
+        try:
+            folded = folded.encode('ascii')
+        except UnicodeEncodeError:
+            pass
+    if(isinstance(folded, str)):
+        folded = intern(folded)
+
+    if(len(_FOLDED) >= MAX_FOLDED):
+        _FOLDED.clear()
+    _FOLDED[name] = folded
+    return(folded)
+
+
 def parse_classad_environment(raw_value):
     """
     Given the raw value of the Environment CLassAd string, `raw_value`, parse it
@@ -52,23 +110,30 @@ def parse_classad_environment(raw_value):
 def _parse_classad_value(raw_value):
     """
     Parse a single ClassAd value and cast it to the appropriate Python type.
+    The type is inferred from the first character of the value (and, for
+    numbers, a regular expression) rather than trying int() and float() in turn
+    and catching the exceptions: most values are either strings or expressions.
     """
-    if(raw_value.startswith('"') and raw_value.endswith('"')):
+    first = raw_value[:1]
+    if(first == '"' and raw_value.endswith('"')):
         return(unicode(raw_value[1:-1]))
-    if(raw_value.upper() == 'FALSE'):
+    if(first in ('f', 'F') and raw_value.upper() == 'FALSE'):
         return(False)
-    if(raw_value.upper() == 'TRUE'):
+    if(first in ('t', 'T') and raw_value.upper() == 'TRUE'):
         return(True)
+    if(first.isdigit() or first in ('+', '-', '.')):
+        match = _NUMBER.match(raw_value)
+        if(match):
+            if(match.group(1)):
+                return(int(raw_value))
+            return(float(raw_value))
+    if(raw_value.lstrip('+-').lower() in _FLOAT_WORDS):
+        try:
+            return(float(raw_value))
+        except ValueError:
+            pass
     try:
-        return(int(raw_value))
-    except (TypeError, ValueError):
-        pass
-    try:
-        return(float(raw_value))
-    except (TypeError, ValueError):
-        pass
-    try:
-        return(unicode(raw_value))
+        return(Expression(raw_value))
     except (UnicodeDecodeError, UnicodeEncodeError):
         pass
     raise(NotImplementedError('Unable to parse `%s`.' % (raw_value)))
@@ -81,43 +146,97 @@ def _parse(classad_text):
         {key: val}
     dictionary.
     """
-    # First of all, handle line continuations.
-    classad_text = MULTILINE_BUSTER.sub(' ', classad_text)
+    # First of all, handle line continuations (if any).
+    if('\\' in classad_text):
+        classad_text = MULTILINE_BUSTER.sub(' ', classad_text)
+    return(_parse_lines(classad_text.split('\n')))
+
 
+def _parse_lines(lines, wanted=None):
+    """
+    Parse the ClassAd lines `lines` (with no line continuations) in a single
+    pass and return the corresponding {key: val} dictionary. If `wanted` is not
+    None, only keep the keys whose lower-case version is in `wanted`.
+    """
     res = {}
-    lines = classad_text.split('\n')
-    for i in range(len(lines)):
-        line = lines[i].strip()
+    for line in lines:
+        line = line.strip()
 
-        # Handle empty lines.
-        if(not(line)):
+        # Handle empty lines and simple, full line comments.
+        if(not line or line[0] == '#'):
             continue
 
         # Handle the Queue command, which does not have an = sign.
-        if(line.lower().startswith('queue')):
-            res['Instances'] = _extract_num_instances(line)
+        if(line[0] in 'qQ' and line[:5].lower() == 'queue'):
+            if(wanted is None or 'instances' in wanted):
+                res['Instances'] = _extract_num_instances(line)
             continue
 
-        # Handle simple, full line comments.
-        if(line.startswith('#')):
-            continue
-
-        try:
-            raw_key, raw_val = line.split('=', 1)
-        except:
+        (raw_key, sep, raw_val) = line.partition('=')
+        key = raw_key.strip()
+        if(not sep or not key):
             raise(Exception('Cannot parse line "%s"' % (line)))
 
         # Remember to strip any leading + sign from the key name.
-        key = raw_key.strip()
         if(key[0] == '+'):
             key = key[1:]
-        val = _parse_classad_value(raw_val.strip())
-        if(res.has_key(key)):
+        if(wanted is not None and key.lower() not in wanted):
+            continue
+
+        # Strings and non negative integers are the most common values: handle
+        # them right here.
+        raw_val = raw_val.strip()
+        if(raw_val[:1] == '"' and raw_val.endswith('"')):
+            val = unicode(raw_val[1:-1])
+        elif(raw_val.isdigit()):
+            val = int(raw_val)
+        else:
+            val = _parse_classad_value(raw_val)
+        if(key in res):
             raise(NotImplementedError('ClassAd arrays are not supported.'))
         res[key] = val
     return(res)
 
 
+def iter_parse(lines, attributes=None):
+    """
+    Incrementally parse the ClassAds in `lines`, any iterable of text lines
+    (e.g. a file or a pipe) with ClassAds separated by empty lines, as produced
+    by condor_status -long or condor_q -long. Yield one {key: val} dictionary
+    per ClassAd, as soon as its last line has been read: memory usage does not
+    depend on how many ClassAds there are.
+
+    If `attributes` is not None, only keep the (case-insensitive) attribute
+    names it contains. The values of all other attributes are not even parsed.
+    """
+    wanted = None
+    if(attributes is not None):
+        wanted = set([name.lower() for name in attributes])
+
+    ad = []
+    continued = ''
+    for line in lines:
+        line = line.strip()
+
+        # Handle line continuations (see MULTILINE_BUSTER).
+        if(line.endswith('\\')):
+            continued += line[:-1].rstrip() + ' '
+            continue
+        if(continued):
+            line = continued + line
+            continued = ''
+
+        # Empty lines separate ClassAds.
+        if(line):
+            ad.append(line)
+        elif(ad):
+            yield _parse_lines(ad, wanted)
+            ad = []
+    if(ad):
+        yield _parse_lines(ad, wanted)
+    return
+
+
 def _extract_num_instances(line):
     """
     Parse a Queue command and return the number of instances of the given Job to
@@ -161,16 +280,17 @@ class ClassAd(object):
         return
 
     def __getattr__(self, name):
-        if(name.islower()):
+        folded = _fold(name)
+        if(folded == name):
             raise(AttributeError("'%s' object has no attribute '%s'" \
                                  % (self.__class__.__name__, name)))
-        return(getattr(self, name.lower()))
+        return(getattr(self, folded))
 
     def __setattr__(self, name, value):
-        return(super(ClassAd, self).__setattr__(name.lower(), value))
+        return(super(ClassAd, self).__setattr__(_fold(name), value))
 
     def __delattr__(self, name):
-        return(super(ClassAd, self).__delattr__(name.lower()))
+        return(super(ClassAd, self).__delattr__(_fold(name)))
 
     def todict(self):
         """
@@ -180,6 +300,118 @@ class ClassAd(object):
 
 
 
+class AdSchema(object):
+    """
+    Key table shared by all the CompactClassAd instances with the same set of
+    (lower-case) attribute names. Machine ClassAds in a pool and Job ClassAds in
+    a blackboard typically share a handful of schemas.
+    """
+    __slots__ = ('names', 'index', '_extensions')
+
+    @classmethod
+    def get(cls, names):
+        """
+        Return the (shared) schema for the tuple of lower-case attribute names
+        `names`.
+        """
+        with _SCHEMAS_LOCK:
+            schema = _SCHEMAS.pop(names, None)
+            if(schema is None):
+                schema = cls(names)
+            _SCHEMAS[names] = schema
+            while(len(_SCHEMAS) > MAX_SCHEMAS):
+                _SCHEMAS.popitem(last=False)
+        return(schema)
+
+    def __init__(self, names):
+        self.names = names
+        self.index = dict([(name, i) for (i, name) in enumerate(names)])
+        self._extensions = {}
+        return
+
+    def extend(self, name):
+        """
+        Return the schema with all of our attribute names plus `name`.
+        """
+        schema = self._extensions.get(name)
+        if(schema is None):
+            schema = AdSchema.get(self.names + (name, ))
+            if(len(self._extensions) >= MAX_SCHEMAS):
+                self._extensions.clear()
+            self._extensions[name] = schema
+        return(schema)
+
+
+class CompactClassAd(object):
+    """
+    Memory efficient alternative to ClassAd, for when we have to keep a lot of
+    them around (e.g. the machine ClassAds of a large pool). Instead of a per
+    instance __dict__, each CompactClassAd holds a reference to a shared
+    AdSchema (i.e. its attribute names and their positions) and a list of
+    values. Attribute access is case-insensitive, just like with ClassAd.
+    """
+    __slots__ = ('_schema', '_values')
+
+    @classmethod
+    def new_from_classad(cls, ad):
+        """
+        Given a Condor ClassAd text, parse it and create the corresponding
+        CompactClassAd instance. Unlike ClassAd.new_from_classad, we do not keep
+        the raw ClassAd around.
+        """
+        return(cls(**_parse(ad)))
+
+    def __init__(self, **kw):
+        values = dict([(_fold(k), v) for (k, v) in kw.items()])
+        names = tuple(sorted(values.keys()))
+        object.__setattr__(self, '_schema', AdSchema.get(names))
+        object.__setattr__(self, '_values', [values[k] for k in names])
+        return
+
+    def __getattr__(self, name):
+        try:
+            return(self._values[self._schema.index[_fold(name)]])
+        except KeyError:
+            raise(AttributeError("'%s' object has no attribute '%s'" \
+                                 % (self.__class__.__name__, name)))
+
+    def __setattr__(self, name, value):
+        folded = _fold(name)
+        i = self._schema.index.get(folded)
+        if(i is None):
+            object.__setattr__(self, '_schema', self._schema.extend(folded))
+            self._values.append(value)
+        else:
+            self._values[i] = value
+        return
+
+    def __delattr__(self, name):
+        values = self.todict()
+        try:
+            del(values[_fold(name)])
+        except KeyError:
+            raise(AttributeError("'%s' object has no attribute '%s'" \
+                                 % (self.__class__.__name__, name)))
+        names = tuple(sorted(values.keys()))
+        object.__setattr__(self, '_schema', AdSchema.get(names))
+        object.__setattr__(self, '_values', [values[k] for k in names])
+        return
+
+    def __getstate__(self):
+        return(self.todict())
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+        return
+
+    def todict(self):
+        """
+        Convert to a simple dictionary (with lower-case keys, like ClassAd).
+        """
+        return(dict(zip(self._schema.names, self._values)))
+
+
+
 class Job(ClassAd):
     """
     ClassAd subclass describing a Job i.e. a ClassAd with a MyType == Job. This
@@ -0,0 +1,720 @@
+"""
+ClassAd expression evaluation.
+
+ClassAd attributes like
+    Requirements = (Arch == "X86_64") && (TARGET.Memory >= RequestMemory)
+    Rank = ifThenElse(isUndefined(KFlops), 0, KFlops / 1000.)
+are expressions, which the parser in classad keeps as classad.Expression
+strings. This module compiles such strings (once) into Python closures which can
+then be evaluated (many times) in the context of a pair of ClassAds: MY (the ad
+the expression belongs to) and TARGET (the ad it is being matched against).
+This lets us do match-making locally, without asking Condor.
+
+Usage
+    >>> from owl import classad_expr
+    >>> expr = classad_expr.compile_expression('TARGET.Memory >= 1024')
+    >>> expr.evaluate(my=job, target=machine)
+    True
+    >>> classad_expr.matches(job, machine)
+    True
+
+Semantics follow the (old) Condor ClassAd language:
+    * Attribute references are case-insensitive. MY.x and TARGET.x look x up in
+      the given ad, a plain x looks into MY first and then into TARGET. Missing
+      attributes evaluate to UNDEFINED. Attributes whose value is itself an
+      expression are evaluated in the context of the ad they belong to;
+      those we cannot parse (e.g. lists) evaluate to ERROR.
+    * UNDEFINED and ERROR propagate through arithmetic and comparisons. && and
+      || use three-valued logic (e.g. FALSE && UNDEFINED is FALSE). =?= and =!=
+      (also spelled is and isnt) never return UNDEFINED.
+    * String comparisons with == and != (and <, > etc.) are case-insensitive,
+      =?= and =!= are case-sensitive.
+    * Integer division and modulo truncate towards zero, like in C.
+"""
+import math
+import re
+import time
+
+import classad
+
+
+
+# Constants
+# Precedence of the binary operators (higher binds tighter).
+PRECEDENCE = {'||': 2,
+              '&&': 3,
+              '|': 4,
+              '^': 5,
+              '&': 6,
+              '==': 7, '!=': 7, '=?=': 7, '=!=': 7, 'is': 7, 'isnt': 7,
+              '<': 8, '<=': 8, '>': 8, '>=': 8,
+              '<<': 9, '>>': 9,
+              '+': 10, '-': 10,
+              '*': 11, '/': 11, '%': 11}
+TERNARY_PRECEDENCE = 1
+# Size of ClassAd integers, in bits (see _bitwise).
+INT_BITS = 64
+# Maximum number of compiled expressions we keep around (see compile_expression).
+CACHE_SIZE = 10000
+
+_TOKENIZER = re.compile(r'''\s*(?:
+    (?P<real>(?:[0-9]+\.[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?|[0-9]+[eE][+-]?[0-9]+)
+  | (?P<int>[0-9]+)
+  | (?P<str>"(?:[^"\\]|\\.)*")
+  | (?P<name>[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)?)
+  | (?P<op>=\?=|=!=|==|!=|<=|>=|<<|>>|&&|\|\||[-+*/%<>!~&|^?:(),])
+)''', re.VERBOSE)
+_STRING_ESCAPE = re.compile(r'\\(.)')
+_COMPILED = {}
+
+
+
+class _Special(object):
+    """
+    The UNDEFINED and ERROR ClassAd values.
+    """
+    def __init__(self, name):
+        self.name = name
+        return
+
+    def __repr__(self):
+        return(self.name)
+
+    def __nonzero__(self):
+        return(False)
+
+UNDEFINED = _Special('UNDEFINED')
+ERROR = _Special('ERROR')
+_MISSING = object()
+
+
+
+class CompiledExpression(object):
+    """
+    A ClassAd expression, compiled and ready to be evaluated. Besides the
+    compiled closure, we keep the syntax tree around (in self.tree) for other
+    evaluation strategies (see matchmaking). Tree nodes are tuples:
+        ('const', value)
+        ('name', scope, lower-case name)    (scope is None, 'my' or 'target')
+        ('unary', operator, operand)
+        ('binary', operator, left, right)
+        ('ternary', condition, if true, if false)
+        ('call', lower-case function name, [argument, ...])
+    """
+    __slots__ = ('text', 'tree', '_fn')
+
+    def __init__(self, text, tree):
+        self.text = text
+        self.tree = tree
+        self._fn = _build(tree)
+        return
+
+    def __repr__(self):
+        return('<CompiledExpression %s>' % (self.text))
+
+    def evaluate(self, my=None, target=None):
+        """
+        Evaluate the expression in the context of the `my` and `target` ads
+        (ClassAd instances or dictionaries with lower-case keys, both optional).
+        Return a Python value, UNDEFINED or ERROR.
+        """
+        try:
+            return(self._fn(my, target))
+        except RuntimeError:
+            # Most likely, attributes referring to each other in a loop.
+            return(ERROR)
+    __call__ = evaluate
+
+
+
+# Tokenizer and parser.
+def _tokenize(text):
+    """
+    Split the expression `text` into a list of (kind, value) tokens.
+    """
+    tokens = []
+    pos = 0
+    end = len(text.rstrip())
+    while(pos < end):
+        match = _TOKENIZER.match(text, pos)
+        if(not match):
+            raise(ValueError('Syntax error at "%s" in %s' % (text[pos:], text)))
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if(kind == 'name' and value.lower() in ('is', 'isnt')):
+            kind = 'op'
+            value = value.lower()
+        tokens.append((kind, value))
+    tokens.append(('end', None))
+    return(tokens)
+
+
+class _Parser(object):
+    """
+    Pratt parser turning a list of tokens into a syntax tree (see
+    CompiledExpression).
+    """
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.pos = 0
+        return
+
+    def peek(self):
+        return(self.tokens[self.pos])
+
+    def next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return(token)
+
+    def expect(self, value):
+        (kind, val) = self.next()
+        if(kind != 'op' or val != value):
+            raise(ValueError('Expected "%s" in %s' % (value, self.text)))
+        return
+
+    def parse(self):
+        tree = self.expression(0)
+        if(self.peek()[0] != 'end'):
+            raise(ValueError('Unexpected "%s" in %s' \
+                             % (self.peek()[1], self.text)))
+        return(tree)
+
+    def expression(self, min_precedence):
+        left = self.unary()
+        while(True):
+            (kind, op) = self.peek()
+            if(kind != 'op'):
+                break
+            if(op == '?' and TERNARY_PRECEDENCE >= min_precedence):
+                self.next()
+                if_true = self.expression(0)
+                self.expect(':')
+                if_false = self.expression(TERNARY_PRECEDENCE)
+                left = ('ternary', left, if_true, if_false)
+                continue
+            precedence = PRECEDENCE.get(op)
+            if(precedence is None or precedence < min_precedence):
+                break
+            self.next()
+            right = self.expression(precedence + 1)
+            left = ('binary', op, left, right)
+        return(left)
+
+    def unary(self):
+        (kind, value) = self.next()
+        if(kind == 'op' and value in ('-', '+', '!', '~')):
+            return(('unary', value, self.unary()))
+        if(kind == 'op' and value == '('):
+            tree = self.expression(0)
+            self.expect(')')
+            return(tree)
+        if(kind == 'int'):
+            return(('const', int(value)))
+        if(kind == 'real'):
+            return(('const', float(value)))
+        if(kind == 'str'):
+            return(('const', unicode(_STRING_ESCAPE.sub(r'\1', value[1:-1]))))
+        if(kind == 'name'):
+            if(self.peek() == ('op', '(')):
+                self.next()
+                args = []
+                if(self.peek() != ('op', ')')):
+                    args.append(self.expression(0))
+                    while(self.peek() == ('op', ',')):
+                        self.next()
+                        args.append(self.expression(0))
+                self.expect(')')
+                return(('call', value.lower(), args))
+            return(self.name(value))
+        raise(ValueError('Unexpected "%s" in %s' % (value, self.text)))
+
+    def name(self, name):
+        tokens = name.split('.')
+        scope = None
+        if(len(tokens) == 2):
+            (scope, name) = (tokens[0].lower(), tokens[1])
+        name = classad._fold(name)
+
+        keywords = {'true': True, 'false': False,
+                    'undefined': UNDEFINED, 'error': ERROR}
+        if(scope is None and name in keywords):
+            return(('const', keywords[name]))
+        if(scope not in (None, 'my', 'target')):
+            return(('const', UNDEFINED))
+        return(('name', scope, name))
+
+
+
+# Value helpers.
+def _is_number(value):
+    return(isinstance(value, (int, long, float)))
+
+
+def _is_string(value):
+    return(isinstance(value, basestring))
+
+
+def _as_bool(value):
+    """
+    Return `value` as a ClassAd boolean: True, False, UNDEFINED or ERROR.
+    """
+    if(value is True or value is False or value is UNDEFINED or
+       value is ERROR):
+        return(value)
+    if(_is_number(value)):
+        return(value != 0)
+    return(ERROR)
+
+
+def _lookup(ad, name):
+    """
+    Return the value of the attribute `name` (lower-case) in `ad` or _MISSING.
+    """
+    if(ad is None):
+        return(_MISSING)
+    if(isinstance(ad, dict)):
+        return(ad.get(name, _MISSING))
+    return(getattr(ad, name, _MISSING))
+
+
+def _resolve(value, owner, other):
+    """
+    Turn the attribute value `value` (from the `owner` ad) into a ClassAd value,
+    evaluating it (with `owner` as MY) if it is an expression.
+    """
+    if(value is _MISSING or value is None):
+        return(UNDEFINED)
+    if(isinstance(value, classad.Expression)):
+        try:
+            expression = compile_expression(value)
+        except ValueError:
+            # Not something we can parse (e.g. a list): that is an ERROR.
+            return(ERROR)
+        return(expression.evaluate(owner, other))
+    return(value)
+
+
+
+# Node builders: each returns a closure fn(my, target).
+def _build(tree):
+    """
+    Compile the syntax tree `tree` into a closure fn(my, target).
+    """
+    kind = tree[0]
+    if(kind == 'const'):
+        return(_constant(tree[1]))
+    if(kind == 'name'):
+        return(_name(tree[1], tree[2]))
+    if(kind == 'unary'):
+        return(_unary(tree[1], _build(tree[2])))
+    if(kind == 'binary'):
+        return(_binary(tree[1], _build(tree[2]), _build(tree[3])))
+    if(kind == 'ternary'):
+        return(_ternary(*[_build(node) for node in tree[1:]]))
+    return(_call(tree[1], [_build(node) for node in tree[2]]))
+
+
+def _constant(value):
+    return(lambda my, target: value)
+
+
+def _name(scope, name):
+    if(scope == 'my'):
+        return(lambda my, target: _resolve(_lookup(my, name), my, target))
+    if(scope == 'target'):
+        return(lambda my, target: _resolve(_lookup(target, name), target, my))
+
+    def fn(my, target):
+        value = _lookup(my, name)
+        if(value is not _MISSING):
+            return(_resolve(value, my, target))
+        return(_resolve(_lookup(target, name), target, my))
+    return(fn)
+
+
+def _unary(op, operand):
+    def fn(my, target):
+        value = operand(my, target)
+        if(value is UNDEFINED or value is ERROR):
+            return(value)
+        if(op == '!'):
+            return(_not(value))
+        if(not _is_number(value)):
+            return(ERROR)
+        if(op == '-'):
+            return(-value)
+        if(op == '~'):
+            if(isinstance(value, float)):
+                return(ERROR)
+            return(~value)
+        return(value)
+    return(fn)
+
+
+def _not(value):
+    value = _as_bool(value)
+    if(value is UNDEFINED or value is ERROR):
+        return(value)
+    return(not value)
+
+
+def _ternary(condition, if_true, if_false):
+    def fn(my, target):
+        value = _as_bool(condition(my, target))
+        if(value is UNDEFINED or value is ERROR):
+            return(value)
+        if(value):
+            return(if_true(my, target))
+        return(if_false(my, target))
+    return(fn)
+
+
+def _and(left, right):
+    def fn(my, target):
+        a = _as_bool(left(my, target))
+        if(a is False or a is ERROR):
+            return(a)
+        b = _as_bool(right(my, target))
+        if(a is True or b is ERROR or b is False):
+            return(b)
+        return(UNDEFINED)
+    return(fn)
+
+
+def _or(left, right):
+    def fn(my, target):
+        a = _as_bool(left(my, target))
+        if(a is True or a is ERROR):
+            return(a)
+        b = _as_bool(right(my, target))
+        if(a is False or b is ERROR or b is True):
+            return(b)
+        return(UNDEFINED)
+    return(fn)
+
+
+def _identical(a, b):
+    """
+    The =?= operator: same type and same value (strings are case-sensitive).
+    """
+    if(a is UNDEFINED or a is ERROR or b is UNDEFINED or b is ERROR):
+        return(a is b)
+    if(_is_string(a) or _is_string(b)):
+        return(_is_string(a) and _is_string(b) and a == b)
+    if(isinstance(a, bool) != isinstance(b, bool) or
+       isinstance(a, float) != isinstance(b, float)):
+        return(False)
+    return(a == b)
+
+
+def _compare(op, a, b):
+    if(_is_string(a) and _is_string(b)):
+        (a, b) = (a.lower(), b.lower())
+    elif(not (_is_number(a) and _is_number(b))):
+        return(ERROR)
+    if(op == '=='):
+        return(a == b)
+    if(op == '!='):
+        return(a != b)
+    if(op == '<'):
+        return(a < b)
+    if(op == '<='):
+        return(a <= b)
+    if(op == '>'):
+        return(a > b)
+    return(a >= b)
+
+
+def _arithmetic(op, a, b):
+    if(not (_is_number(a) and _is_number(b))):
+        return(ERROR)
+    if(op == '+'):
+        return(a + b)
+    if(op == '-'):
+        return(a - b)
+    if(op == '*'):
+        return(a * b)
+    if(b == 0):
+        return(ERROR)
+    integers = not (isinstance(a, float) or isinstance(b, float))
+    if(op == '/'):
+        if(integers):
+            quotient = abs(a) // abs(b)
+            return(quotient if (a < 0) == (b < 0) else -quotient)
+        return(float(a) / b)
+    if(integers):
+        return(int(math.fmod(a, b)))
+    return(math.fmod(a, b))
+
+
+def _bitwise(op, a, b):
+    if(not (isinstance(a, (int, long)) and isinstance(b, (int, long)))):
+        return(ERROR)
+    if(op == '&'):
+        return(a & b)
+    if(op == '|'):
+        return(a | b)
+    if(op == '^'):
+        return(a ^ b)
+    # Shifts work on 64 bit integers, like in Condor: that also keeps huge
+    # shift counts from eating up all of our memory.
+    if(b < 0):
+        return(ERROR)
+    if(op == '<<'):
+        return(_int64(a << min(b, INT_BITS)))
+    return(a >> min(b, INT_BITS - 1))
+
+
+def _int64(value):
+    """
+    Wrap the integer `value` around to a signed 64 bit integer.
+    """
+    value &= (1 << INT_BITS) - 1
+    if(value >= 1 << (INT_BITS - 1)):
+        value -= 1 << INT_BITS
+    return(int(value))
+
+
+def _binary(op, left, right):
+    if(op == '&&'):
+        return(_and(left, right))
+    if(op == '||'):
+        return(_or(left, right))
+    return(lambda my, target: _binary_value(op, left(my, target),
+                                            right(my, target)))
+
+
+def _binary_value(op, a, b):
+    """
+    Apply the binary operator `op` (anything but && and ||) to the values `a`
+    and `b`.
+    """
+    if(op in ('=?=', 'is')):
+        return(_identical(a, b))
+    if(op in ('=!=', 'isnt')):
+        return(not _identical(a, b))
+    if(a is ERROR or b is ERROR):
+        return(ERROR)
+    if(a is UNDEFINED or b is UNDEFINED):
+        return(UNDEFINED)
+    if(op in ('==', '!=', '<', '<=', '>', '>=')):
+        return(_compare(op, a, b))
+    if(op in ('+', '-', '*', '/', '%')):
+        return(_arithmetic(op, a, b))
+    return(_bitwise(op, a, b))
+
+
+
+# Built-in functions. Each one takes the already evaluated arguments, except
+# for ifThenElse, which is lazy (see _call).
+def _strict(fn, num_args=None):
+    """
+    Wrap the builtin `fn` so that it returns ERROR on bad arguments and
+    UNDEFINED/ERROR if any of its arguments is UNDEFINED/ERROR.
+    """
+    def wrapper(*args):
+        if(num_args is not None and len(args) not in num_args):
+            return(ERROR)
+        if(ERROR in args):
+            return(ERROR)
+        if(UNDEFINED in args):
+            return(UNDEFINED)
+        try:
+            return(fn(*args))
+        except (TypeError, ValueError, AttributeError, OverflowError,
+                re.error):
+            return(ERROR)
+    return(wrapper)
+
+
+def _to_int(value):
+    if(_is_string(value)):
+        value = float(value)
+    return(int(value))
+
+
+def _to_real(value):
+    return(float(value))
+
+
+def _to_string(value):
+    if(value is True or value is False):
+        return(unicode(value).upper())
+    return(unicode(value))
+
+
+def _round(value):
+    if(not _is_number(value)):
+        return(ERROR)
+    return(int(math.floor(value + .5)))
+
+
+def _substr(string, offset, length=None):
+    if(not _is_string(string)):
+        return(ERROR)
+    if(offset < 0):
+        offset = max(0, len(string) + offset)
+    if(length is None):
+        return(string[offset:])
+    if(length < 0):
+        return(string[offset:length])
+    return(string[offset:offset+length])
+
+
+def _string(fn):
+    """
+    Wrap `fn` so that it returns ERROR unless its argument is a string.
+    """
+    def wrapper(value):
+        if(not _is_string(value)):
+            return(ERROR)
+        return(fn(value))
+    return(wrapper)
+
+
+def _string_list_member(item, string_list, delimiters=', ', ignore_case=False):
+    if(not (_is_string(item) and _is_string(string_list))):
+        return(ERROR)
+    members = [m for m in re.split('[%s]+' % (re.escape(delimiters)),
+                                   string_list) if m]
+    if(ignore_case):
+        item = item.lower()
+        members = [m.lower() for m in members]
+    return(item in members)
+
+
+def _regexp(pattern, string, options=''):
+    if(not (_is_string(pattern) and _is_string(string))):
+        return(ERROR)
+    flags = 0
+    if('i' in options.lower()):
+        flags |= re.IGNORECASE
+    return(re.search(pattern, string, flags) is not None)
+
+
+def _numeric(fn):
+    def wrapper(value):
+        if(not _is_number(value)):
+            return(ERROR)
+        return(fn(value))
+    return(wrapper)
+
+
+_FUNCTIONS = {
+    'isundefined': lambda value: value is UNDEFINED,
+    'iserror': lambda value: value is ERROR,
+    'isstring': _is_string,
+    'isinteger': lambda value: isinstance(value, (int, long)) and \
+                               not isinstance(value, bool),
+    'isreal': lambda value: isinstance(value, float),
+    'isboolean': lambda value: isinstance(value, bool),
+    'int': _strict(_to_int, (1, )),
+    'real': _strict(_to_real, (1, )),
+    'string': _strict(_to_string, (1, )),
+    'floor': _strict(_numeric(lambda v: int(math.floor(v))), (1, )),
+    'ceiling': _strict(_numeric(lambda v: int(math.ceil(v))), (1, )),
+    'round': _strict(_round, (1, )),
+    'strcat': _strict(lambda *args: u''.join([_to_string(a) for a in args])),
+    'substr': _strict(_substr, (2, 3)),
+    'size': _strict(_string(len), (1, )),
+    'toupper': _strict(_string(lambda string: string.upper()), (1, )),
+    'tolower': _strict(_string(lambda string: string.lower()), (1, )),
+    'stringlistmember': _strict(_string_list_member, (2, 3)),
+    'stringlistimember': _strict(lambda item, string_list, delimiters=', ': \
+                                     _string_list_member(item, string_list,
+                                                         delimiters, True),
+                                 (2, 3)),
+    'regexp': _strict(_regexp, (2, 3)),
+    'time': _strict(lambda: int(time.time()), (0, )),
+}
+
+
+def _call(name, args):
+    if(name == 'ifthenelse'):
+        if(len(args) != 3):
+            return(_constant(ERROR))
+        return(_ternary(*args))
+
+    fn = _function(name, len(args))
+    return(lambda my, target: fn(*[arg(my, target) for arg in args]))
+
+
+def _function(name, num_args):
+    """
+    Return the builtin function `name` (lower-case) for `num_args` arguments.
+    Unknown functions (or wrong argument counts) always return ERROR.
+    """
+    fn = _FUNCTIONS.get(name)
+    if(fn is None):
+        return(lambda *args: ERROR)
+    if(name in ('isundefined', 'iserror', 'isstring', 'isinteger', 'isreal',
+                'isboolean') and num_args != 1):
+        return(lambda *args: ERROR)
+    return(fn)
+
+
+
+# Public interface.
+def compile_expression(text):
+    """
+    Compile the ClassAd expression `text` and return the corresponding
+    CompiledExpression instance. Compiled expressions are cached: compiling the
+    same text twice is cheap. Raise ValueError in case of syntax errors.
+    """
+    try:
+        return(_COMPILED[text])
+    except KeyError:
+        pass
+
+    expression = CompiledExpression(text, _Parser(text).parse())
+    if(len(_COMPILED) >= CACHE_SIZE):
+        _COMPILED.clear()
+    _COMPILED[text] = expression
+    return(expression)
+
+
+def evaluate(text, my=None, target=None):
+    """
+    Evaluate the ClassAd expression `text` in the context of the `my` and
+    `target` ads.
+    """
+    return(compile_expression(text).evaluate(my, target))
+
+
+def evaluate_attribute(ad, name, target=None):
+    """
+    Evaluate the attribute `name` of `ad` (with `ad` as MY and `target` as
+    TARGET). Return UNDEFINED if `ad` has no such attribute.
+    """
+    value = _lookup(ad, classad._fold(name))
+    try:
+        return(_resolve(value, ad, target))
+    except RuntimeError:
+        return(ERROR)
+
+
+def matches(job, machine):
+    """
+    Can `machine` run `job`? That is the case if both the job and the machine
+    Requirements evaluate to TRUE (missing Requirements count as TRUE).
+    """
+    for (my, target) in ((job, machine), (machine, job)):
+        if(_lookup(my, 'requirements') is _MISSING):
+            continue
+        if(evaluate_attribute(my, 'Requirements', target) is not True):
+            return(False)
+    return(True)
+
+
+def rank(job, machine):
+    """
+    Return how much `job` likes `machine` i.e. its Rank expression evaluated
+    against `machine`, as a float. Anything which is not a number counts as 0.
+    """
+    value = evaluate_attribute(job, 'Rank', machine)
+    if(_is_number(value)):
+        return(float(value))
+    return(0.)
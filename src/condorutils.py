@@ -1,9 +1,11 @@
 """
 A collection of utilities for interfacing with Condor.
 """
+import array
 import os
+import select
+import socket
 import subprocess
-import tempfile
 import time
 
 import classad
@@ -15,29 +17,39 @@ import utils
 # Constants
 # Timeout in seconds for the call to EXE.
 TIMEOUT = 5.
+# Number of bytes we read from a subprocess pipe at a time.
+READ_SIZE = 65536
+# Names of the placeholder ClassAds returned when condor_status fails.
+STATUS_ERROR_NAME = 'Error communicating with condor please try again later.'
+STATS_ERROR_NAME = 'Error communicating with the Condor Schedd.'
 
 
 
-def _parse_classads(stdout):
+def _parse_classads(stdout, attributes=None):
     """
     Parse a (list) of ClassAds in a single file object `stdout`. Return the list
-    of parsed ClassAd instances.
-    """
-    ads = []
-
-    # Machine ClassAds are separated by an empty line.
-    ad = ''
-    for line in stdout:
-        if(line.strip() == '' and ad):
-            # New ClassAd: parse the last one and start a new one.
-            ads.append(classad.ClassAd.new_from_classad(ad))
-            ad = ''
-            continue
-        ad += line
-    # The file ended and hence we must have a last ClassAd: parse it and quit.
-    if(ad):
-        ads.append(classad.ClassAd.new_from_classad(ad))
-    return(ads)
+    of parsed ClassAd instances. If `attributes` is not None, only keep those
+    ClassAd attributes (see iter_classads).
+    """
+    return(list(iter_classads(stdout, attributes)))
+
+
+def iter_classads(stdout, attributes=None, cls=None):
+    """
+    Incrementally parse the ClassAds in `stdout`, any iterable of text lines
+    (e.g. a file object or a subprocess pipe), and yield them one at a time as
+    `cls` instances (classad.ClassAd by default; classad.CompactClassAd saves
+    memory). Machine ClassAds are separated by an empty line.
+
+    If `attributes` is not None, only keep the ClassAd attributes whose
+    (case-insensitive) names are in `attributes`.
+    """
+    # classad imports us: do not touch its content at import time.
+    if(cls is None):
+        cls = classad.ClassAd
+    for attrs in classad.iter_parse(stdout, attributes):
+        yield cls(**attrs)
+    return
 
 
 def parse_globaljobid(gjob_id):
@@ -92,129 +104,138 @@ def is_localjobid(job_id):
     return(True)
 
 
-def _run_and_get_stdout(args, timeout=TIMEOUT, sleep_time=.1):
+def _iter_stdout(args, timeout=TIMEOUT, status=None):
     """
-    Simple wrapper around subprocess.Popen() with support for timeouts. Return
-    the path of the file with the STDOUT content. In case the process had to be
-    killed or returned an error, the file is removed and None returned.
-
-    One possibly controversial thing here: we run the process and have it write
-    STDOUT to a file, which is potentially inefficient. At the same time, we
-    could have a very large cluster with thousands of cores in which case STDOUT
-    could be huge...
+    Execute `args` (no shell involved) and yield the lines of its STDOUT as
+    soon as they are available, without going through a temporary file. STDERR
+    is read (and discarded) at the same time so that the process can never
+    block writing to it. The process is killed as soon as `timeout` seconds have
+    passed since its start, whether or not we are done reading.
+
+    If `status` is not None, once the generator is exhausted, its 'exit_code'
+    key holds the process exit code (None if the process had to be killed).
     """
-    # Open the file for writing.
-    (fid, file_name) = tempfile.mkstemp()
-    os.close(fid)
-    f = open(file_name, 'w')
+    if(status is None):
+        status = {}
+    status['exit_code'] = None
 
-    # Execute the external process and redirect STDOUT to f.
     proc = subprocess.Popen(args,
-                            stdout=f,
-                            shell=False)
-
-    # Since proc.wait() can deadlock, it is prudent to just poll...
-    start_time = time.time()
-    while(time.time() - start_time < timeout):
-        exit_code = proc.poll()
-        if(exit_code is None):
-            # The process is still running.
-            time.sleep(sleep_time)
-            continue
-
-        # If we are here, the process finished. Remove the file.
-        if(exit_code != 0):
-            f.close()
-            os.remove(file_name)
-            return(None)
-
-        # Everything is cool. Return the file name.
-        f.flush()
-        f.close()
-        return(file_name)
-    # If the process is still running at this point, kill it. Remove the file.
-    proc.kill()
-    f.close()
-    os.remove(file_name)
-    return(None)
-
-
-def _run(args, timeout=TIMEOUT, sleep_time=.1):
+                            shell=False,
+                            close_fds=True,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    deadline = time.time() + timeout
+    out_fd = proc.stdout.fileno()
+    open_fds = [out_fd, proc.stderr.fileno()]
+    # poll() rather than select(): the latter cannot handle file descriptors
+    # above FD_SETSIZE, which long-lived processes like owld can get to.
+    poller = select.poll()
+    for fd in open_fds:
+        poller.register(fd, select.POLLIN | select.POLLPRI)
+    partial = ''
+    try:
+        while(open_fds):
+            remaining = deadline - time.time()
+            if(remaining <= 0):
+                return
+            # Closed pipes are reported as POLLHUP: reading them gives ''.
+            for (fd, _) in poller.poll(remaining * 1000.):
+                data = os.read(fd, READ_SIZE)
+                if(not data):
+                    poller.unregister(fd)
+                    open_fds.remove(fd)
+                elif(fd == out_fd):
+                    lines = (partial + data).split('\n')
+                    partial = lines.pop()
+                    for line in lines:
+                        yield line + '\n'
+        if(partial):
+            yield partial
+
+        # Both pipes are closed: the process is exiting (or has exited). Still,
+        # do not wait for it past the deadline.
+        while(proc.poll() is None):
+            remaining = deadline - time.time()
+            if(remaining <= 0):
+                return
+            time.sleep(min(remaining, .001))
+        status['exit_code'] = proc.returncode
+    finally:
+        # We might have been closed early by our consumer or timed out.
+        if(proc.poll() is None):
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        proc.stderr.close()
+    return
+
+
+def _run(args, timeout=TIMEOUT):
     """
     Simple wrapper around subprocess.Popen() with support for timeouts. Return
     the exit code of the invoked command. In case the process had to be killed,
     return None.
     """
-    # Execute the external process.
-    proc = subprocess.Popen(args,
-                            shell=False,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE)
-
-    # Since proc.wait() can deadlock, it is prudent to jut poll...
-    start_time = time.time()
-    while(time.time() - start_time < timeout):
-        exit_code = proc.poll()
-        if(exit_code is None):
-            # The process is still running.
-            time.sleep(sleep_time)
-            continue
-
-        # If we are here, the process finished. Return exit_code.
-        return(exit_code)
+    status = {}
+    for _ in _iter_stdout(args, timeout, status):
+        pass
+    return(status['exit_code'])
 
-    # If the process is still tunning at this point, kill it. Return None.
-    proc.kill()
-    return(None)
 
-
-def _run_condor_cmd(argv, error_result, timeout=TIMEOUT):
+def _run_condor_cmd(argv, error_result, timeout=TIMEOUT, attributes=None):
     """
     Internal: execute the command specified in `argv` and either return its
     parsed STDOUT (as list of ClassAd instances) or `error_result` in case of
-    error.
-    """
-    ads = error_result
-    stdout = _run_and_get_stdout([utils.which(argv.pop(0)), ] + argv, timeout)
-    if(stdout is not None):
-        f = open(stdout, 'r')
-        ads = _parse_classads(f)
-        f.close()
-        os.remove(stdout)
+    error. If `attributes` is not None, only keep those ClassAd attributes.
+    """
+    # Parse the ClassAds as they come out of the pipe.
+    status = {}
+    stdout = _iter_stdout([utils.which(argv.pop(0)), ] + argv, timeout, status)
+    ads = _parse_classads(stdout, attributes)
+    if(status['exit_code'] != 0):
+        return(error_result)
     return(ads)
 
 
-def condor_status(machine_name=None, timeout=TIMEOUT):
+def condor_status(machine_name=None, timeout=TIMEOUT, attributes=None):
     """
     Wrapper around condor_status: retrieve the list of machines in the pool and
     their current status. If `machine_name` == None, then return information on
     all machines that belong to the pool. Otherwise just return info on that one
-    machine.
+    machine. If `attributes` is not None, only keep those ClassAd attributes
+    (e.g. ['Name', 'State']), which saves time and memory on large pools.
 
     Return
         [classad, ...]
     """
-    m = classad.ClassAd(MyType='Machine',
-                Name='Error communicating with condor please try again later.')
+    m = classad.ClassAd(MyType='Machine', Name=STATUS_ERROR_NAME)
     machines = [m, ]
 
     args = [utils.which('condor_status'), '-long']
     if(machine_name):
         args.append(machine_name)
-    return(_run_condor_cmd(args, machines, timeout=timeout))
+    return(_run_condor_cmd(args, machines, timeout=timeout,
+                           attributes=attributes))
 
 
 def condor_stats(timeout=TIMEOUT):
     """
     Return the Condor Schedd stats as a ClassAd instance.
     """
-    ad = classad.ClassAd(MyType='Scheduler',
-                 Name='Error communicating with the Condor Schedd.')
+    ad = classad.ClassAd(MyType='Scheduler', Name=STATS_ERROR_NAME)
     args = [utils.which('condor_status'), '-long', '-schedd']
     res = _run_condor_cmd(args, [ad, ], timeout=timeout)
     return(res[0])
 
 
+def is_error_ad(ad):
+    """
+    Is `ad` one of the placeholder ClassAds condor_status and condor_stats
+    return when they cannot talk to Condor?
+    """
+    return(getattr(ad, 'Name', None) in (STATUS_ERROR_NAME, STATS_ERROR_NAME))
+
+
 def _run_condor_job_cmd(cmd, extra_argv=None, job_id=None, owner=None,
                         timeout=TIMEOUT):
     """
@@ -328,21 +349,22 @@ def condor_getprio(job_id, timeout=TIMEOUT):
         [schedd, job_id, _] = parse_globaljobid(job_id)
         schedd_argv = ['-name', schedd]
 
-    stdout = _run_and_get_stdout([utils.which('condor_q')] +
-                                 schedd_argv +
-                                 ['-format', '%d\n', 'JobPrio', str(job_id)],
-                                 timeout)
-    if(stdout is None):
+    status = {}
+    lines = list(_iter_stdout([utils.which('condor_q')] +
+                              schedd_argv +
+                              ['-format', '%d\n', 'JobPrio', str(job_id)],
+                              timeout,
+                              status))
+    if(status['exit_code'] != 0):
         return
 
     priority = None
-    res = open(stdout).readline().strip()
+    res = lines and lines[0].strip()
     if(res):
         try:
             priority = int(res)
         except (ValueError, TypeError):
             pass
-    os.remove(stdout)
     return(priority)
 
 def condor_rm(job_id=None, owner=None, timeout=TIMEOUT):
@@ -360,37 +382,48 @@ def condor_rm(job_id=None, owner=None, timeout=TIMEOUT):
     return(_run_condor_job_cmd('condor_rm', [], job_id, owner, timeout))
 
 
+def send_alive(pid, timeout=300, master_host="127.0.0.1", master_port=1271):
+    """
+    Send a UDP packet to the condor_master containing the
+    DC_CHILDALIVE command.
 
+    This will have the master register a trigger to fire in timeout
+    seconds. When the trigger fires the pid will be killed. Each time
+    the DC_CHILDALIVE is sent the trigger's timer is reset to fire in
+    timeout seconds.
 
+    DC_CHILDALIVE should be sent every timeout/3 seconds.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.sendto(build_message(pid, int(timeout)), (master_host, master_port))
+    return
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+def build_message(pid, timeout):
+    """
+    Build a datagram packet to send to the condor_master.
+
+    The package format is (command, pid, timeout). The command is
+    always DC_CHILDALIVE (the integer 60008). The pid is the pid of
+    the process the master is monitoring, i.e. getpid if this
+    script. The timeout is the amount of time, in seconds, the master
+    will wait before killing the pid. Each field in the packet must be
+    8 bytes long, thus the padding.
+    """
+    DC_CHILDALIVE = 60008
+
+    message = array.array('H')
+    message.append(0)
+    message.append(0)
+    message.append(0) # padding
+    message.append(socket.htons(DC_CHILDALIVE))
+
+    message.append(0)
+    message.append(0)
+    message.append(0) # padding
+    message.append(socket.htons(pid))
+
+    message.append(0)
+    message.append(0)
+    message.append(0) # padding
+    message.append(socket.htons(timeout))
+    return(message.tostring())
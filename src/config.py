@@ -56,9 +56,17 @@ from utils import db_connection_str
 
 # Define the default values for misssing configuration parameters. The format is
 # {section_name: {key: value}}
-DEFAULTS = {'DATABASE': {'port': -1, 'driver': None},
+DEFAULTS = {'DATABASE': {'port': -1, 'driver': None, 'pool_size': 5,
+                         'max_overflow': 10, 'pool_recycle': 3600,
+                         'pool_pre_ping': True, 'statement_timeout': 0},
+            'DIRECTORIES': {'dag_cache': '', 'template_cache': ''},
             'OWLD': {'max_msg_bytes': None, 'max_rows': None,
-                     'log_name': 'owld.log'},
+                     'log_name': 'owld.log', 'workers': 4, 'queue_depth': 100,
+                     'cache_ttl': 5.},
+            'BLACKBOARDD': {'socket': '/var/run/owl/blackboardd.sock',
+                            'socket_group': 'condor',
+                            'batch_size': 100, 'flush_interval': .05,
+                            'log_name': 'blackboardd.log'},
             'LOGGING': {'log_dir': '/var/log', 'log_level': 'DEBUG'}}
 
 config = None
@@ -1,9 +1,28 @@
 """
 Handle the parsing of OWL DAG files into Python objects.
+
+Parsed .job files are cached (see ParseCache) by content: submitting the same
+workflow over and over only parses the .job files whose content changed.
 """
+import collections
+import hashlib
+import json
 import os
+import tempfile
+import threading
 
+from classad import Expression
 from classad import Job
+from classad import _parse as _parse_classad
+from config import DIRECTORIES_DAG_CACHE
+
+
+
+# Constants
+# Maximum number of parsed .job files kept in memory.
+PARSE_CACHE_SIZE = 1000
+
+
 
 
 
@@ -33,10 +52,10 @@ def _parse(dag, directory):
     """
     A DAG syntax is pretty simple
         JOB <JOBNAME> <JOBSCRIPT>
-        PARENT <JOBNAME> CHILD <JOBNAME>
-    We do not support DATA jobs quite yet.
+        PARENT <JOBNAME> [<JOBNAME>...] CHILD <JOBNAME> [<JOBNAME>...]
+    A node can appear in any number of PARENT lines. Job scripts are relative
+    to `directory`. We do not support DATA jobs quite yet.
     """
-    dag = os.path.join(directory, dag)
     lines = [l.strip() for l in dag.split('\n') if l.strip()]
 
     # Nodes.
@@ -56,23 +75,43 @@ def _parse(dag, directory):
         if(not line.startswith('PARENT')):
             continue
 
-        # PARENT, <node name>, CHILD, <child1> <child2> <child3>...
-        #   0          1         2       3:
+        # PARENT, <parent1> <parent2>..., CHILD, <child1> <child2>...
         tokens = line.split()
-
-        parent = nodes[tokens[1]]
-        children = [nodes[n] for n in tokens[3:]]
-
-        # print('%s is parent of %s' \
-        #         % (parent.name, str([c.name for c in children])))
-        parent.children = children
-        for child in children:
-            # print('%s is child of %s' % (child.name, parent.name))
-            child.parents.append(parent)
-            # print('%s parents are %s' \
-            #         % (child.name, str([p.name for p in child.parents])))
+        i = tokens.index('CHILD')
+        parents = [nodes[n] for n in tokens[1:i]]
+        children = [nodes[n] for n in tokens[i+1:]]
+
+        # Edges can be repeated: only add each of them once.
+        for parent in parents:
+            for child in children:
+                if(child not in parent.children):
+                    parent.children.append(child)
+                if(parent not in child.parents):
+                    child.parents.append(parent)
     return(nodes.values())
 
+def _encode(attributes):
+    """
+    Turn the ClassAd `attributes` into something json can serialize without
+    losing track of which values are Expressions.
+    """
+    return({'attributes': attributes,
+            'expressions': [k for (k, v) in attributes.items()
+                            if isinstance(v, Expression)]})
+
+
+def _decode(data):
+    """
+    Inverse of _encode.
+    """
+    expressions = set(data['expressions'])
+    attributes = {}
+    for (key, val) in data['attributes'].items():
+        if(key in expressions):
+            val = Expression(val)
+        attributes[key.encode('utf-8')] = val
+    return(attributes)
+
 def _escape(arg_string):
     """
     Shell escape arguments.
@@ -86,6 +125,124 @@ def _escape(arg_string):
 
 
 
+class ParseCache(object):
+    """
+    Cache of parsed .job files keyed by the SHA1 hash of their content. The
+    most recently used `size` entries are kept in memory. If `directory` is
+    given, parsed files are also stored there as JSON (one file per hash) so
+    that other processes (or later runs) can reuse them. Only files owned by
+    the current user are ever read back.
+
+    Entries are the dictionaries of ClassAd attributes returned by the ClassAd
+    parser: callers get a fresh Job instance each time and are free to modify
+    it.
+    """
+    def __init__(self, size=PARSE_CACHE_SIZE, directory=None):
+        self.size = size
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        return
+
+    def _path(self, digest):
+        return(os.path.join(self.directory, digest + '.json'))
+
+    def _load(self, digest):
+        """
+        Return the attributes stored in self.directory for `digest` or None.
+        Files which do not belong to us are ignored: anybody could have written
+        them.
+        """
+        if(not self.directory):
+            return
+        try:
+            with open(self._path(digest), 'rb') as f:
+                if(os.fstat(f.fileno()).st_uid != os.getuid()):
+                    return
+                return(_decode(json.load(f)))
+        except Exception:
+            # Missing, corrupted or unreadable: just parse the file again.
+            return
+
+    def _store(self, digest, attributes):
+        """
+        Store `attributes` in self.directory. Files are written atomically so
+        that concurrent readers never see partial ones.
+        """
+        if(not self.directory):
+            return
+        try:
+            if(not os.path.isdir(self.directory)):
+                os.makedirs(self.directory)
+            (fd, tmp_path) = tempfile.mkstemp(dir=self.directory,
+                                              suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                json.dump(_encode(attributes), f)
+            os.rename(tmp_path, self._path(digest))
+        except (IOError, OSError, TypeError, ValueError):
+            # The on-disk cache is an optimization: never fail because of it.
+            pass
+        return
+
+    def get(self, classad):
+        """
+        Return the dictionary of attributes of the ClassAd text `classad`,
+        parsing it only if we have never seen that same text before.
+        """
+        digest = hashlib.sha1(classad).hexdigest()
+        with self._lock:
+            attributes = self._entries.pop(digest, None)
+            if(attributes is not None):
+                self._entries[digest] = attributes
+                self.hits += 1
+                return(attributes)
+
+        attributes = self._load(digest)
+        if(attributes is None):
+            attributes = _parse_classad(classad)
+            self._store(digest, attributes)
+
+        with self._lock:
+            self.misses += 1
+            self._entries[digest] = attributes
+            while(len(self._entries) > self.size):
+                self._entries.popitem(last=False)
+        return(attributes)
+
+    def clear(self):
+        """
+        Empty the in-memory cache (the on-disk one, if any, is left alone).
+        """
+        with self._lock:
+            self._entries.clear()
+        return
+
+    def stats(self):
+        """
+        Return hit and miss counters as well as the number of cached entries.
+        """
+        return({'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries)})
+
+
+parse_cache = ParseCache(directory=DIRECTORIES_DAG_CACHE or None)
+
+
+def _new_job(classad):
+    """
+    Create a Job instance from the ClassAd text `classad`, just like
+    Job.new_from_classad, but using parse_cache.
+    """
+    job = Job(**parse_cache.get(classad))
+    job._raw_classad = classad
+    return(job)
+
+
+
+
 class Node(object):
     """
     A node in the DAG.
@@ -100,7 +257,7 @@ class Node(object):
 
         self.name = name
         self.script = script
-        self.job = Job.new_from_classad(classad)
+        self.job = _new_job(classad)
         self.children = children
         self.parents = parents
         return
@@ -0,0 +1,620 @@
+"""
+Match-making over a whole Condor pool.
+
+classad_expr.matches() and classad_expr.rank() answer the question "can this
+machine run this job and how much does the job like it?" one machine at a time.
+Asking it for every slot in the pool means running the job Requirements and Rank
+closures once per slot. Here instead we turn the machine ads into columns (one
+NumPy array per attribute, built once and reused for every job) and evaluate
+the job expressions over all slots at once.
+
+Usage
+    >>> from owl import matchmaking, condorutils
+    >>> table = matchmaking.MachineTable(condorutils.condor_status())
+    >>> table.match(job)
+    [(<ClassAd slot1@host1>, 10.0), (<ClassAd slot2@host2>, 3.5)]
+
+Semantics are exactly those of classad_expr: whatever we cannot evaluate in
+columnar form (e.g. bitwise operators, most function calls or attributes that
+are strings on some machines and numbers on others) is evaluated one machine at
+a time with classad_expr instead. The same happens if NumPy is not installed.
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import classad
+import classad_expr
+from classad_expr import UNDEFINED, ERROR, _MISSING
+
+
+
+# Constants
+# Beyond this many distinct expressions for the same attribute (e.g. the machine
+# Requirements), we evaluate that attribute one machine at a time.
+MAX_EXPRESSION_GROUPS = 16
+# Maximum nesting of attributes referring to other expression attributes.
+MAX_DEPTH = 32
+
+# Column states.
+OK = 0
+UNDEFINED_STATE = 1
+ERROR_STATE = 2
+
+# Three-valued logic tables indexed by [left code, right code] where the codes
+# are 0 = FALSE, 1 = TRUE, 2 = UNDEFINED, 3 = ERROR. See classad_expr._and and
+# classad_expr._or.
+_AND = ((0, 0, 0, 0),
+        (0, 1, 2, 3),
+        (0, 2, 2, 3),
+        (3, 3, 3, 3))
+_OR = ((0, 1, 2, 3),
+       (1, 1, 1, 1),
+       (2, 1, 2, 3),
+       (3, 3, 3, 3))
+_NOT = (1, 0, 2, 3)
+if(numpy is not None):
+    _AND = numpy.array(_AND, dtype=numpy.uint8)
+    _OR = numpy.array(_OR, dtype=numpy.uint8)
+    _NOT = numpy.array(_NOT, dtype=numpy.uint8)
+
+_TYPE_TESTS = ('isundefined', 'iserror', 'isstring', 'isinteger', 'isreal',
+               'isboolean')
+
+
+
+class _NotVectorizable(Exception):
+    """
+    Raised when an expression cannot be evaluated in columnar form.
+    """
+    pass
+
+
+
+class _Column(object):
+    """
+    The values of an expression over all the machines in a MachineTable.
+    kind is one of 'num', 'bool' or 'str' and tells the type of values (float64,
+    bool and object arrays respectively). state tells, per machine, whether the
+    value is OK, UNDEFINED or ERROR (in which case values is meaningless).
+    integer is only used for 'num' columns: it tells which values are integers.
+    """
+    __slots__ = ('kind', 'values', 'state', 'integer', '_lower')
+
+    def __init__(self, kind, values, state, integer=None):
+        self.kind = kind
+        self.values = values
+        self.state = state
+        self.integer = integer
+        self._lower = None
+        return
+
+    def __len__(self):
+        return(len(self.state))
+
+    @property
+    def lower(self):
+        """
+        Lower-case version of a 'str' column (for case-insensitive comparisons).
+        """
+        if(self._lower is None):
+            self._lower = numpy.array([v.lower() for v in self.values],
+                                      dtype=object)
+        return(self._lower)
+
+    def numeric(self):
+        """
+        Return (float values, integer flags), treating booleans as the integers
+        0 and 1 just like Python (and classad_expr) do.
+        """
+        if(self.kind == 'bool'):
+            return((self.values.astype(numpy.float64),
+                    numpy.ones(len(self), dtype=bool)))
+        return((self.values, self.integer))
+
+    def codes(self):
+        """
+        Return the column as three-valued logic codes (see _AND and _OR).
+        """
+        codes = numpy.empty(len(self), dtype=numpy.uint8)
+        if(self.kind == 'bool'):
+            codes[:] = self.values
+        elif(self.kind == 'num'):
+            codes[:] = self.values != 0
+        else:
+            codes[:] = 3
+        codes[self.state == UNDEFINED_STATE] = 2
+        codes[self.state == ERROR_STATE] = 3
+        return(codes)
+
+
+def _make_column(values):
+    """
+    Build a _Column out of the list of Python values `values`.
+    """
+    state = numpy.zeros(len(values), dtype=numpy.uint8)
+    kinds = set()
+    for (i, value) in enumerate(values):
+        if(value is UNDEFINED or value is None):
+            state[i] = UNDEFINED_STATE
+        elif(value is ERROR):
+            state[i] = ERROR_STATE
+        elif(isinstance(value, bool)):
+            kinds.add('bool')
+        elif(isinstance(value, (int, long, float))):
+            kinds.add('num')
+        elif(isinstance(value, basestring)):
+            kinds.add('str')
+        else:
+            raise(_NotVectorizable('Unsupported value %r' % (value, )))
+    if(len(kinds) > 1):
+        raise(_NotVectorizable('Mixed types %s' % (', '.join(kinds))))
+    kind = kinds and kinds.pop() or 'num'
+
+    ok = state == OK
+    if(kind == 'str'):
+        array = numpy.empty(len(values), dtype=object)
+        array[:] = [v if o else u'' for (v, o) in zip(values, ok)]
+        return(_Column(kind, array, state))
+    if(kind == 'bool'):
+        array = numpy.array([v is True for v in values], dtype=bool)
+        return(_Column(kind, array, state))
+    array = numpy.array([v if o else 0. for (v, o) in zip(values, ok)],
+                        dtype=numpy.float64)
+    integer = numpy.array([isinstance(v, (int, long)) for v in values],
+                          dtype=bool)
+    return(_Column(kind, array, state, integer))
+
+
+def _broadcast(value, size):
+    """
+    Turn the scalar `value` into a _Column of length `size`.
+    """
+    if(isinstance(value, _Column)):
+        return(value)
+    column = _make_column([value])
+    values = numpy.repeat(column.values, size)
+    integer = None
+    if(column.integer is not None):
+        integer = numpy.repeat(column.integer, size)
+    return(_Column(column.kind, values, numpy.repeat(column.state, size),
+                   integer))
+
+
+def _tree(text):
+    """
+    Return the parse tree of the expression `text`, a constant ERROR if it
+    cannot be parsed.
+    """
+    try:
+        return(classad_expr.compile_expression(text).tree)
+    except ValueError:
+        return(('const', ERROR))
+
+
+def _is_true(column):
+    """
+    Mask of the machines for which `column` is TRUE (not just non-zero, see
+    classad_expr.matches).
+    """
+    if(column.kind != 'bool'):
+        return(numpy.zeros(len(column), dtype=bool))
+    return((column.state == OK) & column.values)
+
+
+def _from_codes(codes):
+    """
+    Build a 'bool' _Column out of three-valued logic codes.
+    """
+    state = numpy.zeros(len(codes), dtype=numpy.uint8)
+    state[codes == 2] = UNDEFINED_STATE
+    state[codes == 3] = ERROR_STATE
+    return(_Column('bool', codes == 1, state))
+
+
+def _where(mask, a, b):
+    """
+    Return a _Column with the values of `a` where `mask` is True and those of
+    `b` elsewhere.
+    """
+    if(a.kind != b.kind):
+        # Only OK if one of the two never contributes an actual value.
+        if(not numpy.any(~mask & (b.state == OK))):
+            b = _Column(a.kind, a.values, b.state, a.integer)
+        elif(not numpy.any(mask & (a.state == OK))):
+            a = _Column(b.kind, b.values, a.state, b.integer)
+        else:
+            raise(_NotVectorizable('Mixed types %s, %s' % (a.kind, b.kind)))
+    integer = None
+    if(a.kind == 'num'):
+        integer = numpy.where(mask, a.integer, b.integer)
+    return(_Column(a.kind, numpy.where(mask, a.values, b.values),
+                   numpy.where(mask, a.state, b.state), integer))
+
+
+def _propagate(a, b):
+    """
+    The state of the result of a strict binary operator: ERROR wins over
+    UNDEFINED which wins over OK.
+    """
+    return(numpy.maximum(a.state, b.state))
+
+
+
+class _Evaluator(object):
+    """
+    Evaluate expression syntax trees (see classad_expr.CompiledExpression) over
+    all the machines in `table` at once, in the context of the single ad `ad`.
+    If `table_is_my` the machines are MY and `ad` is TARGET, otherwise the other
+    way around.
+
+    Values are either plain Python values (when they are the same for every
+    machine) or _Column instances.
+    """
+    def __init__(self, table, ad, table_is_my, depth=0):
+        self.table = table
+        self.ad = ad
+        self.table_is_my = table_is_my
+        self.depth = depth
+        if(depth > MAX_DEPTH):
+            raise(_NotVectorizable('Expression nesting too deep'))
+        return
+
+    def evaluate(self, tree):
+        kind = tree[0]
+        if(kind == 'const'):
+            return(tree[1])
+        if(kind == 'name'):
+            return(self.name(tree[1], tree[2]))
+        if(kind == 'unary'):
+            return(self.unary(tree[1], self.evaluate(tree[2])))
+        if(kind == 'binary'):
+            return(self.binary(tree[1], tree[2], tree[3]))
+        if(kind == 'ternary'):
+            return(self.ternary(*tree[1:]))
+        return(self.call(tree[1], tree[2]))
+
+    def name(self, scope, name):
+        if(scope is None):
+            if(self.table_is_my):
+                (column, missing) = self.table.column(name, self.ad,
+                                                      self.depth)
+                if(not numpy.any(missing)):
+                    return(column)
+                fallback = _broadcast(self.ad_value(name), len(column))
+                return(_where(missing, fallback, column))
+            if(classad_expr._lookup(self.ad, name) is not _MISSING):
+                return(self.ad_value(name))
+            return(self.table.column(name, self.ad, self.depth)[0])
+        if((scope == 'my') == self.table_is_my):
+            return(self.table.column(name, self.ad, self.depth)[0])
+        return(self.ad_value(name))
+
+    def ad_value(self, name):
+        """
+        The value of the attribute `name` of self.ad.
+        """
+        value = classad_expr._lookup(self.ad, name)
+        if(value is _MISSING or value is None):
+            return(UNDEFINED)
+        if(isinstance(value, classad.Expression)):
+            # Evaluated with self.ad as MY and the machines as TARGET.
+            evaluator = _Evaluator(self.table, self.ad, False, self.depth + 1)
+            return(evaluator.evaluate(_tree(value)))
+        return(value)
+
+    def unary(self, op, value):
+        if(not isinstance(value, _Column)):
+            return(classad_expr._unary(op, lambda m, t: value)(None, None))
+        if(op == '!'):
+            return(_from_codes(_NOT[value.codes()]))
+        if(op == '~'):
+            raise(_NotVectorizable('Bitwise operators are not supported'))
+        if(value.kind == 'str'):
+            state = value.state.copy()
+            state[state == OK] = ERROR_STATE
+            return(_Column('num', numpy.zeros(len(value)), state,
+                           numpy.ones(len(value), dtype=bool)))
+        if(op == '+'):
+            return(value)
+        (values, integer) = value.numeric()
+        return(_Column('num', -values, value.state, integer))
+
+    def binary(self, op, left, right):
+        if(op in ('&&', '||')):
+            return(self.logical(op, left, right))
+        a = self.evaluate(left)
+        b = self.evaluate(right)
+        if(not isinstance(a, _Column) and not isinstance(b, _Column)):
+            return(classad_expr._binary_value(op, a, b))
+        size = len(a if isinstance(a, _Column) else b)
+        (a, b) = (_broadcast(a, size), _broadcast(b, size))
+
+        if(op in ('=?=', 'is', '=!=', 'isnt')):
+            return(self.identical(op in ('=?=', 'is'), a, b))
+        if(op in ('==', '!=', '<', '<=', '>', '>=')):
+            return(self.compare(op, a, b))
+        if(op in ('+', '-', '*', '/', '%')):
+            return(self.arithmetic(op, a, b))
+        raise(_NotVectorizable('Bitwise operators are not supported'))
+
+    def logical(self, op, left, right):
+        a = self.evaluate(left)
+        if(not isinstance(a, _Column)):
+            a = classad_expr._as_bool(a)
+            # Short-circuit just like classad_expr does.
+            if(a is ERROR or a is (op == '||')):
+                return(a)
+        b = self.evaluate(right)
+        if(not isinstance(a, _Column) and not isinstance(b, _Column)):
+            fn = classad_expr._binary(op, lambda m, t: a, lambda m, t: b)
+            return(fn(None, None))
+        size = len(a if isinstance(a, _Column) else b)
+        table = _AND if op == '&&' else _OR
+        return(_from_codes(table[_broadcast(a, size).codes(),
+                                 _broadcast(b, size).codes()]))
+
+    def identical(self, positive, a, b):
+        ok = (a.state == OK) & (b.state == OK)
+        result = numpy.where(ok, False, a.state == b.state)
+        if(a.kind == b.kind):
+            if(a.kind == 'num'):
+                same = (a.values == b.values) & (a.integer == b.integer)
+            else:
+                same = a.values == b.values
+            result |= ok & same
+        if(not positive):
+            result = ~result
+        return(_Column('bool', result, numpy.zeros(len(a), dtype=numpy.uint8)))
+
+    def compare(self, op, a, b):
+        state = _propagate(a, b)
+        if(a.kind == 'str' and b.kind == 'str'):
+            (x, y) = (a.lower, b.lower)
+        elif(a.kind != 'str' and b.kind != 'str'):
+            (x, y) = (a.numeric()[0], b.numeric()[0])
+        else:
+            state[state == OK] = ERROR_STATE
+            return(_Column('bool', numpy.zeros(len(a), dtype=bool), state))
+
+        if(op == '=='):
+            result = x == y
+        elif(op == '!='):
+            result = x != y
+        elif(op == '<'):
+            result = x < y
+        elif(op == '<='):
+            result = x <= y
+        elif(op == '>'):
+            result = x > y
+        else:
+            result = x >= y
+        return(_Column('bool', numpy.asarray(result, dtype=bool), state))
+
+    def arithmetic(self, op, a, b):
+        state = _propagate(a, b)
+        if(a.kind == 'str' or b.kind == 'str'):
+            state[state == OK] = ERROR_STATE
+            return(_Column('num', numpy.zeros(len(a)), state,
+                           numpy.ones(len(a), dtype=bool)))
+        ((x, x_int), (y, y_int)) = (a.numeric(), b.numeric())
+        integer = x_int & y_int
+
+        with numpy.errstate(all='ignore'):
+            if(op == '+'):
+                result = x + y
+            elif(op == '-'):
+                result = x - y
+            elif(op == '*'):
+                result = x * y
+            else:
+                zero = y == 0
+                if(numpy.any(zero)):
+                    state = state.copy()
+                    state[(state == OK) & zero] = ERROR_STATE
+                if(op == '/'):
+                    # C-style integer division truncates towards zero.
+                    result = numpy.where(integer, numpy.trunc(x / y), x / y)
+                else:
+                    result = numpy.fmod(x, y)
+        return(_Column('num', result, state, integer))
+
+    def ternary(self, condition, if_true, if_false):
+        condition = self.evaluate(condition)
+        if(not isinstance(condition, _Column)):
+            condition = classad_expr._as_bool(condition)
+            if(condition is UNDEFINED or condition is ERROR):
+                return(condition)
+            return(self.evaluate(if_true if condition else if_false))
+
+        codes = condition.codes()
+        size = len(codes)
+        a = _broadcast(self.evaluate(if_true), size)
+        b = _broadcast(self.evaluate(if_false), size)
+        result = _where(codes == 1, a, b)
+        # UNDEFINED and ERROR conditions yield UNDEFINED and ERROR.
+        result.state = numpy.where(codes >= 2, codes - 1, result.state)
+        return(result)
+
+    def call(self, name, args):
+        if(name == 'ifthenelse' and len(args) == 3):
+            return(self.ternary(*args))
+
+        values = [self.evaluate(arg) for arg in args]
+        columns = [v for v in values if isinstance(v, _Column)]
+        if(not columns):
+            return(classad_expr._function(name, len(values))(*values))
+        if(name not in _TYPE_TESTS or len(values) != 1):
+            raise(_NotVectorizable('Function %s is not supported' % (name)))
+
+        value = values[0]
+        ok = value.state == OK
+        if(name == 'isundefined'):
+            result = value.state == UNDEFINED_STATE
+        elif(name == 'iserror'):
+            result = value.state == ERROR_STATE
+        elif(name == 'isstring'):
+            result = ok & (value.kind == 'str')
+        elif(name == 'isboolean'):
+            result = ok & (value.kind == 'bool')
+        elif(value.kind != 'num'):
+            result = numpy.zeros(len(value), dtype=bool)
+        elif(name == 'isinteger'):
+            result = ok & value.integer
+        else:
+            result = ok & ~value.integer
+        return(_Column('bool', result,
+                       numpy.zeros(len(value), dtype=numpy.uint8)))
+
+
+
+class MachineTable(object):
+    """
+    A set of machine (i.e. slot) ClassAds, e.g. the output of
+    condorutils.condor_status(), stored by column for fast match-making.
+
+    Columns are built the first time an attribute is needed and reused for all
+    the following jobs: build one MachineTable per pool snapshot and use it to
+    match as many jobs as needed.
+    """
+    def __init__(self, ads):
+        self.ads = list(ads)
+        # {attribute name: (column of the literal values, missing mask,
+        #                   {expression: row mask})}
+        self._columns = {}
+        return
+
+    def __len__(self):
+        return(len(self.ads))
+
+    def _raw_column(self, name):
+        try:
+            return(self._columns[name])
+        except KeyError:
+            pass
+
+        values = [classad_expr._lookup(ad, name) for ad in self.ads]
+        missing = numpy.array([v is _MISSING for v in values], dtype=bool)
+        groups = {}
+        for (i, value) in enumerate(values):
+            if(isinstance(value, classad.Expression)):
+                groups.setdefault(value, []).append(i)
+                values[i] = None
+            elif(value is _MISSING):
+                values[i] = None
+        for (text, rows) in groups.items():
+            mask = numpy.zeros(len(values), dtype=bool)
+            mask[rows] = True
+            groups[text] = mask
+        entry = (_make_column(values), missing, groups)
+        self._columns[name] = entry
+        return(entry)
+
+    def column(self, name, target, depth=0):
+        """
+        Return (the values of attribute `name` over all machines as a _Column,
+        the mask of machines which do not have that attribute). Attributes which
+        are expressions are evaluated with the machine as MY and `target` as
+        TARGET: machines sharing the same expression are evaluated together.
+        """
+        (column, missing, groups) = self._raw_column(name)
+        if(len(groups) > MAX_EXPRESSION_GROUPS):
+            scalar = groups.items()
+        else:
+            scalar = []
+            for (text, mask) in groups.items():
+                try:
+                    value = _Evaluator(self, target, True,
+                                       depth + 1).evaluate(_tree(text))
+                    column = _where(mask, _broadcast(value, len(self)), column)
+                except _NotVectorizable:
+                    scalar.append((text, mask))
+
+        for (text, mask) in scalar:
+            values = [classad_expr._resolve(text, ad, target) if m else None
+                      for (ad, m) in zip(self.ads, mask)]
+            column = _where(mask, _make_column(values), column)
+        return((column, missing))
+
+    def _evaluate(self, job, name):
+        """
+        Evaluate the attribute `name` of `job` over all machines, as a _Column.
+        Raise _NotVectorizable if that cannot be done.
+        """
+        if(numpy is None):
+            raise(_NotVectorizable('NumPy is not installed'))
+        return(_broadcast(_Evaluator(self, job, False).ad_value(name),
+                          len(self)))
+
+    def _job_requirements(self, job):
+        if(classad_expr._lookup(job, 'requirements') is _MISSING):
+            return(range(len(self)))
+        try:
+            column = self._evaluate(job, 'requirements')
+            return(list(numpy.flatnonzero(_is_true(column))))
+        except (_NotVectorizable, RuntimeError):
+            return([i for (i, m) in enumerate(self.ads)
+                    if classad_expr.evaluate_attribute(job, 'Requirements', m) \
+                       is True])
+
+    def _machine_requirements(self, job, candidates):
+        """
+        Evaluate the machine Requirements of the `candidates` (indices into
+        self.ads) against `job`. Return the list of accepted indices.
+        """
+        try:
+            if(numpy is None):
+                raise(_NotVectorizable('NumPy is not installed'))
+            (column, missing) = self.column('requirements', job)
+            ok = _is_true(column) | missing
+            return([i for i in candidates if ok[i]])
+        except (_NotVectorizable, RuntimeError):
+            return([i for i in candidates
+                    if classad_expr._lookup(self.ads[i],
+                                            'requirements') is _MISSING or
+                       classad_expr.evaluate_attribute(self.ads[i],
+                                                       'Requirements',
+                                                       job) is True])
+
+    def _ranks(self, job, indices):
+        """
+        Return the Rank of `job` for the machines `indices` (indices into
+        self.ads).
+        """
+        if(classad_expr._lookup(job, 'rank') is _MISSING):
+            return([0.] * len(indices))
+        try:
+            column = self._evaluate(job, 'rank')
+            if(column.kind == 'str'):
+                return([0.] * len(indices))
+            values = column.numeric()[0]
+            ranks = numpy.where(column.state == OK, values, 0.)
+            return([float(ranks[i]) for i in indices])
+        except (_NotVectorizable, RuntimeError):
+            return([classad_expr.rank(job, self.ads[i]) for i in indices])
+
+    def match(self, job):
+        """
+        Return the list of machines which can run `job` (a classad.Job instance)
+        as (machine ClassAd, job Rank) tuples, best Rank first. A machine can
+        run a job if both the job and the machine Requirements evaluate to TRUE
+        (see classad_expr.matches).
+        """
+        if(not self.ads):
+            return([])
+        candidates = self._job_requirements(job)
+        accepted = self._machine_requirements(job, candidates)
+        ranks = self._ranks(job, accepted)
+        matches = [(self.ads[i], rank) for (i, rank) in zip(accepted, ranks)]
+        matches.sort(key=lambda (ad, rank): -rank)
+        return(matches)
+
+
+
+def match(job, machines):
+    """
+    Return the list of `machines` (ClassAd instances) which can run `job` as
+    (machine, Rank) tuples, best Rank first. See MachineTable.match.
+    """
+    return(MachineTable(machines).match(job))
@@ -16,6 +16,11 @@ try:
 except:
     print('Warning: XGrid plugin disabled.')
     pass
+try:
+    import local_plugin
+except:
+    print('Warning: local plugin disabled.')
+    pass
 try:
     import spread_plugin
 except:
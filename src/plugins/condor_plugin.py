@@ -83,17 +83,64 @@ def submit(dag_name, work_dir, wait=False):
 
     # Close the DRMAA session.
     session.exit()
-    # Mannage job_id so that it corresponds more closely to what is stored in
-    # the database:
-    #   <hostname>#<ClusterId>.<ProcId> instead of
-    #   <hostname>.<ClusterId>.<ClusterId> that we have here.
-    # The database version of this id appends #<timestamp> to what we have here
-    # as well as replacing the hostname with the fully qualified host name.
-    hostname, cluster_id, proc_id = job_id.rsplit('.', 2)
-    sanitized_id = '%s#%s.%s' % (hostname, cluster_id, proc_id)
+    sanitized_id = _sanitize_job_id(job_id)
     if(wait):
         return((sanitized_id, err))
     return(sanitized_id)
 
 
+def _sanitize_job_id(job_id):
+    """
+    Mannage job_id so that it corresponds more closely to what is stored in
+    the database:
+      <hostname>#<ClusterId>.<ProcId> instead of
+      <hostname>.<ClusterId>.<ClusterId> that we have here.
+    The database version of this id appends #<timestamp> to what we have here
+    as well as replacing the hostname with the fully qualified host name.
+    """
+    hostname, cluster_id, proc_id = job_id.rsplit('.', 2)
+    return('%s#%s.%s' % (hostname, cluster_id, proc_id))
+
+
+
+class Session(object):
+    """
+    A DRMAA session used to submit many DAGMan jobs, one after the other,
+    without paying for session setup and teardown each time (see submit()).
+
+    Usage
+        session = Session()
+        try:
+            job_id = session.submit(dag_name, work_dir)
+            ...
+        finally:
+            session.close()
+    """
+    def __init__(self):
+        self._session = drmaa.Session()
+        self._session.initialize()
+        return
+
+    def submit(self, dag_name, work_dir):
+        """
+        Submit the DAGMan job for `dag_name` (in `work_dir`) asyncronously.
+
+        Return
+            jobId
+        """
+        drmaa_tmplt = create_job_template(self._session, dag_name, work_dir)
+        try:
+            job_id = self._session.runJob(drmaa_tmplt)
+        finally:
+            self._session.deleteJobTemplate(drmaa_tmplt)
+        return(_sanitize_job_id(job_id))
+
+    def close(self):
+        """
+        Close the DRMAA session.
+        """
+        self._session.exit()
+        return
+
+
 
@@ -0,0 +1,192 @@
+"""
+Execute Workflows locally, on the submit host, without any batch job execution
+system. Meant for small datasets, where Condor scheduling overhead dominates.
+
+Each node instance (see the Instances job attribute) is a child process: at
+most `processes` of them run at the same time. A node starts as soon as all of
+its parents have completed successfully. $(Process) is expanded in the job
+Executable, Arguments, Input, Output and Error. Input, Output and Error are
+relative to the work directory, just like Executable; instances of the same node
+sharing the same Output or Error file append to it.
+
+If a node instance fails, no new instance is started, the running ones are
+waited for and its exit code is returned. If some nodes can never start (their
+parents form a loop), INCOMPLETE_EXIT_CODE is returned.
+
+Usage
+    Workflow.execute(..., flavour='local')
+"""
+import collections
+import multiprocessing
+import os
+import Queue
+import re
+import shlex
+import subprocess
+import threading
+
+from owl import dag
+
+
+
+# Constants
+# Default maximum number of node instances running at the same time.
+MAX_PROCESSES = multiprocessing.cpu_count()
+# Exit code of node instances whose executable could not be started.
+EXEC_FAILED_EXIT_CODE = 127
+# Exit code of DAGs some of whose nodes never ran (e.g. because of a loop).
+INCOMPLETE_EXIT_CODE = 1
+
+_PROCESS_MACRO = re.compile(r'\$\(process\)', re.IGNORECASE)
+
+
+
+class DAG(dag.DAG):
+    """
+    A DAG executed locally by a bounded pool of child processes.
+    """
+    def execute(self, work_dir, processes=MAX_PROCESSES):
+        """
+        Execute the DAG in `work_dir` and block until it is done. Return 0 if
+        all nodes succeeded, the exit code of the first failed node instance
+        otherwise (INCOMPLETE_EXIT_CODE if some nodes never ran at all).
+        """
+        processes = max(1, processes)
+
+        # Number of parents each node is still waiting for.
+        waiting = dict([(node, len(node.parents)) for node in self.nodes])
+        # Number of instances of each node still to complete.
+        remaining = {}
+        # Nodes all of whose instances completed successfully.
+        completed = set()
+        ready = collections.deque()
+        done = Queue.Queue()
+
+        def schedule(node):
+            instances = _num_instances(node)
+            remaining[node] = instances
+            ready.extend([(node, i) for i in range(instances)])
+            if(not instances):
+                finished(node)
+            return
+
+        def finished(node):
+            completed.add(node)
+            for child in node.children:
+                waiting[child] -= 1
+                if(not waiting[child]):
+                    schedule(child)
+            return
+
+        for node in self.roots:
+            schedule(node)
+
+        err = 0
+        running = 0
+        while(running or (ready and not err)):
+            while(ready and not err and running < processes):
+                (node, instance_id) = ready.popleft()
+                _start(node, instance_id, work_dir, done)
+                running += 1
+
+            # Wait for any instance to complete.
+            (node, instance_id, exit_code) = done.get()
+            running -= 1
+            if(exit_code != 0):
+                print('Node %s instance %d failed with exit code %d' \
+                      % (node.name, instance_id, exit_code))
+                err = err or exit_code
+                continue
+
+            remaining[node] -= 1
+            if(not remaining[node]):
+                finished(node)
+
+        if(not err and len(completed) != len(self.nodes)):
+            names = [n.name for n in self.nodes if n not in completed]
+            print('Nodes %s never ran' % (', '.join(sorted(names))))
+            err = INCOMPLETE_EXIT_CODE
+        return(err)
+
+
+
+def _num_instances(node):
+    return(int(getattr(node.job, 'Instances', 1)))
+
+
+def _expand(value, instance_id):
+    """
+    Expand $(Process) in the job attribute `value` (which might be None).
+    """
+    if(not value):
+        return(value)
+    return(_PROCESS_MACRO.sub(str(instance_id), unicode(value)))
+
+
+def _open(path, mode, work_dir):
+    if(not path):
+        return(None)
+    return(open(os.path.join(work_dir, path), mode))
+
+
+def _start(node, instance_id, work_dir, done):
+    """
+    Start instance `instance_id` of `node` in `work_dir`. When it completes,
+    put (node, instance_id, exit code) in the `done` queue.
+    """
+    job = node.job
+    executable = os.path.join(work_dir, _expand(job.Executable, instance_id))
+    argv = [executable, ]
+    arguments = _expand(getattr(job, 'Arguments', None), instance_id)
+    if(arguments):
+        argv += shlex.split(arguments.encode('utf-8'))
+
+    env = {}
+    if(getattr(job, 'GetEnv', False) is True):
+        env.update(os.environ)
+    env.update(job.EnvironmentDict)
+
+    # Opened one at a time, so that we close those already open if opening the
+    # next one fails.
+    files = []
+    try:
+        files.append(_open(_expand(getattr(job, 'Input', None), instance_id),
+                           'r', work_dir) or open(os.devnull, 'r'))
+        files.append(_open(_expand(getattr(job, 'Output', None), instance_id),
+                           'a', work_dir))
+        files.append(_open(_expand(getattr(job, 'Error', None), instance_id),
+                           'a', work_dir))
+        proc = subprocess.Popen(argv,
+                                cwd=work_dir,
+                                env=env,
+                                stdin=files[0],
+                                stdout=files[1],
+                                stderr=files[2],
+                                close_fds=True)
+    except (IOError, OSError), e:
+        print('Node %s instance %d could not be started: %s' \
+              % (node.name, instance_id, e))
+        done.put((node, instance_id, EXEC_FAILED_EXIT_CODE))
+        return
+    finally:
+        # The child has its own copies of these.
+        for f in files:
+            if(f is not None):
+                f.close()
+
+    def wait():
+        done.put((node, instance_id, proc.wait()))
+    thread = threading.Thread(target=wait)
+    thread.daemon = True
+    thread.start()
+    return
+
+
+def submit(dagName, workDir, processes=MAX_PROCESSES):
+    """
+    Execute the given DAG (described in os.path.join(workDir, dagName)) locally
+    with at most `processes` node instances running at the same time. Block
+    until the DAG either failed or finished executing and return its exit code.
+    """
+    dag = DAG.new_from_dag(open(os.path.join(workDir, dagName)).read(), workDir)
+    return(dag.execute(workDir, processes))
@@ -1,32 +1,214 @@
 #!/usr/bin/env python
+"""
+Client side of the spread keymaster (bin/spread_keymasterd.py), which hands out
+unique ClusterIds.
+
+Asking the keymaster for ClusterIds one at a time costs a full RPC round trip
+each. ClusterIdCache leases contiguous blocks of ClusterIds instead and hands
+them out locally. All requests from the same process go through one shared,
+thread-safe KeyClient (see get_client).
+
+Usage
+    >>> from spread_keyclient import cluster_ids
+    >>> cluster_ids.take(4000)          # at most one RPC.
+    [1001, 1002, ...]
+"""
+import threading
 import uuid
 
 import pika
 
-from spread.client import RpcClient
-
 
 # Constants
 QUEUE_NAME = 'key_queue'
+# Minimum number of ClusterIds ClusterIdCache leases at a time.
+BLOCK_SIZE = 1000
+# How often (in seconds) threads waiting for a reply check whether it arrived
+# while another thread is reading from the connection.
+POLL_INTERVAL = .01
+
+# Shared KeyClient instances: {broker host: KeyClient}
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+
+
+class Reply(object):
+    """
+    The pending reply to a KeyClient request.
+    """
+    def __init__(self, client):
+        self.body = None
+        self._client = client
+        self._event = threading.Event()
+        return
+
+    def is_ready(self):
+        return(self._event.is_set())
+
+    def wait(self):
+        self._client._wait(self)
+        return
+
+    def result(self):
+        self.wait()
+        return(self.body)
+
+
+
+class KeyClient(object):
+    """
+    Thread-safe RPC client for the keymaster. A single broker connection (and
+    reply queue) carries any number of outstanding requests: replies are matched
+    to requests by correlation_id. There is no I/O thread: whichever thread is
+    waiting for a reply reads from the connection on behalf of everybody.
 
+    Usage
+        >>> client = get_client('localhost')
+        >>> replies = [client.call_async('get_clusterid') for i in range(10)]
+        >>> [int(r.result()) for r in replies]
+    """
+    def __init__(self, host='localhost'):
+        self.host = host
+        self._pending = {}                      # {correlation_id: Reply}
+        self._lock = threading.Lock()           # Guards the connection.
 
+        self.connection = pika.BlockingConnection(pika.ConnectionParameters(
+            host=host))
+        self.channel = self.connection.channel()
+        result = self.channel.queue_declare(exclusive=True)
+        self.callback_queue = result.method.queue
+        self.channel.basic_consume(self._on_response,
+                                   no_ack=True,
+                                   queue=self.callback_queue)
+        return
+
+    def _on_response(self, ch, method, props, body):
+        reply = self._pending.pop(props.correlation_id, None)
+        if(reply is not None):
+            reply.body = body
+            reply._event.set()
+        return
+
+    def _wait(self, reply):
+        """
+        Process network events until `reply` arrives.
+        """
+        while(not reply.is_ready()):
+            if(self._lock.acquire(False)):
+                try:
+                    if(not reply.is_ready()):
+                        self.connection.process_data_events()
+                finally:
+                    self._lock.release()
+            else:
+                # Somebody else is reading from the connection.
+                reply._event.wait(POLL_INTERVAL)
+        return
+
+    def call_async(self, body):
+        """
+        Send the request `body` to the keymaster and return a Reply right away.
+        """
+        reply = Reply(self)
+        correlation_id = str(uuid.uuid4())
+        with self._lock:
+            self._pending[correlation_id] = reply
+            self.channel.basic_publish(exchange='',
+                                       routing_key=QUEUE_NAME,
+                                       properties=pika.BasicProperties(
+                                           reply_to=self.callback_queue,
+                                           correlation_id=correlation_id),
+                                       body=body)
+        return(reply)
+
+    def call(self, body):
+        """
+        Send the request `body` to the keymaster and return its reply.
+        """
+        return(self.call_async(body).result())
+
+
+def get_client(host='localhost'):
+    """
+    Return the KeyClient shared by all threads of this process for `host`.
+    """
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(host)
+        if(client is None):
+            client = _CLIENTS[host] = KeyClient(host)
+    return(client)
 
 
 def get_clusterid(client=None, host='localhost'):
     if(client is None):
-        client = RpcClient(host=host, fast=True)
+        client = get_client(host)
+    return(int(client.call('get_clusterid')))
+
+
+def get_clusterids(n, client=None, host='localhost'):
+    """
+    Lease `n` contiguous ClusterIds from the keymaster in a single RPC. Return
+    them as a list.
+    """
+    if(client is None):
+        client = get_client(host)
+    first = int(client.call('get_clusterids %d' % (n)))
+    return(range(first, first + n))
+
+
+
+class ClusterIdCache(object):
+    """
+    Hand out ClusterIds from blocks (of at least `block_size` ClusterIds)
+    leased from the keymaster. The next block is requested (without waiting for
+    the reply) as soon as the current one is half used. Thread-safe. ClusterIds
+    left in the cache when the process exits are simply never used.
+    """
+    def __init__(self, block_size=BLOCK_SIZE, client=None, host='localhost'):
+        self.block_size = block_size
+        self.client = client
+        self.host = host
+        self._next = 0
+        self._end = 0
+        self._prefetch = None                   # (size, Reply) or None
+        self._lock = threading.Lock()
+        return
+
+    def _request(self, n):
+        client = self.client or get_client(self.host)
+        return((n, client.call_async('get_clusterids %d' % (n))))
+
+    def _refill(self, needed):
+        if(self._prefetch is not None):
+            (size, reply) = self._prefetch
+            self._prefetch = None
+        else:
+            (size, reply) = self._request(max(needed, self.block_size))
+        first = int(reply.result())
+        (self._next, self._end) = (first, first + size)
+        return
 
-    client.response = None
-    client._rpccall_id = str(uuid.uuid4())
-    client.channel.basic_publish(exchange='',
-                               routing_key=QUEUE_NAME,
-                               properties=pika.BasicProperties(
-                                     reply_to = client.callback_queue,
-                                     correlation_id = client._rpccall_id),
-                               body='get_clusterid')
-    while(not client.is_ready()):
-        client.wait()
-    return(client.result())
+    def take(self, n=1):
+        """
+        Return a list of `n` unique ClusterIds, leasing new blocks from the
+        keymaster if needed.
+        """
+        with self._lock:
+            ids = []
+            while(len(ids) < n):
+                if(self._next == self._end):
+                    self._refill(n - len(ids))
+                count = min(self._end - self._next, n - len(ids))
+                ids += range(self._next, self._next + count)
+                self._next += count
 
+            if(self._prefetch is None and
+               self._end - self._next < self.block_size // 2):
+                self._prefetch = self._request(self.block_size)
+        return(ids)
 
 
+# The ClusterId cache shared by all spread submissions in this process.
+cluster_ids = ClusterIdCache()
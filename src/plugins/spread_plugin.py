@@ -3,17 +3,19 @@ Define all Makefile-specific properties here.
 
 This is a bit of a hack... err... proof of concept, I mean ;-)
 """
-import collections
 import os
+import Queue
+import re
 import shutil
 import socket
+import threading
 import time
 
 from owl import dag
 from owl import blackboard
 from owl.utils import which
 from spread import client
-from spread_keyclient import get_clusterid
+from spread_keyclient import cluster_ids
 
 
 
@@ -21,6 +23,11 @@ from spread_keyclient import get_clusterid
 # TODO: infer these fron the condor/owl config
 JOB_HOOK = os.path.join(os.path.dirname(which('owld.py')), 'owl_job_hook.py')
 HOSTNAME = socket.gethostname()
+# Macros expanded in each node instance.
+_MACRO = re.compile(r'\$\((process|cluster)\)', re.IGNORECASE)
+# Exit code of DAGs some of whose nodes were never dispatched (e.g. because of
+# a loop).
+INCOMPLETE_EXIT_CODE = 1
 
 
 
@@ -30,30 +37,80 @@ class DAG(dag.DAG):
     spaces!
     """
     def execute(self, work_dir):
-        err = 0
-        running = _enqueue(self.roots, work_dir)
-
-        # Now wait. A node is done if and only if al its instances are done.
-        total_time = 0.
-        while(running):
-            instances = running.pop(0)
-            not_done = [(p, n) for (p, n) in instances if not p.is_ready()]
-            for (promise, node) in not_done:
-                promise.wait()
-            done = [(p, n) for (p, n) in instances if p.is_ready()]
-            for (promise, node) in done:
-                res = promise.result()
-                if(res['terminated'] or res['exit_code'] != 0):
-                    print(res)
-                    return(res['exit_code'])
-
-            if(len(done) == len(instances)):
-                # Move to the next nodes.
-                running += _enqueue(instances[0][1].children, work_dir)
-            else:
-                running.append(instances)
-        return(err)
-
+        """
+        Submit the DAG nodes as soon as they are ready to run (i.e. as soon as
+        all their parents completed) and block until the DAG either failed or
+        finished. A node is done if and only if all its instances are done.
+        Return 0 or the exit code of the first failed node instance
+        (INCOMPLETE_EXIT_CODE if some nodes were never dispatched at all).
+        """
+        # Number of parents each node is still waiting for.
+        waiting = dict([(node.name, len(node.parents)) for node in self.nodes])
+        # Number of instances of each node which have not completed yet.
+        remaining = {}
+        # Names of the nodes all of whose instances completed successfully.
+        finished = set()
+        # Completed instances, in completion order, as (promise, node) tuples.
+        done = Queue.Queue()
+
+        def dispatch(node):
+            instances = _enqueue([node, ], work_dir)[0]
+            remaining[node.name] = len(instances)
+            for (promise, instance) in instances:
+                _notify_when_done(promise, instance, done)
+            if(not instances):
+                completed(node)
+            return
+
+        def completed(node):
+            finished.add(node.name)
+            # Each child is dispatched exactly once: when its last parent
+            # completes.
+            for child in node.children:
+                waiting[child.name] -= 1
+                if(not waiting[child.name]):
+                    dispatch(child)
+            return
+
+        for node in self.roots:
+            dispatch(node)
+
+        while(any(remaining.values())):
+            (promise, node) = done.get()
+            res = promise.result()
+            if(res['terminated'] or res['exit_code'] != 0):
+                print(res)
+                return(res['exit_code'])
+
+            remaining[node.name] -= 1
+            if(not remaining[node.name]):
+                completed(node)
+
+        if(len(finished) != len(self.nodes)):
+            names = [n.name for n in self.nodes if n.name not in finished]
+            print('Nodes %s were never dispatched' % (', '.join(sorted(names))))
+            return(INCOMPLETE_EXIT_CODE)
+        return(0)
+
+
+
+def _notify_when_done(promise, node, done):
+    """
+    Put (promise, node) in the `done` queue as soon as `promise` is ready.
+    Promises only offer a blocking wait(), so each pending one gets a thread
+    waiting on it.
+    """
+    if(promise.is_ready()):
+        done.put((promise, node))
+        return
+
+    def wait():
+        promise.wait()
+        done.put((promise, node))
+    thread = threading.Thread(target=wait)
+    thread.daemon = True
+    thread.start()
+    return
 
 
 def _copy_input_files(node, work_dir):
@@ -76,11 +133,18 @@ def _enqueue(nodes, work_dir, job_hook=JOB_HOOK, hostname=HOSTNAME):
         instances = []
         t = int(time.time())
 
+        # Parse-free instance creation: the job template is built once per
+        # node and each instance is materialized from it.
+        template = JobTemplate(node.job)
+
+        # One ClusterId per instance, all leased at once.
+        clusterids = cluster_ids.take(node.job.Instances)
         for _id in range(node.job.Instances):
-            node = _expand_vars(node, _id)
-            _copy_input_files(node, work_dir)
-            job = node.job
-            job.ClusterId = get_clusterid()
+            instance = NodeInstance(node,
+                                    template.instance(_id, clusterids[_id]))
+            _copy_input_files(instance, work_dir)
+            job = instance.job
+            job.ClusterId = clusterids[_id]
             job.ProcId = _id
             job.GlobalJobId = '%s#%d.%d#%d' % (hostname, job.ClusterId, _id, t)
             if(not job._raw_classad.endswith('\n')):
@@ -99,7 +163,7 @@ def _enqueue(nodes, work_dir, job_hook=JOB_HOOK, hostname=HOSTNAME):
                 job.Error = None
 
             promise = client.async_call('system',
-                                        _mkargv(node),
+                                        _mkargv(instance),
                                         {'cwd': work_dir,
                                          'getenv': job.GetEnv,
                                          'environment': job.EnvironmentDict,
@@ -111,44 +175,131 @@ def _enqueue(nodes, work_dir, job_hook=JOB_HOOK, hostname=HOSTNAME):
                                          'pre_proc': job_hook,
                                          'post_proc': job_hook,
                                          'classad': job._raw_classad})
-            instances.append((promise, node))
+            instances.append((promise, instance))
         running.append(instances)
     return(running)
 
 
-def _expand_vars(node, instance_id):
-    # TODO: Support $(Cluester) as well.
-    mapping = {'$(Process)': str(instance_id)}
-
-    new_node = _copynode(node)
-    for key in new_node.job.__dict__.keys():
-        for var in mapping.keys():
-            value = getattr(new_node.job, key)
-
-            # Simple strings or unicode.
-            if(isinstance(value, basestring) and var in value):
-                setattr(new_node.job, key, value.replace(var, mapping[var]))
-            # Lists and tuples.
-            elif(isinstance(value, collections.Sequence)):
-                for i in range(len(value)):
-                    if(isinstance(value[i], basestring) and var in value):
-                        value[i] = value[i].replace(var, mapping[var])
-                setattr(new_node.job, key, value)
-            # And now: dictionaries!
-            elif(isinstance(value, collections.Mapping)):
-                for i in value:
-                    if(isinstance(value[i], basestring) and var in value):
-                        value[i] = value[i].replace(var, mapping[var])
-                setattr(new_node.job, key, value)
-    return(new_node)
-
-
-def _copynode(node):
-    new_node = dag.Node(name=node.name,
-                        script=node.script,
-                        children=node.children,
-                        parents=node.parents)
-    return(new_node)
+
+class JobTemplate(object):
+    """
+    Immutable per-node job template from which per-instance jobs are created
+    without copying or re-parsing the node .job file. Attribute values (strings
+    as well as strings inside lists, tuples and dictionaries) containing
+    $(Process) or $(Cluster) are split, once, into literal text and macros:
+    creating an instance only substitutes those.
+    """
+    __slots__ = ('_cls', '_static', '_sites')
+
+    def __init__(self, job):
+        self._cls = job.__class__
+        static = {}
+        sites = []
+        for (key, value) in job.__dict__.items():
+            site = _site(value)
+            if(site is None):
+                static[key] = value
+            else:
+                sites.append((key, site))
+        self._static = static
+        self._sites = tuple(sites)
+        return
+
+    def instance(self, process, cluster):
+        """
+        Return a new job for instance `process` of cluster `cluster`. The job
+        shares the attribute values which do not depend on either.
+        """
+        mapping = {'process': unicode(process), 'cluster': unicode(cluster)}
+        job = object.__new__(self._cls)
+        attributes = job.__dict__
+        attributes.update(self._static)
+        for (key, site) in self._sites:
+            attributes[key] = site.materialize(mapping)
+        return(job)
+
+
+
+class NodeInstance(object):
+    """
+    One instance of a DAG node: same name and relatives as the node, its own
+    job.
+    """
+    __slots__ = ('name', 'script', 'job', 'children', 'parents')
+
+    def __init__(self, node, job):
+        self.name = node.name
+        self.script = node.script
+        self.job = job
+        self.children = node.children
+        self.parents = node.parents
+        return
+
+
+class _Site(object):
+    """
+    Substitution site of an attribute value containing macros. kind is
+        'str'   parts = [literal, macro, literal, ...]
+        'seq'   parts = [_Site or item, ...]
+        'map'   parts = [(key, _Site or item), ...]
+    where macros are lower-case macro names and cls is the type of the value.
+    """
+    __slots__ = ('kind', 'cls', 'parts')
+
+    def __init__(self, kind, cls, parts):
+        self.kind = kind
+        self.cls = cls
+        self.parts = parts
+        return
+
+    def materialize(self, mapping):
+        """
+        Return the value with macros replaced by their values in `mapping`.
+        """
+        if(self.kind == 'str'):
+            text = ''.join([mapping[part] if i % 2 else part
+                            for (i, part) in enumerate(self.parts)])
+            return(self.cls(text))
+        if(self.kind == 'seq'):
+            return(self.cls([_materialize(part, mapping)
+                             for part in self.parts]))
+        return(self.cls([(key, _materialize(part, mapping))
+                         for (key, part) in self.parts]))
+
+
+def _materialize(value, mapping):
+    if(isinstance(value, _Site)):
+        return(value.materialize(mapping))
+    return(value)
+
+
+def _site(value):
+    """
+    Return the _Site for `value` or None if `value` contains no macro.
+    """
+    if(isinstance(value, basestring)):
+        parts = _MACRO.split(value)
+        if(len(parts) == 1):
+            return
+        parts[1::2] = [macro.lower() for macro in parts[1::2]]
+        return(_Site('str', type(value), parts))
+
+    if(isinstance(value, (list, tuple))):
+        sites = [_site(item) for item in value]
+        if(sites.count(None) == len(sites)):
+            return
+        return(_Site('seq', type(value),
+                     [item if site is None else site
+                      for (site, item) in zip(sites, value)]))
+
+    if(isinstance(value, dict)):
+        sites = [(key, _site(item)) for (key, item) in value.items()]
+        if(not [site for (_, site) in sites if site is not None]):
+            return
+        return(_Site('map', type(value),
+                     [(key, value[key] if site is None else site)
+                      for (key, site) in sites]))
+    return
 
 
 def _mkargv(node):
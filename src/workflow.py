@@ -1,16 +1,123 @@
 """
 Workflow class and related utility functions.
+
+Compiling templates is not free. Workflow instances with the same template root
+share one jinja2 Environment (which keeps compiled templates around and only
+recompiles those which changed on disk). If the template_cache owlrc entry is
+set, compiled templates are also stored there (see jinja2 bytecode caches) and
+reused across processes e.g. across invocations of the same submit script. Each
+user gets their own subdirectory of template_cache and never loads bytecode
+written by somebody else.
+
+Usage
+    >>> wflow = Workflow.shared(template_root)
+    >>> wflow.execute(code_root, repository, dataset)
 """
+import multiprocessing
 import os
 import tempfile
+import threading
+import time
 
 # import drmaa
 import jinja2
 
 import plugins
+from config import DIRECTORIES_TEMPLATE_CACHE
+
+
+
+# Constants
+# {(template root, bytecode cache directory): jinja2.Environment}
+_ENVIRONMENTS = {}
+# {(Workflow class, template root, bytecode cache directory): Workflow}
+_WORKFLOWS = {}
+_REGISTRY_LOCK = threading.Lock()
+# Number of datasets handed to an execute_many worker process at a time.
+RENDER_CHUNK_SIZE = 8
+# The Workflow whose templates execute_many worker processes render.
+_RENDERING = None
+_RENDER_LOCK = threading.Lock()
+
+
+
+
+def _get_environment(template_root, template_cache):
+    """
+    Return the (shared) jinja2 Environment for `template_root`, using a bytecode
+    cache in the directory `template_cache` unless that is None.
+    """
+    key = (os.path.abspath(template_root), template_cache)
+    with _REGISTRY_LOCK:
+        env = _ENVIRONMENTS.get(key)
+        if(env is None):
+            bytecode_cache = None
+            directory = _user_directory(template_cache)
+            if(directory):
+                bytecode_cache = _BytecodeCache(directory)
+            env = jinja2.Environment(loader=jinja2.FileSystemLoader(key[0]),
+                                     bytecode_cache=bytecode_cache,
+                                     auto_reload=True)
+            _ENVIRONMENTS[key] = env
+    return(env)
+
+
+def _user_directory(template_cache):
+    """
+    Return our own subdirectory of `template_cache` (which might be shared by
+    all OWL users), creating it if needed. Return None if `template_cache` is
+    None or if that subdirectory belongs to somebody else.
+    """
+    if(not template_cache):
+        return
+    if(not os.path.isdir(template_cache)):
+        os.makedirs(template_cache)
+    path = os.path.join(template_cache, str(os.getuid()))
+    if(not os.path.isdir(path)):
+        os.mkdir(path, 0700)
+    if(os.stat(path).st_uid != os.getuid()):
+        return
+    return(path)
 
 
 
+class _BytecodeCache(jinja2.FileSystemBytecodeCache):
+    """
+    jinja2 bytecode cache which only loads files owned by the current user:
+    bytecode is code, we do not want to run whatever somebody else put there.
+    """
+    def load_bytecode(self, bucket):
+        try:
+            f = open(self._get_cache_filename(bucket), 'rb')
+        except (IOError, OSError):
+            return
+        try:
+            if(os.fstat(f.fileno()).st_uid == os.getuid()):
+                bucket.load_bytecode(f)
+        finally:
+            f.close()
+        return
+
+
+
+def _render_one(task):
+    """
+    Render the templates of _RENDERING for one dataset (in an execute_many
+    worker process). `task` is a tuple
+        (dataset, code_root, repository, work_dir, flavour, extra_env)
+    Return (dataset, dag file name, work_dir, seconds, error message or None).
+    """
+    (dataset, code_root, repository, work_dir, flavour, extra_env) = task
+    t0 = time.time()
+    dag_name = None
+    error = None
+    try:
+        (dag_name, work_dir) = _RENDERING._render(code_root, repository,
+                                                  dataset, work_dir, flavour,
+                                                  extra_env)
+    except Exception, e:
+        error = '%s: %s' % (e.__class__.__name__, e)
+    return((dataset, dag_name, work_dir, time.time() - t0, error))
 
 
 
@@ -19,21 +126,57 @@ class Workflow(object):
     """
     Workflow: a templated DAG.
     """
-    def __init__(self, template_root):
-        # Init the template engine.
-        loader = jinja2.FileSystemLoader(template_root)
-        env = jinja2.Environment(loader=loader)
-
-        # Load all the available templates.
-        self.templates = [env.get_template(path)
-                          for path in loader.list_templates()]
+    @classmethod
+    def shared(cls, template_root, template_cache=DIRECTORIES_TEMPLATE_CACHE):
+        """
+        Return the Workflow instance (of this very class) for `template_root`,
+        creating it the first time. Use this instead of instantiating a new
+        Workflow for each dataset.
+        """
+        key = (cls, os.path.abspath(template_root), template_cache)
+        with _REGISTRY_LOCK:
+            wflow = _WORKFLOWS.get(key)
+        if(wflow is None):
+            wflow = cls(template_root, template_cache)
+            with _REGISTRY_LOCK:
+                wflow = _WORKFLOWS.setdefault(key, wflow)
+        return(wflow)
+
+    def __init__(self, template_root,
+                 template_cache=DIRECTORIES_TEMPLATE_CACHE):
+        # Init the template engine (shared by all Workflows with the same
+        # template_root).
+        self.env = _get_environment(template_root, template_cache or None)
+
+        # Make sure that we have a .dag template to begin with.
+        self.dag
+        return
+
+    @property
+    def templates(self):
+        """
+        All the available templates. They are fetched from the template engine
+        each time, so that a shared Workflow always sees the current version of
+        its templates: those which were already loaded are only recompiled if
+        they changed on disk.
+        """
+        return([self.env.get_template(path)
+                for path in self.env.loader.list_templates()])
+
+    @property
+    def dag(self):
+        """
+        The .dag template.
+        """
+        return(self._dag(self.templates))
+
+    def _dag(self, templates):
         try:
-            self.dag = [t for t in self.templates if t.name.endswith('.dag')][0]
+            return([t for t in templates if t.name.endswith('.dag')][0])
         except:
             msg = 'We do not support the case where a workflow .dag file is' + \
                   ' not present.'
             raise(NotImplementedError(msg))
-        return
 
 
     def execute(self, code_root, repository, dataset, work_dir=None,
@@ -46,6 +189,106 @@ class Workflow(object):
         if(extra_env is None):
             extra_env = {}
 
+        (dag_name, work_dir) = self._render(code_root, repository, dataset,
+                                            work_dir, flavour, extra_env)
+
+        # Now submit the whole workflow via DRMAA.
+        return(self._submit(dag_name, work_dir, flavour, extra_env, wait))
+
+
+    def execute_many(self, datasets, code_root, repository, work_dir=None,
+                     flavour='condor', extra_env=None, processes=None):
+        """
+        Execute the workflow for each dataset in `datasets` (any iterable, e.g.
+        a generator). This is equivalent to (but much faster than) calling
+        self.execute() once per dataset: templates are rendered by a pool of
+        `processes` worker processes (one per CPU by default) and workflows are
+        submitted as soon as they are rendered, all within a single session of
+        the batch job execution system (if the plugin supports it, see
+        condor_plugin.Session).
+
+        If work_dir is None, each dataset gets its own temporary directory.
+
+        Return
+            [{'dataset': dataset,
+              'job_id': job id or None,
+              'work_dir': work directory,
+              'render_time': seconds,
+              'submit_time': seconds,
+              'error': None or error message}, ...]
+            in the same order as `datasets`.
+        """
+        global _RENDERING
+
+        if(extra_env is None):
+            extra_env = {}
+        tasks = [(dataset, code_root, repository, work_dir, flavour, extra_env)
+                 for dataset in datasets]
+
+        if(processes is None):
+            processes = multiprocessing.cpu_count()
+        processes = max(1, min(processes, len(tasks)))
+
+        pool = None
+        with _RENDER_LOCK:
+            # Worker processes are forked and inherit _RENDERING: we do not have
+            # to pickle self (which we could not, since it holds a jinja2
+            # Environment).
+            _RENDERING = self
+            try:
+                if(processes > 1):
+                    pool = multiprocessing.Pool(processes)
+                    rendered = pool.imap(_render_one, tasks, RENDER_CHUNK_SIZE)
+                else:
+                    rendered = [_render_one(task) for task in tasks]
+            finally:
+                _RENDERING = None
+
+        # Submit as results come in: rendering and submission overlap.
+        if(extra_env):
+            os.environ.update(extra_env)
+        plugin = getattr(plugins, flavour + '_plugin')
+        session = None
+        if(hasattr(plugin, 'Session')):
+            session = plugin.Session()
+
+        results = []
+        try:
+            for (dataset, dag_name, dir_name, render_time, error) in rendered:
+                result = {'dataset': dataset,
+                          'job_id': None,
+                          'work_dir': dir_name,
+                          'render_time': render_time,
+                          'submit_time': 0.,
+                          'error': error}
+                results.append(result)
+                if(error):
+                    continue
+
+                t0 = time.time()
+                try:
+                    if(session is not None):
+                        result['job_id'] = session.submit(dag_name, dir_name)
+                    else:
+                        result['job_id'] = plugin.submit(dag_name, dir_name)
+                except Exception, e:
+                    result['error'] = '%s: %s' % (e.__class__.__name__, e)
+                result['submit_time'] = time.time() - t0
+        finally:
+            if(session is not None):
+                session.close()
+            if(pool is not None):
+                pool.close()
+                pool.join()
+        return(results)
+
+
+    def _render(self, code_root, repository, dataset, work_dir, flavour,
+                extra_env):
+        """
+        Render the templates for `dataset` into `work_dir` (a new temporary
+        directory if work_dir is None). Return (dag file name, work_dir).
+        """
         # Get any extra keyword we might need for our templates.
         extrakwds = self.get_extra_keywords(code_root, repository, dataset,
                                             work_dir, flavour, extra_env)
@@ -72,7 +315,8 @@ class Workflow(object):
         # work_dir. By convention we rename the templates to make them dataset
         # specific: root_<dataset>.extension
         #   e.g. processMef_J9AM01071.job
-        for tmplt in self.templates:
+        templates = self.templates
+        for tmplt in templates:
             # Make it dataset specific
             (root, ext) = os.path.splitext(tmplt.name)
             file_name = root + '_' + dataset + ext
@@ -83,11 +327,9 @@ class Workflow(object):
             fid.close()
 
         # Update the name of the dag accordingly
-        (root, ext) = os.path.splitext(self.dag.name)
+        (root, ext) = os.path.splitext(self._dag(templates).name)
         dag_name = root + '_' + dataset + ext
-
-        # Now submit the whole workflow via DRMAA.
-        return(self._submit(dag_name, work_dir, flavour, extra_env, wait))
+        return((dag_name, work_dir))
 
 
     def get_extra_keywords(self, code_root, repository, dataset, work_dir,
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+"""
+Blackboard tests. They use a throw-away SQLite database, not the one in owlrc.
+
+Usage
+    shell> python test/test_blackboard.py
+"""
+import datetime
+import os
+import tempfile
+import unittest
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'blackboard.sqlite')
+os.environ['OWL_DATABASE_CONNECTION_STR'] = 'sqlite:///' + DB_PATH
+
+import elixir
+from sqlalchemy.orm.exc import NoResultFound
+
+from owl import blackboard
+from owl.blackboard import Blackboard, BlackboardSummary
+
+
+
+
+# Constants
+START = 1363295847
+
+
+
+def make_ad(job_id, **attrs):
+    """
+    Return the text of a minimal job ClassAd for `job_id`, with the extra
+    attributes `attrs` (None values remove the attribute).
+    """
+    cluster_proc = job_id.split('#')[1]
+    (cluster, proc) = cluster_proc.split('.')
+    values = {'GlobalJobId': job_id,
+              'ClusterId': int(cluster),
+              'ProcId': int(proc),
+              'Owner': 'fpierfed',
+              'DAGManJobId': 1,
+              'DAGNodeName': 'PROC_MEF',
+              'Arguments': '-i raw-%s.fits -o out.fits' % (cluster),
+              'JobStartDate': START + int(cluster),
+              'JobState': 'Running',
+              'Instances': 4}
+    values.update(attrs)
+
+    lines = []
+    for (key, val) in sorted(values.items()):
+        if(val is None):
+            continue
+        if(isinstance(val, basestring)):
+            val = '"%s"' % (val)
+        lines.append('%s = %s' % (key, val))
+    return('\n'.join(lines) + '\n')
+
+
+def job_id(n):
+    return('host.example.com#%d.0#%d' % (n, START))
+
+
+def dump(table):
+    """
+    Return the content of `table` as stored in the database (i.e. without any
+    conversion done by SQLAlchemy) as {GlobalJobId: row}.
+    """
+    sql = 'SELECT * FROM %s' % (table)
+    rows = blackboard._connect().execute(sql).fetchall()
+    return(dict([(row['GlobalJobId'], tuple(row)) for row in rows]))
+
+
+def stored(column, globalJobId):
+    """
+    Return the value of `column` for `globalJobId` as stored in the database.
+    """
+    sql = 'SELECT %s FROM blackboard WHERE GlobalJobId = ?' % (column)
+    return(blackboard._connect().execute(sql, globalJobId).scalar())
+
+
+def event_stream():
+    """
+    A job hook event stream exercising all the code paths of processHookEvent.
+    """
+    return([('prepare_job', make_ad(job_id(1))),
+            ('prepare_job', make_ad(job_id(2), InputDataset='ds2')),
+            ('update_job', make_ad(job_id(1), JobState='Suspended',
+                                   Instances=99)),
+            # Rescue DAG: prepare_job for a known job.
+            ('prepare_job', make_ad(job_id(2), Instances=7, Dataset='other',
+                                    JobState='Starting')),
+            ('job_exit', make_ad(job_id(1), JobState='Exited', ExitCode=0,
+                                 JobDuration=12.5, CompletionDate=0)),
+            ('prepare_job', make_ad(job_id(3), Arguments='-x')),
+            ('job_exit', make_ad(job_id(2), JobState='Exited', ExitCode=1,
+                                 JobDuration=3., CompletionDate=START + 10))])
+
+
+
+class BlackboardTestCase(unittest.TestCase):
+    def setUp(self):
+        blackboard._connect()
+        elixir.create_all()
+        self.clear()
+        return
+
+    def tearDown(self):
+        elixir.session.rollback()
+        self.clear()
+        return
+
+    def clear(self):
+        elixir.session.close()
+        engine = blackboard._connect()
+        engine.execute(Blackboard.table.delete())
+        engine.execute(BlackboardSummary.table.delete())
+        return
+
+
+
+class IngestManyTest(BlackboardTestCase):
+    def test_update_read_back(self):
+        blackboard.ingestMany([('prepare_job', make_ad(job_id(1))),
+                               ('prepare_job', make_ad(job_id(2)))])
+        blackboard.ingestMany([('update_job',
+                                make_ad(job_id(1), JobStartDate=START + 100,
+                                        CompletionDate=START + 200,
+                                        JobState='Exited'))])
+
+        entry = Blackboard.query.filter_by(GlobalJobId=job_id(1)).one()
+        self.assertEqual(entry.JobState, 'Exited')
+        self.assertEqual(entry.Instances, 4)
+        self.assertEqual(entry.JobStartDate,
+                         datetime.datetime.utcfromtimestamp(START + 100))
+        self.assertEqual(entry.CompletionDate,
+                         datetime.datetime.utcfromtimestamp(START + 200))
+
+        # Updated and inserted timestamps compare and sort together.
+        newest = Blackboard.query \
+                           .order_by(Blackboard.JobStartDate.desc()).first()
+        self.assertEqual(newest.GlobalJobId, job_id(1))
+        found = Blackboard.query.filter(Blackboard.JobStartDate ==
+                                        entry.JobStartDate).all()
+        self.assertEqual([e.GlobalJobId for e in found], [job_id(1)])
+
+        # Same stored format as when written by the ORM.
+        blackboard.processHookEvent('update_job', make_ad(job_id(2)))
+        self.assertEqual(len(stored('JobStartDate', job_id(1))),
+                         len(stored('JobStartDate', job_id(2))))
+        return
+
+    def test_same_as_processHookEvent(self):
+        for (role, ad) in event_stream():
+            blackboard.processHookEvent(role, ad)
+        expected = (dump('blackboard'), dump('blackboard_summary'))
+        self.assertEqual(len(expected[0]), 3)
+        self.clear()
+
+        self.assertEqual(blackboard.ingestMany(event_stream()), 3)
+        self.assertEqual((dump('blackboard'), dump('blackboard_summary')),
+                         expected)
+        self.clear()
+
+        # Same, one event per batch.
+        for event in event_stream():
+            blackboard.ingestMany([event, ])
+        self.assertEqual((dump('blackboard'), dump('blackboard_summary')),
+                         expected)
+        return
+
+    def test_unknown_job(self):
+        self.assertRaises(NoResultFound, blackboard.processHookEvent,
+                          'update_job', make_ad(job_id(1)))
+        elixir.session.rollback()
+
+        events = [('prepare_job', make_ad(job_id(2))),
+                  ('update_job', make_ad(job_id(1)))]
+        self.assertRaises(NoResultFound, blackboard.ingestMany, events)
+        self.assertEqual(dump('blackboard'), {})
+        self.assertEqual(dump('blackboard_summary'), {})
+        return
+
+    def test_bad_role(self):
+        self.assertRaises(ValueError, blackboard.ingestMany,
+                          [('submit_job', make_ad(job_id(1)))])
+        return
+
+
+
+class PaginationTest(BlackboardTestCase):
+    def setUp(self):
+        BlackboardTestCase.setUp(self)
+
+        # Half the jobs through the ORM, half in batches, some with the same
+        # JobStartDate and some without one. Then update some of each through
+        # ingestMany.
+        for n in range(1, 11):
+            blackboard.processHookEvent('prepare_job', make_ad(job_id(n)))
+        blackboard.ingestMany([('prepare_job',
+                                make_ad(job_id(n), JobStartDate=START))
+                               for n in range(11, 16)])
+        blackboard.ingestMany([('prepare_job',
+                                make_ad(job_id(n), JobStartDate=None))
+                               for n in range(16, 21)])
+        blackboard.ingestMany([('update_job',
+                                make_ad(job_id(n), JobStartDate=START + 2 * n))
+                               for n in range(1, 21, 3)])
+        self.expected = set([job_id(n) for n in range(1, 21)])
+        return
+
+    def walk(self, limit, **kwds):
+        """
+        Page through all the entries, `limit` at a time, and return their
+        GlobalJobIds in the order we got them.
+        """
+        ids = []
+        cursor = None
+        for _ in range(len(self.expected) + 2):
+            (entries, cursor) = blackboard.listEntriesPage(limit=limit,
+                                                           cursor=cursor,
+                                                           **kwds)
+            self.assertTrue(limit is None or len(entries) <= limit)
+            ids += [e.GlobalJobId for e in entries]
+            if(cursor is None):
+                return(ids)
+        self.fail('Paging never ended: got %s' % (ids))
+        return
+
+    def test_walk_to_the_end(self):
+        for newest_first in (True, False):
+            everything = self.walk(None, newest_first=newest_first)
+            self.assertEqual(len(everything), len(self.expected))
+            self.assertEqual(set(everything), self.expected)
+
+            for limit in (1, 3, 20, 100):
+                for summary in (False, True):
+                    ids = self.walk(limit, newest_first=newest_first,
+                                    summary=summary)
+                    self.assertEqual(ids, everything)
+        return
+
+    def test_order(self):
+        entries = []
+        cursor = None
+        while(True):
+            (page, cursor) = blackboard.listEntriesPage(limit=4, cursor=cursor)
+            entries += page
+            if(cursor is None):
+                break
+        dated = [(e.JobStartDate, e.GlobalJobId) for e in entries
+                 if e.JobStartDate is not None]
+        self.assertEqual(dated, sorted(dated, reverse=True))
+        # Entries without a JobStartDate (16 and 19 got one afterwards) come
+        # last.
+        self.assertEqual(len(dated), 17)
+        self.assertTrue(all([e.JobStartDate is None for e in entries[17:]]))
+        return
+
+    def test_filters(self):
+        ids = self.walk(2, owner='fpierfed', dataset='raw-12.fits')
+        self.assertEqual(ids, [job_id(12)])
+        self.assertEqual(self.walk(2, owner='nobody'), [])
+        return
+
+    def test_bad_cursor(self):
+        self.assertRaises(ValueError, blackboard.listEntriesPage,
+                          cursor='not a cursor')
+        return
+
+
+class FieldsTest(BlackboardTestCase):
+    def setUp(self):
+        BlackboardTestCase.setUp(self)
+        for (role, ad) in event_stream():
+            blackboard.processHookEvent(role, ad)
+        return
+
+    def check(self, full, projected, fields):
+        self.assertEqual(len(projected), len(full))
+        for (f, p) in zip(full, projected):
+            self.assertFalse(isinstance(p, (Blackboard, BlackboardSummary)))
+            for field in fields:
+                self.assertEqual(getattr(p, field), getattr(f, field))
+        return
+
+    def test_listEntries(self):
+        fields = ('GlobalJobId', 'ExitCode', 'JobState')
+        for summary in (False, True):
+            full = blackboard.listEntries(summary=summary)
+            projected = blackboard.listEntries(summary=summary, fields=fields)
+            self.check(full, projected, fields)
+            # Columns nobody asked for are not fetched.
+            self.assertFalse(hasattr(projected[0], 'Owner'))
+        return
+
+    def test_listEntriesPage(self):
+        fields = ('ExitCode', 'Dataset')
+        (full, _) = blackboard.listEntriesPage(limit=None)
+        (projected, cursor) = blackboard.listEntriesPage(limit=2,
+                                                         fields=fields)
+        self.check(full[:2], projected, fields)
+        # The cursor works even if we did not ask for its columns.
+        (rest, cursor) = blackboard.listEntriesPage(limit=2, cursor=cursor,
+                                                    fields=fields)
+        self.check(full[2:], rest, fields)
+        self.assertEqual(cursor, None)
+        return
+
+    def test_getOSFEntry(self):
+        fields = ('GlobalJobId', 'JobState')
+        dag_id = 'host.example.com#1.0#%d' % (START)
+        full = blackboard.getOSFEntry(dag_id)
+        projected = blackboard.getOSFEntry(dag_id, summary=True, fields=fields)
+        self.assertEqual(projected[:3], full[:3])
+        self.check(full[3], projected[3], fields)
+        return
+
+    def test_unknown_field(self):
+        self.assertRaises(ValueError, blackboard.listEntries,
+                          fields=('NotAColumn', ))
+        self.assertRaises(ValueError, blackboard.listEntries, summary=True,
+                          fields=('Arguments', ))
+        return
+
+
+class UpgradeTest(BlackboardTestCase):
+    def test_indexes_and_summary(self):
+        for (role, ad) in event_stream():
+            blackboard.processHookEvent(role, ad)
+        expected = dump('blackboard_summary')
+
+        # Turn the database into one from before the indexes and the summary.
+        engine = blackboard._connect()
+        for index in Blackboard.table.indexes:
+            engine.execute('DROP INDEX %s' % (index.name))
+        BlackboardSummary.table.drop(bind=engine)
+
+        # What blackboard-init.py does.
+        elixir.create_all()
+        names = set([i.name for i in Blackboard.table.indexes])
+        self.assertEqual(set(blackboard.createIndexes()), names)
+        self.assertEqual(blackboard.createIndexes(), [])
+        blackboard.rebuildSummary()
+        self.assertEqual(dump('blackboard_summary'), expected)
+        return
+
+
+
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""
+ClassAd parsing tests: the single-pass and incremental parsers have to give
+the same results as the original one (copied below).
+
+Usage
+    shell> python test/test_classad.py
+"""
+import os
+import StringIO
+import unittest
+
+from owl import classad
+from owl import condorutils
+
+
+
+
+# Constants
+HERE = os.path.dirname(os.path.abspath(__file__))
+AD_TEXT = open(os.path.join(HERE, 'ad.txt')).read()
+# Values exercising every branch of the value parser.
+ODD_AD_TEXT = '''MyType = "Machine"
+Name = "slot1@node1.example.com"
+# A comment.
++Dataset = "raw-000001.fits"
+Int = 42
+Negative = -7
+Positive = +7
+Zero = 0
+Float = 3.25
+Dot = 5.
+LeadingDot = .5
+Exp = 1e5
+NegExp = -2.5E-3
+Inf = inf
+MinusInfinity = -Infinity
+False = FALSE
+True = true
+Hex = 0x10
+Version = 7.6.10
+Empty = ""
+Quoted = "a \\"quoted\\" string"
+Requirements = (Arch == "X86_64") && \\
+               (Memory > 1024)
+Expr = ceiling(ImageSize / 1024.000000)
+Equals = a == b
+queue 12
+'''
+
+
+
+# The original parser.
+def old_parse_value(raw_value):
+    if(raw_value.startswith('"') and raw_value.endswith('"')):
+        return(unicode(raw_value[1:-1]))
+    if(raw_value.upper() == 'FALSE'):
+        return(False)
+    if(raw_value.upper() == 'TRUE'):
+        return(True)
+    try:
+        return(int(raw_value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return(float(raw_value))
+    except (TypeError, ValueError):
+        pass
+    return(unicode(raw_value))
+
+
+def old_parse(classad_text):
+    classad_text = classad.MULTILINE_BUSTER.sub(' ', classad_text)
+
+    res = {}
+    for line in classad_text.split('\n'):
+        line = line.strip()
+        if(not(line)):
+            continue
+        if(line.lower().startswith('queue')):
+            res['Instances'] = classad._extract_num_instances(line)
+            continue
+        if(line.startswith('#')):
+            continue
+
+        raw_key, raw_val = line.split('=', 1)
+        key = raw_key.strip()
+        if(key[0] == '+'):
+            key = key[1:]
+        val = old_parse_value(raw_val.strip())
+        if(res.has_key(key)):
+            raise(NotImplementedError('ClassAd arrays are not supported.'))
+        res[key] = val
+    return(res)
+
+
+def public(attrs):
+    """
+    Return `attrs` without its private (i.e. starting with _) keys.
+    """
+    return(dict([(k, v) for (k, v) in attrs.items() if not k.startswith('_')]))
+
+
+def typed(attrs):
+    """
+    Return `attrs` with each value paired with its type, so that e.g. 1, 1.0
+    and True do not compare equal. Expressions are unicode strings.
+    """
+    res = {}
+    for (key, val) in attrs.items():
+        kind = type(val)
+        if(isinstance(val, unicode)):
+            kind = unicode
+        res[key] = (kind, val)
+    return(res)
+
+
+
+class ParseTest(unittest.TestCase):
+    def test_same_as_old_parser(self):
+        for text in (AD_TEXT, ODD_AD_TEXT):
+            self.assertEqual(typed(classad._parse(text)),
+                             typed(old_parse(text)))
+        return
+
+    def test_values(self):
+        attrs = classad._parse(ODD_AD_TEXT)
+        self.assertEqual(attrs['Instances'], 12)
+        self.assertEqual(attrs['Dataset'], u'raw-000001.fits')
+        self.assertEqual(attrs['Requirements'],
+                         u'(Arch == "X86_64") && (Memory > 1024)')
+        self.assertTrue(isinstance(attrs['Requirements'], classad.Expression))
+        self.assertFalse(isinstance(attrs['Name'], classad.Expression))
+        self.assertEqual(attrs['Exp'], 1e5)
+        self.assertEqual(attrs['MinusInfinity'], float('-inf'))
+        return
+
+    def test_errors(self):
+        self.assertRaises(Exception, classad._parse, 'no equal sign\n')
+        self.assertRaises(NotImplementedError, classad._parse, 'A = 1\nA = 2')
+        return
+
+
+class IterParseTest(unittest.TestCase):
+    def stream(self):
+        texts = [AD_TEXT, ODD_AD_TEXT, 'Name = "last"\nMemory = 1\n']
+        return(texts, '\n'.join(texts))
+
+    def test_same_as_old_parser(self):
+        (texts, stream) = self.stream()
+        ads = list(classad.iter_parse(StringIO.StringIO(stream)))
+        self.assertEqual([typed(ad) for ad in ads],
+                         [typed(old_parse(text)) for text in texts])
+
+        # Blank lines at either end and between ClassAds do not matter.
+        padded = '\n  \n' + stream.replace('\n\n', '\n\n\n') + '\n\n'
+        self.assertEqual([typed(ad) for ad in classad.iter_parse(
+                              padded.splitlines(True))],
+                         [typed(ad) for ad in ads])
+        return
+
+    def test_incremental(self):
+        (texts, stream) = self.stream()
+        lines = iter(StringIO.StringIO(stream))
+        ads = classad.iter_parse(lines)
+        ads.next()
+        # The first ClassAd was yielded without reading the whole stream.
+        self.assertTrue(len(list(lines)) > 0)
+        return
+
+    def test_attributes(self):
+        (texts, stream) = self.stream()
+        wanted = ('name', 'MEMORY', 'Instances', 'Requirements')
+        ads = list(classad.iter_parse(StringIO.StringIO(stream), wanted))
+        for (ad, text) in zip(ads, texts):
+            old = old_parse(text)
+            self.assertEqual(typed(ad),
+                             typed(dict([(k, v) for (k, v) in old.items()
+                                         if k.lower() in [w.lower()
+                                                          for w in wanted]])))
+        return
+
+    def test_iter_classads(self):
+        (texts, stream) = self.stream()
+        for cls in (classad.ClassAd, classad.CompactClassAd):
+            ads = list(condorutils.iter_classads(StringIO.StringIO(stream),
+                                                 cls=cls))
+            self.assertEqual([typed(public(ad.todict())) for ad in ads],
+                             [typed(dict([(k.lower(), v) for (k, v)
+                                          in old_parse(t).items()]))
+                              for t in texts])
+        self.assertEqual(condorutils._parse_classads(StringIO.StringIO('')),
+                         [])
+        return
+
+
+
+class CompactClassAdTest(unittest.TestCase):
+    def test_same_as_ClassAd(self):
+        compact = classad.CompactClassAd.new_from_classad(AD_TEXT)
+        ad = classad.ClassAd.new_from_classad(AD_TEXT)
+        self.assertEqual(compact.todict(), public(ad.todict()))
+        self.assertEqual(compact.GlobalJobId, ad.globaljobid)
+        self.assertEqual(compact.globaljobid, ad.GLOBALJOBID)
+        self.assertRaises(AttributeError, getattr, compact, 'NoSuchThing')
+
+        compact.NewAttribute = 1
+        compact.clusterid = 89
+        del(compact.Owner)
+        self.assertEqual(compact.newattribute, 1)
+        self.assertEqual(compact.ClusterId, 89)
+        self.assertFalse(hasattr(compact, 'owner'))
+        return
+
+    def test_shared_schemas(self):
+        ads = list(classad.iter_parse(StringIO.StringIO(AD_TEXT + '\n' +
+                                                        AD_TEXT)))
+        (a, b) = [classad.CompactClassAd(**attrs) for attrs in ads]
+        self.assertTrue(a._schema is b._schema)
+        a.Extra = 1
+        b.Extra = 2
+        self.assertTrue(a._schema is b._schema)
+        self.assertEqual((a.extra, b.extra), (1, 2))
+        return
+
+    def test_bounded_schemas(self):
+        for i in range(classad.MAX_SCHEMAS + 10):
+            ad = classad.CompactClassAd(**{'Name': 'x', 'Attr%d' % (i): i})
+            self.assertEqual(getattr(ad, 'attr%d' % (i)), i)
+        self.assertEqual(len(classad._SCHEMAS), classad.MAX_SCHEMAS)
+
+        # Ads whose schema was evicted keep working.
+        ad = classad.CompactClassAd(Name='first', Attr0=0)
+        for i in range(classad.MAX_SCHEMAS + 10):
+            classad.CompactClassAd(**{'Other%d' % (i): i})
+        self.assertEqual((ad.name, ad.attr0), ('first', 0))
+        ad.Attr1 = 1
+        self.assertEqual(ad.todict(), {'name': 'first', 'attr0': 0,
+                                       'attr1': 1})
+        return
+
+    def test_unicode_names(self):
+        self.assertEqual(classad._fold(u'Na\xefve'), u'na\xefve')
+        self.assertEqual(classad._fold(u'Name'), 'name')
+        self.assertTrue(type(classad._fold(u'Name')) is str)
+
+        ad = classad.CompactClassAd(**{u'Na\xefve': 1, u'Name': u'x'})
+        self.assertEqual(ad.todict(), {u'na\xefve': 1, 'name': u'x'})
+        self.assertEqual(ad.name, u'x')
+        return
+
+
+
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+ClassAd expression evaluation and match-making tests.
+
+Usage
+    shell> python test/test_classad_expr.py
+"""
+import unittest
+
+from owl import classad
+from owl import classad_expr
+from owl import matchmaking
+from owl.classad_expr import UNDEFINED, ERROR
+
+
+
+
+# Constants
+MACHINE_TEXT = '''MyType = "Machine"
+Name = "slot1@node1.example.com"
+Arch = "X86_64"
+Memory = 2048
+KFlops = 1000000
+Requirements = (TARGET.ImageSize < Memory) && (Memory >= 1024)
+'''
+JOB_TEXT = '''MyType = "Job"
+Owner = "fpierfed"
+ImageSize = 100
+Requirements = (Arch == "x86_64") && (TARGET.Memory >= 1024)
+Rank = KFlops / 1000.
+'''
+# Attribute values we cannot parse.
+UNPARSEABLE = ('{ "a", "b" }', '', '   ', 'a +', '[ a = 1 ]')
+
+
+
+def ad(text, **extra):
+    """
+    Return a ClassAd instance from `text` plus the Expression attributes
+    `extra`.
+    """
+    res = classad.ClassAd.new_from_classad(text)
+    for (key, val) in extra.items():
+        setattr(res, key, classad.Expression(val))
+    return(res)
+
+
+
+class EvaluateTest(unittest.TestCase):
+    def test_values(self):
+        evaluate = classad_expr.evaluate
+        self.assertEqual(evaluate('1 + 2 * 3'), 7)
+        self.assertEqual(evaluate('-7 / 2'), -3)
+        self.assertEqual(evaluate('"abc" == "ABC"'), True)
+        self.assertEqual(evaluate('"abc" =?= "ABC"'), False)
+        self.assertTrue(evaluate('x') is UNDEFINED)
+        self.assertEqual(evaluate('x =?= UNDEFINED'), True)
+        self.assertEqual(evaluate('FALSE && x'), False)
+        self.assertTrue(evaluate('1 / 0') is ERROR)
+        self.assertEqual(evaluate('ifThenElse(x > 1, 1, 2)', {'x': 3}), 1)
+        self.assertEqual(evaluate('regexp("^n.*1$", Name)',
+                                  {'name': u'node1'}), True)
+        return
+
+    def test_my_and_target(self):
+        machine = ad(MACHINE_TEXT)
+        job = ad(JOB_TEXT)
+        self.assertEqual(classad_expr.evaluate('MY.Memory + TARGET.ImageSize',
+                                               machine, job), 2148)
+        self.assertEqual(classad_expr.evaluate_attribute(job, 'requirements',
+                                                         machine), True)
+        self.assertTrue(classad_expr.matches(job, machine))
+        self.assertEqual(classad_expr.rank(job, machine), 1000.)
+        return
+
+    def test_syntax_errors(self):
+        for text in UNPARSEABLE:
+            self.assertRaises(ValueError, classad_expr.compile_expression, text)
+        return
+
+    def test_loops(self):
+        job = ad(JOB_TEXT, A='B + 1', B='A + 1')
+        self.assertTrue(classad_expr.evaluate_attribute(job, 'A') is ERROR)
+        return
+
+
+
+class ErrorTest(unittest.TestCase):
+    def test_unparseable_attributes(self):
+        for text in UNPARSEABLE:
+            job = ad(JOB_TEXT, Requirements=text, Rank=text)
+            machine = ad(MACHINE_TEXT, Lists=text)
+            self.assertTrue(classad_expr.evaluate_attribute(job, 'Rank',
+                                                            machine) is ERROR)
+            self.assertTrue(classad_expr.evaluate('isError(TARGET.Lists)', job,
+                                                  machine))
+            self.assertFalse(classad_expr.matches(job, machine))
+            self.assertEqual(classad_expr.rank(job, machine), 0.)
+
+            # Also when it is the machine Requirements.
+            machine = ad(MACHINE_TEXT, Requirements=text)
+            self.assertFalse(classad_expr.matches(ad(JOB_TEXT), machine))
+        return
+
+    def test_arguments(self):
+        self.assertTrue(classad_expr.evaluate('time(1)') is ERROR)
+        self.assertEqual(classad_expr.evaluate('time() > 0'), True)
+        self.assertTrue(classad_expr.evaluate('int(1, 2)') is ERROR)
+        self.assertTrue(classad_expr.evaluate('noSuchFunction(1)') is ERROR)
+        return
+
+    def test_shifts(self):
+        evaluate = classad_expr.evaluate
+        self.assertEqual(evaluate('3 << 2'), 12)
+        self.assertEqual(evaluate('-8 >> 1'), -4)
+        self.assertTrue(evaluate('1 << -1') is ERROR)
+        self.assertTrue(evaluate('1 >> -1') is ERROR)
+        # 64 bit integers.
+        self.assertEqual(evaluate('1 << 62'), 2 ** 62)
+        self.assertEqual(evaluate('1 << 63'), -2 ** 63)
+        self.assertEqual(evaluate('1 << 100000000000'), 0)
+        self.assertEqual(evaluate('-1 >> 100000000000'), -1)
+        return
+
+    def test_bad_regexp(self):
+        self.assertTrue(classad_expr.evaluate('regexp("(", "x")') is ERROR)
+        job = ad(JOB_TEXT, Requirements='regexp("[", TARGET.Name)')
+        self.assertFalse(classad_expr.matches(job, ad(MACHINE_TEXT)))
+        return
+
+
+
+class MatchTest(unittest.TestCase):
+    def machines(self, **extra):
+        res = []
+        for (i, memory) in enumerate((512, 2048, 4096)):
+            machine = ad(MACHINE_TEXT, **extra)
+            machine.Name = u'slot%d@node1.example.com' % (i + 1)
+            machine.Memory = memory
+            machine.KFlops = 1000 * (i + 1)
+            res.append(machine)
+        return(res)
+
+    def test_same_as_matches(self):
+        machines = self.machines()
+        job = ad(JOB_TEXT)
+        found = matchmaking.match(job, machines)
+        self.assertEqual([m.name for (m, r) in found],
+                         ['slot3@node1.example.com', 'slot2@node1.example.com'])
+        self.assertEqual([r for (m, r) in found], [3., 2.])
+        self.assertEqual([m for (m, r) in found],
+                         [m for m in reversed(machines)
+                          if classad_expr.matches(job, m)])
+        return
+
+    def test_unparseable_attributes(self):
+        for text in UNPARSEABLE:
+            job = ad(JOB_TEXT, Rank=text)
+            self.assertEqual([r for (m, r) in matchmaking.match(
+                                  job, self.machines())], [0., 0.])
+
+            job = ad(JOB_TEXT, Requirements=text)
+            self.assertEqual(matchmaking.match(job, self.machines()), [])
+
+            job = ad(JOB_TEXT, Requirements='isError(TARGET.Lists)')
+            machines = self.machines(Lists=text)
+            self.assertEqual(len(matchmaking.match(job, machines)), 2)
+
+            machines = self.machines(Requirements=text)
+            self.assertEqual(matchmaking.match(ad(JOB_TEXT), machines), [])
+        return
+
+    def test_bad_regexp(self):
+        job = ad(JOB_TEXT, Requirements='regexp("(", TARGET.Name)')
+        self.assertEqual(matchmaking.match(job, self.machines()), [])
+        return
+
+
+
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+Tests of the helpers condorutils uses to run Condor commands.
+
+Usage
+    shell> python test/test_condorutils.py
+"""
+import os
+import resource
+import unittest
+
+from owl import condorutils
+
+
+
+
+# Constants
+# Open at least this many files, to get past select() FD_SETSIZE.
+MANY_FILES = 1100
+
+
+
+class IterStdoutTest(unittest.TestCase):
+    def test_lines(self):
+        status = {}
+        lines = condorutils._iter_stdout(['/bin/sh', '-c',
+                                          'echo a; echo b >&2; printf c'],
+                                         5., status)
+        self.assertEqual(list(lines), ['a\n', 'c'])
+        self.assertEqual(status['exit_code'], 0)
+        self.assertEqual(condorutils._run(['/bin/sh', '-c', 'exit 3']), 3)
+        return
+
+    def test_timeout(self):
+        status = {}
+        lines = condorutils._iter_stdout(['/bin/sh', '-c', 'echo a; sleep 5'],
+                                         .5, status)
+        self.assertEqual(list(lines), ['a\n'])
+        self.assertEqual(status['exit_code'], None)
+        return
+
+    def test_many_open_files(self):
+        (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if(soft < MANY_FILES + 10):
+            self.skipTest('cannot open %d files' % (MANY_FILES))
+
+        fds = []
+        try:
+            for _ in range(MANY_FILES):
+                fds.append(os.open(os.devnull, os.O_RDONLY))
+            self.assertEqual(list(condorutils._iter_stdout(['/bin/echo',
+                                                            'a'])), ['a\n'])
+        finally:
+            for fd in fds:
+                os.close(fd)
+        return
+
+
+
+
+if(__name__ == '__main__'):
+    unittest.main()
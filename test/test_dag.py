@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""
+DAG parsing tests.
+
+Usage
+    shell> python test/test_dag.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from owl import classad
+from owl import dag
+
+
+
+
+# Constants
+HERE = os.path.dirname(os.path.abspath(__file__))
+AD_TEXT = open(os.path.join(HERE, 'ad.txt')).read()
+JOB_TEXT = '''Universe = vanilla
+Executable = /bin/echo
+Arguments = "-i raw-$(Process).fits"
+Instances = 3
+Ratio = 0.5
+Flag = TRUE
+Requirements = (Arch == "X86_64") && (Memory > 1024)
+queue 3
+'''
+
+
+
+def typed(attrs):
+    """
+    Return `attrs` with each value paired with its type, so that e.g. 1, 1.0
+    and True do not compare equal and neither do strings and Expressions.
+    """
+    return(dict([(k, (type(v), v)) for (k, v) in attrs.items()]))
+
+
+
+class ParseTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name in 'ABCD':
+            with open(os.path.join(self.directory, name + '.job'), 'w') as f:
+                f.write(JOB_TEXT)
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        return
+
+    def parse(self, dag_text):
+        """
+        Return {node name: (sorted parent names, sorted children names)}.
+        """
+        nodes = dag.DAG.new_from_dag(dag_text, self.directory).nodes
+        return(dict([(n.name, (sorted([p.name for p in n.parents]),
+                               sorted([c.name for c in n.children])))
+                     for n in nodes]))
+
+    def test_relations(self):
+        dag_text = '\n'.join(['JOB A A.job',
+                              'JOB B B.job',
+                              'JOB C C.job',
+                              'JOB D D.job',
+                              '',
+                              'PARENT A CHILD B',
+                              'PARENT A CHILD C',
+                              'PARENT A CHILD C',
+                              'PARENT B C CHILD D'])
+        self.assertEqual(self.parse(dag_text),
+                         {'A': ([], ['B', 'C']),
+                          'B': (['A'], ['D']),
+                          'C': (['A'], ['D']),
+                          'D': (['B', 'C'], [])})
+
+        nodes = dag.DAG.new_from_dag(dag_text, self.directory).nodes
+        self.assertEqual(sorted([n.script for n in nodes]),
+                         [os.path.join(self.directory, name + '.job')
+                          for name in 'ABCD'])
+        self.assertEqual([n.job.Instances for n in nodes], [3, 3, 3, 3])
+        return
+
+    def test_roots(self):
+        dag_text = '\n'.join(['JOB A A.job',
+                              'JOB B B.job',
+                              'JOB C C.job',
+                              'PARENT A CHILD B C'])
+        roots = dag.DAG.new_from_dag(dag_text, self.directory).roots
+        self.assertEqual([n.name for n in roots], ['A'])
+        return
+
+
+
+class ParseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        return
+
+    def test_memory(self):
+        cache = dag.ParseCache(size=2)
+        for text in (AD_TEXT, JOB_TEXT):
+            self.assertEqual(typed(cache.get(text)),
+                             typed(classad._parse(text)))
+        cache.get(AD_TEXT)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2, 'entries': 2})
+
+        # Least recently used entries go first.
+        cache.get('A = 1\n')
+        cache.get(AD_TEXT)
+        cache.get(JOB_TEXT)
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 4, 'entries': 2})
+
+        cache.clear()
+        self.assertEqual(cache.stats()['entries'], 0)
+        return
+
+    def test_disk(self):
+        for text in (AD_TEXT, JOB_TEXT):
+            expected = typed(classad._parse(text))
+            self.assertEqual(typed(dag.ParseCache(
+                directory=self.directory).get(text)), expected)
+
+            # A new cache (e.g. another process) reads the file back.
+            cache = dag.ParseCache(directory=self.directory)
+            self.assertEqual(typed(cache.get(text)), expected)
+            self.assertEqual(cache._load(dag.hashlib.sha1(text).hexdigest()),
+                             classad._parse(text))
+        self.assertEqual(sorted([os.path.splitext(f)[1]
+                                 for f in os.listdir(self.directory)]),
+                         ['.json', '.json'])
+        return
+
+    def test_bad_files(self):
+        cache = dag.ParseCache(directory=self.directory)
+        digest = dag.hashlib.sha1(JOB_TEXT).hexdigest()
+        cache.get(JOB_TEXT)
+
+        with open(cache._path(digest), 'wb') as f:
+            f.write('{"attributes": ')
+        self.assertEqual(cache._load(digest), None)
+        cache.clear()
+        self.assertEqual(typed(cache.get(JOB_TEXT)),
+                         typed(classad._parse(JOB_TEXT)))
+        return
+
+    def test_foreign_files(self):
+        cache = dag.ParseCache(directory=self.directory)
+        digest = dag.hashlib.sha1(JOB_TEXT).hexdigest()
+        cache.get(JOB_TEXT)
+        self.assertNotEqual(cache._load(digest), None)
+
+        # Files written by somebody else are not trusted.
+        getuid = os.getuid
+        os.getuid = lambda: getuid() + 1
+        try:
+            self.assertEqual(cache._load(digest), None)
+        finally:
+            os.getuid = getuid
+        return
+
+    def test_new_job(self):
+        job = dag._new_job(JOB_TEXT)
+        self.assertEqual(job._raw_classad, JOB_TEXT)
+        self.assertEqual(job.Instances, 3)
+        job.Instances = 1
+        self.assertEqual(dag._new_job(JOB_TEXT).Instances, 3)
+        return
+
+
+
+
+if(__name__ == '__main__'):
+    unittest.main()
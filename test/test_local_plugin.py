@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+Local plugin tests: they run small DAGs of shell commands in a temporary
+directory.
+
+Usage
+    shell> python test/test_local_plugin.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from owl.plugins import local_plugin
+
+
+
+
+# Constants
+JOB_TEMPLATE = '''Universe = vanilla
+Executable = /bin/sh
+Arguments = "-c 'echo %(name)s.$(Process) >> log.txt; exit %(exit_code)d'"
+Instances = %(instances)d
+queue %(instances)d
+'''
+
+
+
+class LocalPluginTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+        return
+
+    def submit(self, dag_text, exit_codes=None, instances=None, processes=2):
+        """
+        Write out `dag_text` and one .job file per node, then run it. Node N
+        exits with exit_codes[N] (default 0) and has instances[N] instances
+        (default 1). Return (exit code, log lines).
+        """
+        if(exit_codes is None):
+            exit_codes = {}
+        if(instances is None):
+            instances = {}
+
+        for line in dag_text.split('\n'):
+            if(not line.startswith('JOB')):
+                continue
+            (_, name, script) = line.split()
+            with open(os.path.join(self.work_dir, script), 'w') as f:
+                f.write(JOB_TEMPLATE % {'name': name,
+                                        'exit_code': exit_codes.get(name, 0),
+                                        'instances': instances.get(name, 1)})
+        with open(os.path.join(self.work_dir, 'test.dag'), 'w') as f:
+            f.write(dag_text)
+
+        err = local_plugin.submit('test.dag', self.work_dir, processes)
+        log = []
+        path = os.path.join(self.work_dir, 'log.txt')
+        if(os.path.exists(path)):
+            log = open(path).read().split()
+        return((err, log))
+
+    def assertBefore(self, log, first, then):
+        self.assertTrue(log.index(first) < log.index(then),
+                        '%s ran before %s: %s' % (then, first, log))
+        return
+
+    def test_diamond(self):
+        dag_text = '\n'.join(['JOB A a.job',
+                              'JOB B b.job',
+                              'JOB C c.job',
+                              'JOB D d.job',
+                              'PARENT A CHILD B',
+                              'PARENT A CHILD C',
+                              'PARENT B C CHILD D'])
+        (err, log) = self.submit(dag_text, instances={'B': 3})
+        self.assertEqual(err, 0)
+        self.assertEqual(sorted(log), ['A.0', 'B.0', 'B.1', 'B.2', 'C.0',
+                                       'D.0'])
+        for node in ('B.0', 'B.1', 'B.2', 'C.0'):
+            self.assertBefore(log, 'A.0', node)
+            self.assertBefore(log, node, 'D.0')
+        return
+
+    def test_several_parents(self):
+        dag_text = '\n'.join(['JOB S s.job',
+                              'JOB F f.job',
+                              'JOB C c.job',
+                              'JOB G g.job',
+                              'PARENT S CHILD C',
+                              'PARENT F CHILD C',
+                              'PARENT F CHILD G',
+                              'PARENT F CHILD G'])
+        (err, log) = self.submit(dag_text, processes=1)
+        self.assertEqual(err, 0)
+        self.assertEqual(sorted(log), ['C.0', 'F.0', 'G.0', 'S.0'])
+        self.assertBefore(log, 'S.0', 'C.0')
+        self.assertBefore(log, 'F.0', 'C.0')
+        self.assertBefore(log, 'F.0', 'G.0')
+        return
+
+    def test_failure(self):
+        dag_text = '\n'.join(['JOB A a.job',
+                              'JOB B b.job',
+                              'JOB C c.job',
+                              'PARENT A CHILD B',
+                              'PARENT B CHILD C'])
+        (err, log) = self.submit(dag_text, exit_codes={'B': 3})
+        self.assertEqual(err, 3)
+        self.assertEqual(log, ['A.0', 'B.0'])
+        return
+
+    def test_loop(self):
+        dag_text = '\n'.join(['JOB A a.job',
+                              'JOB B b.job',
+                              'JOB C c.job',
+                              'PARENT A CHILD B',
+                              'PARENT B CHILD A'])
+        (err, log) = self.submit(dag_text)
+        self.assertEqual(err, local_plugin.INCOMPLETE_EXIT_CODE)
+        self.assertEqual(log, ['C.0'])
+        return
+
+    def test_cannot_start(self):
+        dag_text = '\n'.join(['JOB A a.job',
+                              'JOB B b.job',
+                              'PARENT A CHILD B'])
+        with open(os.path.join(self.work_dir, 'a.job'), 'w') as f:
+            f.write('Executable = no_such_executable\n')
+        with open(os.path.join(self.work_dir, 'b.job'), 'w') as f:
+            f.write(JOB_TEMPLATE % {'name': 'B', 'exit_code': 0,
+                                    'instances': 1})
+        with open(os.path.join(self.work_dir, 'test.dag'), 'w') as f:
+            f.write(dag_text)
+        self.assertEqual(local_plugin.submit('test.dag', self.work_dir),
+                         local_plugin.EXEC_FAILED_EXIT_CODE)
+        return
+
+    def test_bad_output(self):
+        with open(os.path.join(self.work_dir, 'in.txt'), 'w') as f:
+            f.write('input\n')
+        with open(os.path.join(self.work_dir, 'a.job'), 'w') as f:
+            f.write('Executable = /bin/cat\n' +
+                    'Input = in.txt\n' +
+                    'Output = no/such/directory/out.txt\n')
+        with open(os.path.join(self.work_dir, 'test.dag'), 'w') as f:
+            f.write('JOB A a.job\n')
+
+        # The files opened before the failing one are closed.
+        opened = []
+        _open = local_plugin._open
+        def tracking_open(*args):
+            f = _open(*args)
+            opened.append(f)
+            return(f)
+        local_plugin._open = tracking_open
+        try:
+            self.assertEqual(local_plugin.submit('test.dag', self.work_dir),
+                             local_plugin.EXEC_FAILED_EXIT_CODE)
+        finally:
+            local_plugin._open = _open
+        self.assertEqual(len(opened), 1)
+        self.assertTrue(opened[0].closed)
+        return
+
+
+
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+"""
+owld tests. They run the daemon in-process, on the loopback interface, and do
+not need a Condor pool: condor_status is replaced by a fake one.
+
+Usage
+    shell> python test/test_owld_api.py
+"""
+import imp
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+owld = imp.load_source('owld', os.path.join(HERE, '..', 'bin', 'owld.py'))
+from owl import classad
+
+
+
+
+# Constants
+HOST = '127.0.0.1'
+PORT = 19998
+TIMEOUT = 10.
+
+# The daemon all the tests talk to (see setUpModule).
+daemon = None
+
+
+
+class Daemon(owld.Daemon):
+    """
+    owld with a couple of extra API methods useful for testing.
+    """
+    def owlapi_sleep(self, seconds):
+        time.sleep(seconds)
+        return(seconds)
+
+    def owlapi_fail(self):
+        raise(RuntimeError('failed on purpose'))
+
+
+def setUpModule():
+    """
+    Start the daemon (in a background thread) once for all the tests.
+    """
+    global daemon
+    owld.condor.send_alive = lambda *args: None
+    logger = logging.getLogger('test_owld_api')
+    logger.addHandler(logging.NullHandler())
+    daemon = Daemon(HOST, PORT, 10, logger, workers=4)
+    thread = threading.Thread(target=daemon.run)
+    thread.daemon = True
+    thread.start()
+    return
+
+
+def fake_condor_status(calls, delay=0.):
+    """
+    Return a fake condor.condor_status appending to `calls` and taking `delay`
+    seconds each time it is called.
+    """
+    def condor_status(timeout=None):
+        calls.append(timeout)
+        time.sleep(delay)
+        return([classad.ClassAd(Name='slot%d@%s' % (slot, host), Machine=host,
+                                Memory=1024 * slot)
+                for host in ('node1.example.com', 'node2.example.com')
+                for slot in (1, 2)])
+    return(condor_status)
+
+
+def connect():
+    sock = socket.create_connection((HOST, PORT), TIMEOUT)
+    return((sock, sock.makefile()))
+
+
+def send(sock, message):
+    sock.sendall(json.dumps(message) + '\n')
+    return
+
+
+
+class PipeliningTest(unittest.TestCase):
+    def test_out_of_order_replies(self):
+        (sock, f) = connect()
+        send(sock, {'id': 'slow', 'command': ['sleep', .5]})
+        for i in range(20):
+            send(sock, {'id': i, 'command': ['echo', i * 2]})
+
+        replies = [json.loads(f.readline()) for _ in range(21)]
+        # The slow command does not hold up the others.
+        self.assertEqual(replies[-1], {'id': 'slow', 'result': .5})
+        self.assertEqual(sorted([r['id'] for r in replies[:-1]]), range(20))
+        for reply in replies[:-1]:
+            self.assertEqual(reply['result'], reply['id'] * 2)
+
+        # The connection stays open.
+        send(sock, {'id': [1, 'x'], 'command': ['echo', 'again']})
+        self.assertEqual(json.loads(f.readline()),
+                         {'id': [1, 'x'], 'result': 'again'})
+        sock.close()
+        return
+
+    def test_errors(self):
+        (sock, f) = connect()
+        send(sock, {'id': 1, 'command': 5})
+        reply = json.loads(f.readline())
+        self.assertEqual(reply['id'], 1)
+        self.assertTrue(reply['result'].startswith('Warning'))
+
+        send(sock, {'id': 2, 'command': ['no_such_method']})
+        reply = json.loads(f.readline())
+        self.assertEqual(reply['id'], 2)
+        self.assertTrue(reply['result'].startswith('Warning'))
+
+        send(sock, {'id': 3, 'command': ['fail']})
+        self.assertEqual(json.loads(f.readline()), {'id': 3, 'result': None})
+        sock.close()
+        return
+
+    def test_legacy_requests(self):
+        (sock, f) = connect()
+        send(sock, ['echo', 'legacy'])
+        self.assertEqual(json.loads(f.readline()), 'legacy')
+        # Plain requests still close the connection.
+        self.assertEqual(f.readline(), '')
+        sock.close()
+        return
+
+    def test_many_clients(self):
+        results = {}
+        def client(n):
+            (sock, f) = connect()
+            for i in range(10):
+                send(sock, {'id': i, 'command': ['echo', n]})
+            results[n] = set([json.loads(f.readline())['result']
+                              for _ in range(10)])
+            sock.close()
+        threads = [threading.Thread(target=client, args=(n, ))
+                   for n in range(8)]
+        [t.start() for t in threads]
+        [t.join(TIMEOUT) for t in threads]
+        self.assertEqual(results, dict([(n, set([n])) for n in range(8)]))
+        return
+
+
+
+class ResourcesTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self._condor_status = owld.condor.condor_status
+        owld.condor.condor_status = fake_condor_status(self.calls)
+        daemon.cache = owld.CondorCache(ttl=60.)
+        return
+
+    def tearDown(self):
+        owld.condor.condor_status = self._condor_status
+        return
+
+    def test_get_info(self):
+        info = daemon.owlapi_resources_get_info('slot2@node1.example.com')
+        self.assertEqual(info['memory'], 2048)
+        # Host names give their first slot.
+        info = daemon.owlapi_resources_get_info('node2.example.com')
+        self.assertEqual(info['name'], 'slot1@node2.example.com')
+        self.assertEqual(daemon.owlapi_resources_get_info('nope'), None)
+        self.assertEqual(daemon.owlapi_resources_get_info(None), None)
+        return
+
+    def test_get_info_many(self):
+        names = ['slot2@node1.example.com', 'node2.example.com', 'nope']
+        many = daemon.owlapi_resources_get_info_many(names)
+        self.assertEqual(many, dict([(name,
+                                      daemon.owlapi_resources_get_info(name))
+                                     for name in names]))
+        self.assertEqual(many['node2.example.com']['name'],
+                         'slot1@node2.example.com')
+        self.assertEqual(daemon.owlapi_resources_get_info_many([]), {})
+        self.assertEqual(len(self.calls), 1)
+        return
+
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self._condor_status = owld.condor.condor_status
+        owld.condor.condor_status = fake_condor_status(self.calls, delay=.2)
+        return
+
+    def tearDown(self):
+        owld.condor.condor_status = self._condor_status
+        return
+
+    def test_concurrent_misses(self):
+        daemon.cache = owld.CondorCache(ttl=60.)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+                       daemon.owlapi_resources_get_list()))
+                   for _ in range(10)]
+        [t.start() for t in threads]
+        [t.join(TIMEOUT) for t in threads]
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(len(results), 10)
+        self.assertTrue(all([r == results[0] for r in results]))
+        self.assertEqual(len(results[0]), 4)
+
+        stats = daemon.owlapi_resources_get_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (9, 1))
+        return
+
+    def test_expiration(self):
+        daemon.cache = owld.CondorCache(ttl=.3)
+        daemon.owlapi_resources_get_list()
+        daemon.owlapi_resources_get_info('node1.example.com')
+        self.assertEqual(len(self.calls), 1)
+        time.sleep(.4)
+        daemon.owlapi_resources_get_list()
+        self.assertEqual(len(self.calls), 2)
+        return
+
+    def test_disabled(self):
+        daemon.cache = owld.CondorCache(ttl=0)
+        daemon.owlapi_resources_get_list()
+        daemon.owlapi_resources_get_list()
+        self.assertEqual(len(self.calls), 2)
+        return
+
+    def test_errors_not_cached(self):
+        error = [classad.ClassAd(Name=owld.condor.STATUS_ERROR_NAME)]
+        owld.condor.condor_status = lambda timeout=None: \
+                                    self.calls.append(timeout) or error
+        daemon.cache = owld.CondorCache(ttl=60.)
+        daemon.owlapi_resources_get_list()
+        daemon.owlapi_resources_get_list()
+        self.assertEqual(len(self.calls), 2)
+        return
+
+    def test_over_the_wire(self):
+        daemon.cache = owld.CondorCache(ttl=60.)
+        (sock, f) = connect()
+        send(sock, {'id': 1, 'command': ['resources_get_list']})
+        send(sock, {'id': 2, 'command': ['resources_get_cache_stats']})
+        replies = dict([(r['id'], r['result'])
+                        for r in [json.loads(f.readline()) for _ in range(2)]])
+        self.assertEqual(len(replies[1]), 4)
+        self.assertEqual(replies[2]['ttl'], 60.)
+        sock.close()
+        return
+
+
+
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+ClusterIdCache tests. They use a fake keymaster client instead of talking to
+the broker, but still need the pika module to import spread_keyclient and are
+skipped otherwise.
+
+Usage
+    shell> python test/test_spread_keyclient.py
+"""
+import threading
+import unittest
+
+try:
+    from owl.plugins import spread_keyclient
+except ImportError:
+    spread_keyclient = None
+
+
+
+
+# Constants
+FIRST_ID = 1001
+
+
+
+class Reply(object):
+    def __init__(self, body):
+        self.body = body
+        return
+
+    def result(self):
+        return(self.body)
+
+
+class FakeKeymaster(object):
+    """
+    Fake KeyClient handing out contiguous ClusterIds like the keymaster does.
+    """
+    def __init__(self):
+        self.requests = []
+        self._next = FIRST_ID
+        self._lock = threading.Lock()
+        return
+
+    def call_async(self, body):
+        (command, n) = body.split()
+        with self._lock:
+            self.requests.append(int(n))
+            first = self._next
+            self._next += int(n)
+        return(Reply(str(first)))
+
+
+
+@unittest.skipIf(spread_keyclient is None, 'pika is not installed')
+class ClusterIdCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.keymaster = FakeKeymaster()
+        self.cache = spread_keyclient.ClusterIdCache(block_size=10,
+                                                     client=self.keymaster)
+        return
+
+    def test_blocks(self):
+        self.assertEqual(self.cache.take(), [FIRST_ID])
+        self.assertEqual(self.keymaster.requests, [10])
+        self.assertEqual(self.cache.take(3), range(FIRST_ID + 1, FIRST_ID + 4))
+        self.assertEqual(self.keymaster.requests, [10])
+
+        # Past half a block, the next one is requested ahead of time.
+        self.cache.take(2)
+        self.assertEqual(self.keymaster.requests, [10, 10])
+        self.assertEqual(self.cache.take(4),
+                         range(FIRST_ID + 6, FIRST_ID + 10))
+        self.assertEqual(self.cache.take(), [FIRST_ID + 10])
+        self.assertEqual(self.keymaster.requests, [10, 10])
+        return
+
+    def test_large_requests(self):
+        ids = self.cache.take(25)
+        self.assertEqual(ids, range(FIRST_ID, FIRST_ID + 25))
+        self.assertEqual(self.keymaster.requests, [25, 10])
+        self.assertEqual(self.cache.take(0), [])
+        # The prefetched block is used first, then a new one is leased. Half
+        # of it is left: no need to prefetch yet.
+        self.assertEqual(self.cache.take(15), range(FIRST_ID + 25,
+                                                    FIRST_ID + 40))
+        self.assertEqual(self.keymaster.requests, [25, 10, 10])
+        return
+
+    def test_threads(self):
+        results = []
+        def take():
+            for n in range(1, 8):
+                results.append(self.cache.take(n))
+        threads = [threading.Thread(target=take) for _ in range(8)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+
+        ids = [i for r in results for i in r]
+        self.assertEqual(len(ids), 8 * 28)
+        self.assertEqual(len(set(ids)), len(ids))
+        # Nothing is leased twice and only a few ids are left over.
+        leased = sum(self.keymaster.requests)
+        self.assertEqual(set(ids) - set(range(FIRST_ID, FIRST_ID + leased)),
+                         set())
+        self.assertTrue(leased - len(ids) <= 2 * self.cache.block_size)
+        return
+
+
+
+
+if(__name__ == '__main__'):
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+Spread plugin DAG execution tests. Nodes are not sent to spread: each one
+completes as soon as it is dispatched.
+
+They need the spread and pika modules (and owld.py in $PATH) to import the
+plugin and are skipped otherwise.
+
+Usage
+    shell> python test/test_spread_plugin.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from owl.plugins import spread_plugin
+except Exception:
+    spread_plugin = None
+
+
+
+
+# Constants
+JOB_TEXT = '''Universe = vanilla
+Executable = /bin/true
+Arguments = "$(Process)"
+Instances = 2
+queue 2
+'''
+
+
+
+class Promise(object):
+    def __init__(self, exit_code):
+        self.exit_code = exit_code
+        return
+
+    def is_ready(self):
+        return(True)
+
+    def wait(self):
+        return
+
+    def result(self):
+        return({'terminated': False, 'exit_code': self.exit_code})
+
+
+
+@unittest.skipIf(spread_plugin is None, 'the spread plugin is not available')
+class ExecuteTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.dispatched = []
+        self.exit_codes = {}
+        self._enqueue = spread_plugin._enqueue
+        spread_plugin._enqueue = self.enqueue
+        return
+
+    def tearDown(self):
+        spread_plugin._enqueue = self._enqueue
+        shutil.rmtree(self.work_dir)
+        return
+
+    def enqueue(self, nodes, work_dir):
+        """
+        Fake spread_plugin._enqueue: record which nodes were dispatched.
+        """
+        running = []
+        for node in nodes:
+            self.dispatched.append(node.name)
+            promise = Promise(self.exit_codes.get(node.name, 0))
+            running.append([(promise, node)
+                            for _ in range(node.job.Instances)])
+        return(running)
+
+    def execute(self, lines):
+        for line in lines:
+            if(line.startswith('JOB')):
+                with open(os.path.join(self.work_dir, line.split()[2]),
+                          'w') as f:
+                    f.write(JOB_TEXT)
+        dag = spread_plugin.DAG.new_from_dag('\n'.join(lines), self.work_dir)
+        return(dag.execute(self.work_dir))
+
+    def test_several_parents(self):
+        err = self.execute(['JOB S s.job',
+                            'JOB F f.job',
+                            'JOB C c.job',
+                            'JOB G g.job',
+                            'PARENT S CHILD C',
+                            'PARENT F CHILD C',
+                            'PARENT F CHILD G'])
+        self.assertEqual(err, 0)
+        self.assertEqual(sorted(self.dispatched), ['C', 'F', 'G', 'S'])
+        for (parent, child) in (('S', 'C'), ('F', 'C'), ('F', 'G')):
+            self.assertTrue(self.dispatched.index(parent) <
+                            self.dispatched.index(child))
+        return
+
+    def test_failure(self):
+        self.exit_codes['B'] = 2
+        err = self.execute(['JOB A a.job',
+                            'JOB B b.job',
+                            'JOB C c.job',
+                            'PARENT A CHILD B',
+                            'PARENT B CHILD C'])
+        self.assertEqual(err, 2)
+        self.assertEqual(self.dispatched, ['A', 'B'])
+        return
+
+    def test_loop(self):
+        err = self.execute(['JOB A a.job',
+                            'JOB B b.job',
+                            'JOB C c.job',
+                            'PARENT A CHILD B',
+                            'PARENT B CHILD A'])
+        self.assertEqual(err, spread_plugin.INCOMPLETE_EXIT_CODE)
+        self.assertEqual(self.dispatched, ['C'])
+        return
+
+
+
+
+if(__name__ == '__main__'):
+    unittest.main()
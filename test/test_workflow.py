@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""
+Workflow template rendering tests.
+
+Usage
+    shell> python test/test_workflow.py
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import jinja2.bccache
+
+from owl import workflow
+from owl.workflow import Workflow
+
+
+
+
+# Constants
+DAG_TEXT = 'JOB A a.job\n'
+JOB_TEXT = 'Executable = {{ code_root }}/bin/a\nArguments = {{ dataset }}\n'
+
+
+
+class SharedTest(unittest.TestCase):
+    def setUp(self):
+        self.template_root = tempfile.mkdtemp()
+        self.work_dir = tempfile.mkdtemp()
+        self.write('a.dag', DAG_TEXT)
+        self.write('a.job', JOB_TEXT)
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.template_root)
+        shutil.rmtree(self.work_dir)
+        return
+
+    def write(self, name, text):
+        path = os.path.join(self.template_root, name)
+        mtime = None
+        if(os.path.exists(path)):
+            mtime = os.path.getmtime(path)
+        with open(path, 'w') as f:
+            f.write(text)
+        if(mtime is not None):
+            # Make sure the change is visible even on coarse file systems.
+            os.utime(path, (time.time(), mtime + 2))
+        return
+
+    def render(self, dataset):
+        wflow = Workflow.shared(self.template_root, None)
+        (dag_name, _) = wflow._render('/code', '/repo', dataset, self.work_dir,
+                                      'condor', {})
+        self.assertEqual(dag_name, 'a_%s.dag' % (dataset))
+        return(sorted(os.listdir(self.work_dir)))
+
+    def read(self, name):
+        return(open(os.path.join(self.work_dir, name)).read())
+
+    def test_shared(self):
+        self.assertTrue(Workflow.shared(self.template_root, None) is
+                        Workflow.shared(self.template_root, None))
+        return
+
+    def test_templates_change(self):
+        self.assertEqual(self.render('d1'), ['a_d1.dag', 'a_d1.job'])
+        self.assertEqual(self.read('a_d1.job'),
+                         'Executable = /code/bin/a\nArguments = d1\n')
+
+        # The shared Workflow picks up changed and new templates.
+        self.write('a.job', 'Arguments = {{ dataset }} again\n')
+        self.write('b.job', 'Executable = /bin/b\n')
+        self.assertEqual(self.render('d2'), ['a_d1.dag', 'a_d1.job',
+                                             'a_d2.dag', 'a_d2.job',
+                                             'b_d2.job'])
+        self.assertEqual(self.read('a_d2.job'), 'Arguments = d2 again\n')
+        return
+
+    def test_no_dag(self):
+        os.remove(os.path.join(self.template_root, 'a.dag'))
+        self.assertRaises(NotImplementedError, Workflow, self.template_root,
+                          None)
+        return
+
+
+class ExecuteManyTest(unittest.TestCase):
+    def setUp(self):
+        self.template_root = tempfile.mkdtemp()
+        with open(os.path.join(self.template_root, 'a.dag'), 'w') as f:
+            f.write('JOB A a_{{ dataset }}.job\n')
+        with open(os.path.join(self.template_root, 'a.job'), 'w') as f:
+            f.write('Executable = /bin/sh\n' +
+                    'Arguments = "-c \'echo {{ dataset }} > out.txt\'"\n')
+        self.work_dirs = []
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.template_root)
+        for work_dir in self.work_dirs:
+            shutil.rmtree(work_dir)
+        return
+
+    def test_generator(self):
+        datasets = ['d%d' % (i) for i in range(5)]
+        for processes in (1, 3):
+            results = Workflow(self.template_root, None).execute_many(
+                (d for d in datasets), '/code', '/repo', flavour='local',
+                processes=processes)
+            self.work_dirs += [r['work_dir'] for r in results]
+            self.assertEqual([r['dataset'] for r in results], datasets)
+            for result in results:
+                self.assertEqual((result['error'], result['job_id']),
+                                 (None, 0))
+                path = os.path.join(result['work_dir'], 'out.txt')
+                self.assertEqual(open(path).read(), result['dataset'] + '\n')
+
+        self.assertEqual(Workflow(self.template_root, None).execute_many(
+            iter([]), '/code', '/repo', flavour='local'), [])
+        return
+
+
+
+class BytecodeCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.template_root = tempfile.mkdtemp()
+        self.template_cache = tempfile.mkdtemp()
+        with open(os.path.join(self.template_root, 'a.dag'), 'w') as f:
+            f.write(DAG_TEXT)
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.template_root)
+        shutil.rmtree(self.template_cache)
+        return
+
+    def bucket(self, cache):
+        """
+        Return the bytecode cache bucket of a.dag, as loaded from `cache`.
+        """
+        path = os.path.join(self.template_root, 'a.dag')
+        env = workflow._get_environment(self.template_root,
+                                        self.template_cache)
+        bucket = jinja2.bccache.Bucket(env, cache.get_cache_key('a.dag', path),
+                                       cache.get_source_checksum(DAG_TEXT))
+        cache.load_bytecode(bucket)
+        return(bucket)
+
+    def test_per_user(self):
+        Workflow(self.template_root, self.template_cache)
+        directory = os.path.join(self.template_cache, str(os.getuid()))
+        self.assertEqual(os.stat(directory).st_mode & 0777, 0700)
+        self.assertTrue(os.listdir(directory))
+
+        cache = workflow._BytecodeCache(directory)
+        self.assertNotEqual(self.bucket(cache).code, None)
+        return
+
+    def test_foreign_files(self):
+        Workflow(self.template_root, self.template_cache)
+        directory = os.path.join(self.template_cache, str(os.getuid()))
+        cache = workflow._BytecodeCache(directory)
+
+        # Bytecode written by somebody else is not loaded and directories
+        # created by somebody else are not used.
+        getuid = os.getuid
+        os.getuid = lambda: getuid() + 1
+        try:
+            self.assertEqual(self.bucket(cache).code, None)
+            os.mkdir(os.path.join(self.template_cache, str(os.getuid())))
+            self.assertEqual(workflow._user_directory(self.template_cache),
+                             None)
+        finally:
+            os.getuid = getuid
+        self.assertEqual(workflow._user_directory(self.template_cache),
+                         directory)
+        return
+
+
+
+
+if(__name__ == '__main__'):
+    unittest.main()